@@ -1,21 +1,47 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Request, Header
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
 from email_validator import validate_email, EmailNotValidError # type: ignore[import-untyped]
-import aiosmtplib # type: ignore[import-untyped]
 from uuid import uuid4
 
+from . import mail_queue
 from .config import settings
 from .database import get_db
 from .models import User
 from .schemas import TokenData
 
-# Password hashing context using bcrypt
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# Password hashing context using bcrypt. Hashes made with another cost than
+# BCRYPT_ROUNDS are reported as needing an update, so logins rehash them.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# bcrypt deliberately burns 100-300 ms of CPU per call, so request handlers run it
+# on this bounded pool instead of the event loop (bcrypt releases the GIL).
+# At most PASSWORD_HASH_MAX_PENDING calls may be queued or running; further
+# requests are rejected with 503 instead of piling up.
+_password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+_password_metrics_lock = threading.Lock()
+_password_metrics = {
+    "pending": 0,          # Calls queued or running
+    "completed": 0,
+    "rejected": 0,         # Refused because PASSWORD_HASH_MAX_PENDING was reached
+    "total_seconds": 0.0,  # Time spent hashing/verifying (excluding queueing)
+    "max_seconds": 0.0,
+    "rehashed": 0,         # Hashes upgraded to the configured cost on login
+}
 
 # OAuth2PasswordBearer for token extraction from headers
 # Explicitly define tokenUrl to the *absolute* path of your token endpoint
@@ -25,6 +51,60 @@ oauth2_scheme = OAuth2PasswordBearer(
 )
 
 
+# Authenticated user cache: token subject (username) -> (column values, cached at).
+# Saves the users query of get_current_user on every authenticated request; entries
+# are dropped when the user row is updated or deleted through the ORM in this
+# process, and expire after settings.USER_CACHE_TTL_SECONDS otherwise.
+_user_cache: Dict[str, Tuple[Dict, float]] = {}
+_user_cache_lock = threading.Lock()
+USER_CACHE_MAX_ENTRIES = 10000
+
+
+def invalidate_cached_user(username: Optional[str] = None):
+    """Drop a user (or every user, if None) from the authenticated user cache."""
+    with _user_cache_lock:
+        if username is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(username, None)
+
+
+@event.listens_for(User.username, "set", active_history=True)
+def _load_old_username(target, value, oldvalue, initiator):
+    """No-op, registered for active_history: a rename keeps the old username in the history."""
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user_on_change(mapper, connection, target):
+    invalidate_cached_user(target.username)
+    # A renamed user is still cached under its old username
+    for old_username in sa_inspect(target).attrs.username.history.deleted:
+        invalidate_cached_user(old_username)
+
+
+def _get_user_by_username(db: Session, username: str) -> Optional[User]:
+    """
+    Load a user by username, from the authenticated user cache when possible.
+    Cached users are attached to `db` without a query, so they can be modified and committed.
+    """
+    ttl = settings.USER_CACHE_TTL_SECONDS
+    cached = _user_cache.get(username)
+    if cached and time.time() - cached[1] < ttl:
+        user = User(**cached[0])
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+
+    user = db.query(User).filter(User.username == username).first()
+    if user is not None and ttl > 0:
+        values = {attr.key: getattr(user, attr.key) for attr in sa_inspect(User).column_attrs}
+        with _user_cache_lock:
+            if len(_user_cache) >= USER_CACHE_MAX_ENTRIES:
+                _user_cache.clear()
+            _user_cache[username] = (values, time.time())
+    return user
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verifies if a plain password matches a hashed password.
@@ -39,6 +119,62 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def get_password_hash_metrics() -> Dict:
+    """Snapshot of the password hashing pool counters."""
+    with _password_metrics_lock:
+        metrics = dict(_password_metrics)
+    metrics["workers"] = settings.PASSWORD_HASH_WORKERS
+    metrics["max_pending"] = settings.PASSWORD_HASH_MAX_PENDING
+    return metrics
+
+
+def _timed(func, *args):
+    start_time = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        with _password_metrics_lock:
+            _password_metrics["total_seconds"] += elapsed
+            _password_metrics["max_seconds"] = max(_password_metrics["max_seconds"], elapsed)
+
+
+async def _run_password_task(func, *args):
+    """Run a bcrypt call on the password pool, rejecting it if too many are pending."""
+    with _password_metrics_lock:
+        if _password_metrics["pending"] >= settings.PASSWORD_HASH_MAX_PENDING:
+            _password_metrics["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password operations, please retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+        _password_metrics["pending"] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_password_executor, _timed, func, *args)
+    finally:
+        with _password_metrics_lock:
+            _password_metrics["pending"] -= 1
+            _password_metrics["completed"] += 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password on the password pool.
+    Returns (matches, new_hash); new_hash is set when the stored hash should be
+    replaced because it was made with another cost than BCRYPT_ROUNDS.
+    """
+    return await _run_password_task(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    Hashes a plain password on the password pool.
+    """
+    return await _run_password_task(pwd_context.hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Creates a JWT access token.
@@ -57,13 +193,22 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+async def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
     """
     Authenticates a user by username and password.
+    Hashes made with an outdated bcrypt cost are transparently replaced.
     """
     user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        return None
+    matches, new_hash = await verify_password_async(password, user.hashed_password)
+    if not matches:
         return None
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+        with _password_metrics_lock:
+            _password_metrics["rehashed"] += 1
     return user
 
 
@@ -75,8 +220,6 @@ async def get_current_user(
     Dependency to get the current authenticated user from a JWT token.
     Raises HTTPException if the token is invalid or user not found/inactive.
     """
-    print("--- Entering get_current_user (Manual Header Extraction) ---")
-
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -84,50 +227,60 @@ async def get_current_user(
     )
 
     if authorization is None:
-        print("Authorization header is missing.")
+        logger.debug("Authorization header is missing")
         raise credentials_exception
 
     try:
         scheme, token = authorization.split()
         if scheme.lower() != "bearer":
-            print(f"Authorization scheme is not 'Bearer': {scheme}")
+            logger.debug("Authorization scheme is not 'Bearer': %s", scheme)
             raise credentials_exception
     except ValueError:
-        print(f"Authorization header malformed: {authorization}")
+        # Never log the header itself, it carries the credentials
+        logger.debug("Authorization header malformed")
         raise credentials_exception
 
     try:
-        print(f"Received token in get_current_user: {token}")
-
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
         )
         username: str = payload.get("sub")
         if username is None:
-            print("JWT payload 'sub' (username) is None.")
+            logger.debug("JWT payload 'sub' (username) is None")
             raise credentials_exception
         token_data = TokenData(username=username)
     except JWTError as e:
-        print(f"JWT Error during token decoding: {e}")
+        logger.debug("JWT error during token decoding: %s", e)
         raise credentials_exception
     except Exception as e:
-        print(f"Unexpected error in get_current_user: {e}")
+        logger.exception("Unexpected error in get_current_user")
         raise credentials_exception
 
 
-    user = db.query(User).filter(User.username == token_data.username).first()
+    user = _get_user_by_username(db, token_data.username)
     if user is None:
-        print(f"User with username '{token_data.username}' not found in DB.")
+        logger.info("User '%s' of a valid token not found in DB", token_data.username)
         raise credentials_exception
     if not user.is_active:
-        print(f"User '{token_data.username}' is inactive.")
+        logger.info("User '%s' is inactive", token_data.username)
         raise HTTPException(status_code=400, detail="Inactive user")
     return user
 
 
+async def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """
+    Dependency for admin endpoints: the current user must be listed in settings.ADMIN_USERNAMES.
+    """
+    if current_user.username not in settings.ADMIN_USERNAMES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required"
+        )
+    return current_user
+
+
 async def send_password_reset_email(email: str, reset_token: str):
     """
-    Sends a password reset email to the user.
+    Queues a password reset email to the user.
     """
     try:
         validate_email(email)
@@ -160,13 +313,10 @@ Thanks,
 """
 
     try:
-        async with aiosmtplib.SMTP(
-            hostname=settings.SMTP_SERVER, port=settings.SMTP_PORT, start_tls=True
-        ) as client:
-            await client.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
-            await client.sendmail(sender_email_address, email, message)
+        # Delivered by the background mail queue, the request does not wait for the SMTP server
+        mail_queue.enqueue(sender_email_address, email, message)
     except Exception as e:
-        print(f"Error sending email: {e}")
+        logger.error("Error queueing email: %s", e)
         raise HTTPException(
             status_code=500,
             detail="Failed to send password reset email. Please try again later.",
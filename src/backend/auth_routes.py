@@ -15,8 +15,7 @@ from .schemas import (
     ResetPasswordRequest,
 )
 from .auth import (
-    get_password_hash,
-    verify_password,
+    get_password_hash_async,
     create_access_token,
     send_password_reset_email,
     generate_reset_token,
@@ -55,7 +54,7 @@ async def signup(user: UserCreate, db: Session = Depends(get_db)):
         )
 
     # Hash the user's password
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
 
     # Create a new User object, including the username
     new_user = User(
@@ -96,7 +95,7 @@ async def login_for_access_token(
     - Verifies username and password.
     - Generates a JWT token.
     """
-    user = authenticate_user(db, user_login.username, user_login.password)
+    user = await authenticate_user(db, user_login.username, user_login.password)
 
     if not user:
         raise HTTPException(
@@ -189,7 +188,7 @@ async def reset_password(request: ResetPasswordRequest, db: Session = Depends(ge
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired token."
         )
 
-    user.hashed_password = get_password_hash(request.new_password)
+    user.hashed_password = await get_password_hash_async(request.new_password)
     user.reset_token = None
     user.reset_token_expires_at = None
 
@@ -0,0 +1,309 @@
+"""
+Layer catalog operations for the Data Explorer.
+
+The catalog (tables of the 'layers' schema with their columns, geometry type,
+SRID and feature count) is read from the PostgreSQL system catalogs in a single
+query instead of per-table inspection, SRID probes and COUNT(*) scans:
+
+- feature counts come from the planner statistics (pg_class.reltuples)
+- geometry type and SRID come from geometry_columns
+- columns, defaults, primary keys and comments come from pg_attribute and friends
+
+Exact counts are optional: they are computed in the background and served
+from memory once available (see `refresh_exact_counts`).
+
+The catalog changes rarely, so `get_catalog_snapshot` keeps the serialized JSON
+(and its ETag) in memory. It is rebuilt only when the DDL version of the
+'layers' schema changes (checked at most every
+`settings.CATALOG_VERSION_CHECK_SECONDS`) or after `settings.CATALOG_CACHE_TTL_SECONDS`.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+from .config import settings
+from .database import get_db_connection
+from .server_timing import ServerTiming
+
+logger = logging.getLogger(__name__)
+
+# Seconds before an exact count is considered stale and recomputed
+EXACT_COUNT_TTL_SECONDS = 300
+
+# A failed count is retried after EXACT_COUNT_RETRY_SECONDS, doubled on every
+# consecutive failure up to EXACT_COUNT_MAX_RETRY_SECONDS
+EXACT_COUNT_RETRY_SECONDS = 60
+EXACT_COUNT_MAX_RETRY_SECONDS = 3600
+
+# table -> (exact row count, computed at)
+_exact_counts: Dict[str, Tuple[int, float]] = {}
+# table -> (consecutive failures, time before which the count is not retried)
+_count_failures: Dict[str, Tuple[int, float]] = {}
+_counts_in_progress = set()
+_counts_lock = threading.Lock()
+
+CATALOG_QUERY = text("""
+    SELECT
+        c.relname AS table_name,
+        c.reltuples::bigint AS estimated_count,
+        gc.type AS geometry_type,
+        gc.srid AS srid,
+        a.attname AS column_name,
+        format_type(a.atttypid, a.atttypmod) AS column_type,
+        NOT a.attnotnull AS nullable,
+        pg_get_expr(d.adbin, d.adrelid) AS column_default,
+        pk.indrelid IS NOT NULL AS primary_key,
+        (a.attidentity <> '' OR COALESCE(pg_get_expr(d.adbin, d.adrelid), '') LIKE 'nextval(%') AS autoincrement,
+        col_description(c.oid, a.attnum) AS comment
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+    LEFT JOIN pg_index pk ON pk.indrelid = c.oid AND pk.indisprimary AND a.attnum = ANY(pk.indkey)
+    -- Prefer the original geometry column over the pre-simplified geom_z_* levels
+    LEFT JOIN LATERAL (
+        SELECT g.type, g.srid
+        FROM geometry_columns g
+        WHERE g.f_table_schema = n.nspname AND g.f_table_name = c.relname
+        ORDER BY g.f_geometry_column LIKE 'geom\\_z\\_%', g.f_geometry_column
+        LIMIT 1
+    ) gc ON true
+    WHERE n.nspname = 'layers' AND c.relkind IN ('r', 'p')
+    -- Byte order, so catalog order matches the name comparison used by pagination cursors
+    ORDER BY c.relname COLLATE "C", a.attnum
+""")
+
+
+# Fingerprint of the 'layers' schema DDL. Creating, dropping, renaming or altering
+# a table rewrites its pg_class / pg_attribute rows, which changes their xmin.
+CATALOG_VERSION_QUERY = text("""
+    SELECT md5(COALESCE(string_agg(
+        c.oid::text || ':' || c.xmin::text || ':' || a.max_xmin,
+        ',' ORDER BY c.oid
+    ), ''))
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    CROSS JOIN LATERAL (
+        SELECT max(pa.xmin::text::bigint)::text AS max_xmin
+        FROM pg_attribute pa
+        WHERE pa.attrelid = c.oid
+    ) a
+    WHERE n.nspname = 'layers' AND c.relkind IN ('r', 'p')
+""")
+
+
+class CatalogSnapshot(NamedTuple):
+    tables: List[Dict]  # Catalog as returned by get_layers_catalog
+    body: bytes         # Serialized JSON response
+    etag: str           # Quoted ETag of `body`
+    version: str        # Schema version the snapshot was built from
+    built_at: float
+
+
+# use_exact_counts -> CatalogSnapshot
+_snapshots: Dict[bool, CatalogSnapshot] = {}
+_snapshot_lock = threading.Lock()
+_schema_version: Optional[str] = None
+_version_checked_at = 0.0
+
+
+def _get_exact_count(table: str) -> Optional[int]:
+    cached = _exact_counts.get(table)
+    if cached and time.time() - cached[1] <= EXACT_COUNT_TTL_SECONDS:
+        return cached[0]
+    return None
+
+
+def get_layers_catalog(use_exact_counts: bool = False) -> List[Dict]:
+    """
+    Return the catalog of the 'layers' schema as a list of dicts matching `TableSchema`.
+
+    Feature counts are planner estimates (None for tables never analyzed). With
+    `use_exact_counts`, exact counts already computed by `refresh_exact_counts`
+    are used instead, and `feature_count_exact` tells which counts are exact.
+    """
+    with get_db_connection() as conn:
+        rows = conn.execute(CATALOG_QUERY).fetchall()
+
+    tables: Dict[str, Dict] = {}
+    for row in rows:
+        table = tables.get(row.table_name)
+        if table is None:
+            # reltuples is -1 (PostgreSQL 14+) for tables that were never vacuumed or analyzed
+            feature_count = row.estimated_count if row.estimated_count >= 0 else None
+            exact_count = _get_exact_count(row.table_name) if use_exact_counts else None
+            table = {
+                "name": row.table_name,
+                "columns": [],
+                "geometry_type": row.geometry_type,
+                "srid": row.srid,
+                "feature_count": exact_count if exact_count is not None else feature_count,
+                "feature_count_exact": exact_count is not None,
+            }
+            tables[row.table_name] = table
+        table["columns"].append({
+            "name": row.column_name,
+            "type": row.column_type,
+            "nullable": row.nullable,
+            "default": row.column_default,
+            "primary_key": row.primary_key,
+            "autoincrement": row.autoincrement,
+            "comment": row.comment,
+        })
+    return list(tables.values())
+
+
+def refresh_exact_counts(table_names: List[str]):
+    """
+    Compute exact row counts for the given tables and keep them in memory.
+    Meant to run as a background task; tables already being counted, or whose
+    last count failed less than their retry delay ago, are skipped.
+    """
+    now = time.time()
+    with _counts_lock:
+        pending = [
+            table for table in table_names
+            if table not in _counts_in_progress and _count_failures.get(table, (0, 0.0))[1] <= now
+        ]
+        _counts_in_progress.update(pending)
+
+    try:
+        # Full scans run on the read pool (a replica if configured), never on the CRUD pool
+        with get_db_connection() as conn:
+            for table in pending:
+                try:
+                    with conn.begin():
+                        # The read pool's statement_timeout is meant for tiles, not full scans
+                        conn.execute(
+                            text("SELECT set_config('statement_timeout', :timeout, true)"),
+                            {"timeout": str(settings.CATALOG_EXACT_COUNT_TIMEOUT_MS)},
+                        )
+                        count = conn.execute(
+                            text(f'SELECT COUNT(*) FROM layers."{table}"')
+                        ).scalar()
+                    _exact_counts[table] = (count, time.time())
+                    _count_failures.pop(table, None)
+                except Exception as e:
+                    failures = _count_failures.get(table, (0, 0.0))[0] + 1
+                    retry_seconds = min(EXACT_COUNT_RETRY_SECONDS * 2 ** (failures - 1), EXACT_COUNT_MAX_RETRY_SECONDS)
+                    _count_failures[table] = (failures, time.time() + retry_seconds)
+                    logger.warning(
+                        "Error counting rows of layers.%s (failure %d, retrying in %ds): %s",
+                        table, failures, retry_seconds, e,
+                    )
+    finally:
+        with _counts_lock:
+            _counts_in_progress.difference_update(pending)
+            # Exact counts changed, rebuild the exact catalog on next request
+            _snapshots.pop(True, None)
+
+
+def _get_schema_version() -> str:
+    """Return the DDL version of the 'layers' schema, querying it at most every CATALOG_VERSION_CHECK_SECONDS."""
+    global _schema_version, _version_checked_at
+    now = time.time()
+    if _schema_version is None or now - _version_checked_at >= settings.CATALOG_VERSION_CHECK_SECONDS:
+        with get_db_connection() as conn:
+            _schema_version = conn.execute(CATALOG_VERSION_QUERY).scalar()
+        _version_checked_at = now
+    return _schema_version
+
+
+def _is_fresh(snapshot: Optional[CatalogSnapshot], version: str) -> bool:
+    return (
+        snapshot is not None
+        and snapshot.version == version
+        and time.time() - snapshot.built_at < settings.CATALOG_CACHE_TTL_SECONDS
+    )
+
+
+def get_catalog_snapshot(use_exact_counts: bool = False, timing: Optional[ServerTiming] = None) -> CatalogSnapshot:
+    """
+    Return the cached catalog, rebuilding it if the 'layers' schema changed
+    or the snapshot is older than CATALOG_CACHE_TTL_SECONDS.
+    Pass `timing` to time the version check, catalog query and serialization.
+    """
+    timing = timing if timing is not None else ServerTiming()
+    with timing.measure("version"):
+        version = _get_schema_version()
+    snapshot = _snapshots.get(use_exact_counts)
+    if _is_fresh(snapshot, version):
+        return snapshot
+
+    with _snapshot_lock:
+        # Another request may have rebuilt the catalog while we were waiting
+        snapshot = _snapshots.get(use_exact_counts)
+        if _is_fresh(snapshot, version):
+            return snapshot
+
+        with timing.measure("catalog_query"):
+            tables = get_layers_catalog(use_exact_counts=use_exact_counts)
+        with timing.measure("serialize"):
+            body = b"".join(iter_catalog_json(tables))
+        snapshot = CatalogSnapshot(
+            tables=tables,
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            version=version,
+            built_at=time.time(),
+        )
+        _snapshots[use_exact_counts] = snapshot
+        logger.info("Rebuilt layer catalog (%d tables, %d bytes)", len(tables), len(body))
+        return snapshot
+
+
+
+def filter_catalog(tables: List[Dict], name: Optional[str] = None, geometry_types: Optional[List[str]] = None,
+                   after: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Select the catalog entries matching the filters, in catalog (table name) order.
+
+    `name` is a case-insensitive substring of the table name, `geometry_types` a list of
+    upper-case geometry types and `after` the last table name of the previous page.
+    Returns the selected tables and, when more tables match than `limit`, the name to
+    continue after.
+    """
+    selected = []
+    for table in tables:
+        if after is not None and table["name"] <= after:
+            continue
+        if name and name.lower() not in table["name"].lower():
+            continue
+        if geometry_types and (table["geometry_type"] or "").upper() not in geometry_types:
+            continue
+        selected.append(table)
+        if limit is not None and len(selected) > limit:
+            return selected[:limit], selected[limit - 1]["name"]
+    return selected, None
+
+
+def encode_cursor(table_name: str) -> str:
+    """Opaque pagination cursor pointing after `table_name`."""
+    return base64.urlsafe_b64encode(table_name.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    """Return the table name of a cursor made by `encode_cursor`, or raise ValueError."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.b64decode(padded, altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+def iter_catalog_json(tables: List[Dict], include_columns: bool = True) -> Iterator[bytes]:
+    """Serialize catalog entries as a JSON array, one table at a time."""
+    yield b"["
+    for index, table in enumerate(tables):
+        if not include_columns:
+            table = {key: value for key, value in table.items() if key != "columns"}
+        yield (b"," if index else b"") + json.dumps(table, separators=(",", ":"), default=str).encode("utf-8")
+    yield b"]"
@@ -1,6 +1,14 @@
+import json
 import os
 from dotenv import load_dotenv
 
+from .geometry_pyramid import (
+    DEFAULT_MIN_FEATURE_MAX_ZOOM,
+    DEFAULT_MIN_FEATURE_PIXELS,
+    DEFAULT_PIXEL_TOLERANCE,
+    DEFAULT_ZOOM_BREAKS,
+)
+
 # Load environment variables from .env file
 load_dotenv(dotenv_path='.env.local')
 
@@ -12,14 +20,155 @@ class Settings:
 
     DATABASE_URL: str = os.getenv("DATABASE_URL")
     DOCKER_DATABASE_URL: str = os.getenv("DOCKER_DATABASE_URL")
+
+    # Connection pools (see database.py): DB_* sizes the pool for users, layers and
+    # other CRUD traffic, TILE_DB_* the separate pool used for tile generation.
+    # Statement timeouts are in milliseconds (0 disables them).
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 15000))
+    TILE_DB_POOL_SIZE: int = int(os.getenv("TILE_DB_POOL_SIZE", 10))
+    TILE_DB_MAX_OVERFLOW: int = int(os.getenv("TILE_DB_MAX_OVERFLOW", 10))
+    TILE_DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("TILE_DB_STATEMENT_TIMEOUT_MS", 30000))
+    DB_POOL_TIMEOUT_SECONDS: float = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 30))
+    DB_POOL_RECYCLE_SECONDS: int = int(os.getenv("DB_POOL_RECYCLE_SECONDS", 1800))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # Optional comma-separated read replica URLs. Tile, catalog and metadata reads are
+    # spread over them round-robin (each gets a pool sized like the tile pool); a
+    # replica that fails to connect is skipped for READ_REPLICA_RETRY_SECONDS.
+    READ_REPLICA_URLS: list = [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
+    READ_REPLICA_RETRY_SECONDS: float = float(os.getenv("READ_REPLICA_RETRY_SECONDS", 30))
+
     SECRET_KEY: str = os.getenv("SECRET_KEY")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+    # bcrypt cost for new password hashes (existing hashes are upgraded on login),
+    # and the bounded pool that runs hashing off the event loop.
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", 12))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 32))
+    # Seconds an authenticated user is served from memory instead of the users table (0 disables)
+    USER_CACHE_TTL_SECONDS: int = int(os.getenv("USER_CACHE_TTL_SECONDS", 30))
 
     SMTP_SERVER: str = os.getenv("SMTP_SERVER")
     SMTP_PORT: int = int(os.getenv("SMTP_PORT", 587))
     SMTP_USERNAME: str = os.getenv("SMTP_USERNAME")
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD")
+    SMTP_START_TLS: bool = os.getenv("SMTP_START_TLS", "true").lower() == "true"
+
+    # Outbound mail queue (see mail_queue)
+    MAIL_QUEUE_MAX_SIZE: int = int(os.getenv("MAIL_QUEUE_MAX_SIZE", 1000))
+    MAIL_BATCH_SIZE: int = int(os.getenv("MAIL_BATCH_SIZE", 20))
+    MAIL_MAX_RETRIES: int = int(os.getenv("MAIL_MAX_RETRIES", 5))
+    MAIL_IDLE_CLOSE_SECONDS: float = float(os.getenv("MAIL_IDLE_CLOSE_SECONDS", 60))
+
+    # Token-bucket rate limits per user (or client IP): refill rate in requests per
+    # second and burst size, for tile cache misses, logins and catalog listings.
+    # A rate of 0 disables a budget. RATE_LIMIT_BACKEND is "memory" (per process)
+    # or "postgres" (shared by every worker). Only trust X-Forwarded-For behind a proxy.
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_TRUST_FORWARDED: bool = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+    RATE_LIMIT_TILE_MISS_RATE: float = float(os.getenv("RATE_LIMIT_TILE_MISS_RATE", 20))
+    RATE_LIMIT_TILE_MISS_BURST: float = float(os.getenv("RATE_LIMIT_TILE_MISS_BURST", 200))
+    RATE_LIMIT_LOGIN_RATE: float = float(os.getenv("RATE_LIMIT_LOGIN_RATE", 0.1))
+    RATE_LIMIT_LOGIN_BURST: float = float(os.getenv("RATE_LIMIT_LOGIN_BURST", 10))
+    RATE_LIMIT_CATALOG_RATE: float = float(os.getenv("RATE_LIMIT_CATALOG_RATE", 2))
+    RATE_LIMIT_CATALOG_BURST: float = float(os.getenv("RATE_LIMIT_CATALOG_BURST", 20))
+    # Pool of the "postgres" backend, kept apart from the CRUD pool so bucket updates
+    # never wait behind (or hold) the connections of logins and layer saves.
+    RATE_LIMIT_DB_POOL_SIZE: int = int(os.getenv("RATE_LIMIT_DB_POOL_SIZE", 2))
+    RATE_LIMIT_DB_MAX_OVERFLOW: int = int(os.getenv("RATE_LIMIT_DB_MAX_OVERFLOW", 3))
+    RATE_LIMIT_DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("RATE_LIMIT_DB_STATEMENT_TIMEOUT_MS", 2000))
+
+    # Comma separated usernames allowed to call the admin endpoints
+    ADMIN_USERNAMES: list = [name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()]
+
+    # Simplification pyramid shared by simplify_geometries.py and the tile queries:
+    # comma separated zoom breaks (one geom_z_<from>_<to> column per band) and the
+    # simplification tolerance in screen pixels at the most detailed zoom of a band.
+    SIMPLIFY_ZOOM_BREAKS: str = os.getenv("SIMPLIFY_ZOOM_BREAKS", DEFAULT_ZOOM_BREAKS)
+    SIMPLIFY_PIXEL_TOLERANCE: float = float(os.getenv("SIMPLIFY_PIXEL_TOLERANCE", DEFAULT_PIXEL_TOLERANCE))
+
+    # In-memory feature store for small, frequently tiled (non-point) layers.
+    # Tables whose total relation size is at or below this threshold are loaded
+    # once and tiled in-process. Set to 0 to disable the store.
+    FEATURE_STORE_MAX_TABLE_MB: float = float(os.getenv("FEATURE_STORE_MAX_TABLE_MB", 16))
+    FEATURE_STORE_TTL_SECONDS: int = int(os.getenv("FEATURE_STORE_TTL_SECONDS", 600))
+
+    # Sub-pixel feature filtering for non-point layers (requires the geom_size
+    # column written by simplify_geometries.py). Up to TILE_MIN_FEATURE_MAX_ZOOM,
+    # features whose bounding-box diagonal is below TILE_MIN_FEATURE_PIXELS screen
+    # pixels are dropped, or replaced by a point if TILE_SMALL_FEATURES_AS_POINTS.
+    TILE_MIN_FEATURE_MAX_ZOOM: int = int(os.getenv("TILE_MIN_FEATURE_MAX_ZOOM", DEFAULT_MIN_FEATURE_MAX_ZOOM))
+    TILE_MIN_FEATURE_PIXELS: float = float(os.getenv("TILE_MIN_FEATURE_PIXELS", DEFAULT_MIN_FEATURE_PIXELS))
+    TILE_SMALL_FEATURES_AS_POINTS: bool = os.getenv("TILE_SMALL_FEATURES_AS_POINTS", "false").lower() == "true"
+
+    # Maximum MVT tile size in bytes (0 disables the budget). Oversized tiles are
+    # regenerated with stronger simplification, without attributes or sampled.
+    # TILE_MAX_BYTES_PER_LAYER is a JSON object of per-table overrides,
+    # e.g. {"parcels": 1048576}.
+    TILE_MAX_BYTES: int = int(os.getenv("TILE_MAX_BYTES", 512 * 1024))
+    TILE_MAX_BYTES_PER_LAYER: dict = json.loads(os.getenv("TILE_MAX_BYTES_PER_LAYER", "{}"))
+
+    # Tile generation runs on a dedicated pool of TILE_WORKERS threads. Its queries
+    # get a statement_timeout by zoom: a JSON object mapping the last zoom of a band
+    # to milliseconds (low zooms cover large areas and get more time). Zooms above
+    # every band use TILE_DB_STATEMENT_TIMEOUT_MS. Queries of tiles whose client
+    # disconnected are cancelled.
+    TILE_WORKERS: int = int(os.getenv("TILE_WORKERS", 8))
+    TILE_STATEMENT_TIMEOUT_MS_BY_ZOOM: dict = json.loads(
+        os.getenv("TILE_STATEMENT_TIMEOUT_MS_BY_ZOOM", '{"6": 20000, "12": 10000, "22": 5000}')
+    )
+
+    # Layer catalog cache. The serialized catalog is reused until the 'layers'
+    # schema changes: its DDL version is checked at most every
+    # CATALOG_VERSION_CHECK_SECONDS, and the catalog is rebuilt at least every
+    # CATALOG_CACHE_TTL_SECONDS so feature count estimates stay fresh.
+    CATALOG_VERSION_CHECK_SECONDS: float = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", 5))
+    CATALOG_CACHE_TTL_SECONDS: int = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", 300))
+    # statement_timeout of the background COUNT(*) scans of ?exact=true (0: no limit).
+    # They run on the read pool, whose TILE_DB_STATEMENT_TIMEOUT_MS is too short for large tables.
+    CATALOG_EXACT_COUNT_TIMEOUT_MS: int = int(os.getenv("CATALOG_EXACT_COUNT_TIMEOUT_MS", 0))
+
+    # In-memory layer_filters cache. Changes are picked up through LISTEN/NOTIFY
+    # when LAYER_FILTER_LISTEN is enabled, and by a background reload after the TTL.
+    LAYER_FILTER_LISTEN: bool = os.getenv("LAYER_FILTER_LISTEN", "true").lower() == "true"
+    LAYER_FILTER_CACHE_TTL_SECONDS: int = int(os.getenv("LAYER_FILTER_CACHE_TTL_SECONDS", 300))
+
+    # Apply the layer_filters filter of a table inside its tile queries, so features
+    # hidden by the filter are never encoded (filters outside the supported subset,
+    # see filter_sql, are still only applied by the client).
+    TILE_SERVER_SIDE_FILTERS: bool = os.getenv("TILE_SERVER_SIDE_FILTERS", "true").lower() == "true"
+
+    # Logging (see logging_config): LOG_LEVEL for the backend package, LOG_LEVELS a
+    # JSON object of per-module overrides, e.g. {"tiling_operations": "DEBUG"}.
+    # LOG_SAMPLE_RATES keeps a fraction of high-volume events (tile served from the
+    # cache, tile generated, request rate limited, rate limit store error) and
+    # LOG_QUEUE_SIZE bounds the records waiting to be written.
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_LEVELS: dict = json.loads(os.getenv("LOG_LEVELS", "{}"))
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    LOG_SAMPLE_RATES: dict = json.loads(
+        os.getenv(
+            "LOG_SAMPLE_RATES",
+            '{"tile_cache_hit": 0.01, "tile_generated": 0.1, "rate_limited": 0.01, "rate_limit_store_error": 0.1}',
+        )
+    )
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+    # GET /metrics only answers clients in METRICS_ALLOWED_NETWORKS (comma separated
+    # CIDRs, loopback and private ranges by default) and, if METRICS_TOKEN is set,
+    # sending "Authorization: Bearer <token>". Behind a reverse proxy every client has
+    # the proxy's address: keep /metrics off the public routes or set METRICS_TOKEN.
+    METRICS_ALLOWED_NETWORKS: list = [
+        network.strip()
+        for network in os.getenv(
+            "METRICS_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16"
+        ).split(",")
+        if network.strip()
+    ]
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
 
 
 settings = Settings()
\ No newline at end of file
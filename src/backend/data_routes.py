@@ -1,23 +1,35 @@
 from fastapi import (
     APIRouter,
+    BackgroundTasks,
     Depends,
     HTTPException,
+    Query,
+    Request,
+    Response,
     status,
     Security,
 )
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import inspect, text # Import text for raw SQL queries
+from sqlalchemy import text # Import text for raw SQL queries
 from typing import Dict, Optional, List, Any
+import logging
 
-from .database import get_db, engine
-from .models import User, MapLayer, LayerFilter
+from .database import get_db
+from .models import User, MapLayer
 from .schemas import UserResponse, UserSettingsUpdate, MapSettingsUpdate, TableSchema, ColumnSchema, MapLayerResponse, MapLayerCreate, MapLayerUpdate, LayerFilterResponse
 from .auth import (
+    get_current_admin_user,
     get_current_user,
-    get_password_hash
+    get_password_hash_async
 )
-from .tiling_operations import apply_layer_filter
+from .tiling_operations import apply_layer_filter, get_layer_filters_for_names, refresh_map_layer_filters
+from . import catalog_operations as catalog_ops
+from . import layer_filter_cache
+from .server_timing import ServerTiming
+
+logger = logging.getLogger(__name__)
 
 # Initialize FastAPI Router for data routes
 router = APIRouter(
@@ -25,9 +37,7 @@ router = APIRouter(
 )
 
 
-@router.get(
-    "/users/me", response_model=UserResponse, dependencies=[Depends(get_current_user)]
-)
+@router.get("/users/me", response_model=UserResponse)
 async def read_users_me(current_user: User = Depends(get_current_user)):
     """
     Retrieves the currently authenticated user's information, including profile and map settings.
@@ -39,7 +49,6 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
 @router.put(
     "/users/me/settings/account",
     response_model=UserResponse,
-    dependencies=[Depends(get_current_user)],
 )
 async def update_user_account_settings(
     settings_update: UserSettingsUpdate,
@@ -64,7 +73,7 @@ async def update_user_account_settings(
         )
 
     if "password" in updates:
-        current_user.hashed_password = get_password_hash(updates["password"])
+        current_user.hashed_password = await get_password_hash_async(updates["password"])
         del updates["password"]
 
     for key, value in updates.items():
@@ -92,7 +101,6 @@ async def update_user_account_settings(
 @router.put(
     "/users/me/settings/map",
     response_model=UserResponse,
-    dependencies=[Depends(get_current_user)],
 )
 async def update_user_map_settings(
     settings_update: MapSettingsUpdate,
@@ -142,7 +150,6 @@ async def get_public_data():
 @router.get(
     "/protected",
     response_model=Dict[str, str],
-    dependencies=[Depends(get_current_user)],
 )
 async def get_protected_data(current_user: User = Depends(get_current_user)):
     """
@@ -151,73 +158,84 @@ async def get_protected_data(current_user: User = Depends(get_current_user)):
     return {"message": f"Hello {current_user.username}, this is protected data!"}
 
 
+def _describe_catalog(timing: ServerTiming, tables: List[Dict]):
+    """Debug counts of a catalog listing for the Server-Timing header."""
+    timing.describe("tables", len(tables))
+    timing.describe("columns", sum(len(table["columns"]) for table in tables))
+    timing.describe("features", sum(table["feature_count"] or 0 for table in tables))
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header (comma separated, W/ prefixes, or *) with `etag`."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    return any((candidate[2:] if candidate.startswith("W/") else candidate) == opaque_tag for candidate in candidates)
+
+
+# Plain def: the catalog snapshot may query the database, so FastAPI runs this in its threadpool
 @router.get("/layers/tables", response_model=List[TableSchema])
-async def get_layers_tables():
+def get_layers_tables(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    exact: bool = Query(False, description="Use exact feature counts, computed in the background"),
+    name: Optional[str] = Query(None, description="Only tables whose name contains this text (case-insensitive)"),
+    geometry_type: Optional[str] = Query(None, description="Comma separated geometry types, e.g. POLYGON,MULTIPOLYGON"),
+    include_columns: bool = Query(True, description="Include the column list of each table"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; the next page's cursor is returned in X-Next-Cursor"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value of the previous page"),
+    debug: bool = Query(False, description="Add table, column and feature counts to the Server-Timing header"),
+):
     """
     Returns a list of all table names within the 'layers' schema, along with their column properties and geometry type.
+    Feature counts are planner estimates; with `exact=true`, exact counts are returned once a
+    background count has completed (`feature_count_exact` tells which counts are exact).
+    The full listing is cached until the schema changes and served with an ETag,
+    so clients revalidating with If-None-Match get a 304 when nothing changed.
+    Filtered or paginated listings are streamed from the same cached catalog.
+    The Server-Timing header reports the version check, catalog query, serialization
+    and filtering times (streamed listings are serialized after the header is sent).
     This is a public route.
     """
-    inspector = inspect(engine)
+    timing = ServerTiming()
     try:
-        table_names = inspector.get_table_names(schema='layers')
-        
-        tables_data = []
-        with engine.connect() as connection:
-            for table_name in table_names:
-                columns_data = []
-                table_geometry_type = None
-                
-                # Query geometry_columns for the table's geometry type
-                # This assumes a PostGIS database with the geometry_columns view
-                geometry_query = text(f"""
-                    SELECT type
-                    FROM geometry_columns
-                    WHERE f_table_schema = 'layers' AND f_table_name = :table_name
-                    LIMIT 1;
-                """)
-                result = connection.execute(geometry_query, {"table_name": table_name}).fetchone()
-                if result:
-                    table_geometry_type = result[0] # The 'type' column from geometry_columns
-
-                columns = inspector.get_columns(table_name, schema='layers')
-                for col in columns:
-                    columns_data.append(ColumnSchema(
-                        name=col['name'],
-                        type=str(col['type']),
-                        nullable=col['nullable'],
-                        default=col.get('default'),
-                        primary_key=col.get('primary_key', False),
-                        autoincrement=col.get('autoincrement', False),
-                        comment=col.get('comment')
-                    ))
-                
-                # tables_data.append(TableSchema(name=table_name, columns=columns_data, geometry_type=table_geometry_type))
-
-                # Query SRID for the table (assuming 'geom' column exists)
-                srid_query = text(f"""
-                    SELECT DISTINCT ST_SRID(geom)
-                    FROM layers.{table_name}
-                    LIMIT 1;
-                """)
-                srid_result = connection.execute(srid_query).fetchone()
-                srid_value = srid_result[0] if srid_result else None
-
-                # Query row count for the table
-                count_query = text(f"""
-                    SELECT COUNT(*) FROM layers.{table_name};
-                """)
-                count_result = connection.execute(count_query).fetchone()
-                count_value = count_result[0] if count_result else None
-
-                tables_data.append(TableSchema(
-                    name=table_name,
-                    columns=columns_data,
-                    geometry_type=table_geometry_type,
-                    srid=srid_value,
-                    feature_count=count_value
-                ))
-
-        return tables_data
+        after = catalog_ops.decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    try:
+        snapshot = catalog_ops.get_catalog_snapshot(use_exact_counts=exact, timing=timing)
+        if exact:
+            missing = [table["name"] for table in snapshot.tables if not table["feature_count_exact"]]
+            if missing:
+                background_tasks.add_task(catalog_ops.refresh_exact_counts, missing)
+
+        if name or geometry_type or limit or after is not None or not include_columns:
+            geometry_types = [t.strip().upper() for t in geometry_type.split(",")] if geometry_type else None
+            with timing.measure("filter"):
+                tables, next_name = catalog_ops.filter_catalog(
+                    snapshot.tables, name=name, geometry_types=geometry_types, after=after, limit=limit
+                )
+            if debug:
+                _describe_catalog(timing, tables)
+            headers = {"Cache-Control": "no-cache", **timing.headers()}
+            if next_name is not None:
+                headers["X-Next-Cursor"] = catalog_ops.encode_cursor(next_name)
+            return StreamingResponse(
+                catalog_ops.iter_catalog_json(tables, include_columns=include_columns),
+                media_type="application/json",
+                headers=headers,
+            )
+
+        if debug:
+            _describe_catalog(timing, snapshot.tables)
+        headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache", **timing.headers()}
+        if _etag_matches(request.headers.get("if-none-match"), snapshot.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=snapshot.body, media_type="application/json", headers=headers)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -225,32 +243,32 @@ async def get_layers_tables():
         )
 
 # --- Map Layers CRUD Endpoints ---
-@router.get("/users/me/map_layers", response_model=List[MapLayerResponse], dependencies=[Depends(get_current_user)])
+@router.get("/users/me/map_layers", response_model=List[MapLayerResponse])
 async def get_user_map_layers(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """
     Get all map layers for the current user.
     Populates mapbox_filter field based on layer_name match from layers_filters table.
     """
     layers = db.query(MapLayer).filter(MapLayer.user_id == current_user.id).all()
-    
-    # Populate mapbox_filter for each layer
-    for layer in layers:
-        if not layer.mapbox_filter:
-            # Try to get filter from layer_filters table based on layer name
-            layer_name = layer.original_name or layer.name
-            print(f"🔍 Trying to populate filter for existing layer: '{layer_name}'")
-            filter_config = apply_layer_filter(layer_name)
+
+    # Populate mapbox_filter of the layers that have none, resolving all filters in one query
+    missing = [layer for layer in layers if not layer.mapbox_filter]
+    if missing:
+        filters = get_layer_filters_for_names([layer.original_name or layer.name for layer in missing])
+        populated = 0
+        for layer in missing:
+            filter_config = filters.get(layer.original_name or layer.name)
             if filter_config:
-                print(f"✅ Got filter config for existing layer '{layer_name}': {filter_config}")
                 layer.mapbox_filter = filter_config
-                # Optionally save to database for future use
-                db.commit()
-            else:
-                print(f"❌ No filter config found for existing layer '{layer_name}'")
-    
+                populated += 1
+        if populated:
+            logger.info("Populated filters for %d of %d layers without a filter", populated, len(missing))
+            # Save to database for future use
+            db.commit()
+
     return layers
 
-@router.post("/users/me/map_layers", response_model=MapLayerResponse, dependencies=[Depends(get_current_user)])
+@router.post("/users/me/map_layers", response_model=MapLayerResponse)
 async def add_user_map_layer(layer: MapLayerCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """
     Add a new map layer for the current user. Unique by (user_id, name).
@@ -261,27 +279,28 @@ async def add_user_map_layer(layer: MapLayerCreate, current_user: User = Depends
     # Populate mapbox_filter if not provided
     if not layer_data.get('mapbox_filter'):
         layer_name = layer_data.get('original_name') or layer_data.get('name')
-        print(f"🔍 Trying to get filter for layer: '{layer_name}'")
         filter_config = apply_layer_filter(layer_name)
         if filter_config:
-            print(f"✅ Got filter config for layer '{layer_name}': {filter_config}")
             layer_data['mapbox_filter'] = filter_config
         else:
-            print(f"❌ No filter config found for layer '{layer_name}'")
-    
-    print(f"📝 Creating layer with data: {layer_data}")
+            logger.debug("No filter config found for layer '%s'", layer_name)
+
+    logger.debug("Creating layer with data: %s", layer_data)
     db_layer = MapLayer(**layer_data, user_id=current_user.id)
     db.add(db_layer)
     try:
         db.commit()
         db.refresh(db_layer)
-        print(f"✅ Layer created successfully: {db_layer.name}, mapbox_filter: {db_layer.mapbox_filter}")
+        logger.info(
+            "Layer '%s' created for user %s", db_layer.name, current_user.id,
+            extra={"event": "map_layer_created", "user_id": current_user.id},
+        )
         return db_layer
     except IntegrityError as e:
         db.rollback()
         raise HTTPException(status_code=409, detail="Layer with this name already exists for this user.")
 
-@router.patch("/users/me/map_layers/{layer_id}", response_model=MapLayerResponse, dependencies=[Depends(get_current_user)])
+@router.patch("/users/me/map_layers/{layer_id}", response_model=MapLayerResponse)
 async def update_user_map_layer(layer_id: int, layer_update: MapLayerUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """
     Update a map layer's state (is_visible, is_selected_for_info, color) for the current user.
@@ -295,7 +314,7 @@ async def update_user_map_layer(layer_id: int, layer_update: MapLayerUpdate, cur
     db.refresh(db_layer)
     return db_layer
 
-@router.delete("/users/me/map_layers/{layer_id}", response_model=dict, dependencies=[Depends(get_current_user)])
+@router.delete("/users/me/map_layers/{layer_id}", response_model=dict)
 async def delete_user_map_layer(layer_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """
     Delete a map layer for the current user.
@@ -308,70 +327,67 @@ async def delete_user_map_layer(layer_id: int, current_user: User = Depends(get_
     return {"detail": "Layer deleted."}
 
 @router.get("/layer_filters", response_model=List[LayerFilterResponse])
-async def get_layer_filters(db: Session = Depends(get_db)):
+async def get_layer_filters():
     """
-    Get all layer filters from the layer_filters table.
+    Get all layer filters from the layer_filters table (served from the in-memory filter cache).
     These filters are used to apply zoom-based filtering to map layers.
     """
     try:
-        print("🔍 API: Getting all layer filters...")
-        filters = db.query(LayerFilter).all()
-        print(f"✅ API: Found {len(filters)} layer filters")
-        return filters
+        return layer_filter_cache.get_all_records()
     except Exception as e:
-        print(f"❌ API: Error getting layer filters: {e}")
+        logger.exception("Error getting layer filters")
         raise HTTPException(
             status_code=500, 
             detail=f"Internal server error while fetching layer filters: {str(e)}"
         )
 
 @router.get("/layer_filters/{layer_name}", response_model=LayerFilterResponse)
-async def get_layer_filter_by_name(layer_name: str, db: Session = Depends(get_db)):
+async def get_layer_filter_by_name(layer_name: str):
     """
     Get filter configuration for a specific layer by name.
     Returns the filter that should be applied to the layer.
     """
     try:
-        print(f"🔍 API: Looking for filter for layer: '{layer_name}'")
-        layer_filter = db.query(LayerFilter).filter(LayerFilter.layer_name == layer_name).first()
+        layer_filter = layer_filter_cache.get_record(layer_name)
         
         if not layer_filter:
-            print(f"❌ API: No filter found for layer: '{layer_name}'")
             # Let's check what layer names exist in the database
-            all_filters = db.query(LayerFilter).all()
-            available_names = [f.layer_name for f in all_filters]
-            print(f"📋 API: Available layer names: {available_names}")
+            available_names = layer_filter_cache.get_layer_names()
             raise HTTPException(status_code=404, detail=f"Filter not found for layer: {layer_name}. Available layers: {available_names}")
-        
-        print(f"✅ API: Found filter for layer: '{layer_name}'")
+
         return layer_filter
         
     except HTTPException:
         # Re-raise HTTP exceptions (like 404)
         raise
     except Exception as e:
-        print(f"❌ API: Unexpected error getting filter for layer '{layer_name}': {e}")
+        logger.exception("Unexpected error getting filter for layer '%s'", layer_name)
         raise HTTPException(
             status_code=500, 
             detail=f"Internal server error while fetching filter for layer '{layer_name}': {str(e)}"
         )
 
-@router.post("/users/me/map_layers/refresh_filters", response_model=dict, dependencies=[Depends(get_current_user)])
+@router.post("/users/me/map_layers/refresh_filters", response_model=dict)
 async def refresh_layer_filters(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """
     Refresh mapbox_filter for all user's layers based on current layer_filters table.
     Useful when filter configurations are updated in the database.
     """
-    layers = db.query(MapLayer).filter(MapLayer.user_id == current_user.id).all()
-    updated_count = 0
-    
-    for layer in layers:
-        layer_name = layer.original_name or layer.name
-        filter_config = apply_layer_filter(layer_name)
-        
-        # Update the layer's filter (even if it's None/empty to clear old filters)
-        layer.mapbox_filter = filter_config
-        updated_count += 1
-    
+    updated_count = refresh_map_layer_filters(db, user_id=current_user.id)
+    db.commit()
+    return {"detail": f"Refreshed filters for {updated_count} layers"}
+
+
+@router.post("/admin/map_layers/refresh_filters", response_model=dict)
+async def refresh_all_layer_filters(admin_user: User = Depends(get_current_admin_user), db: Session = Depends(get_db)):
+    """
+    Refresh mapbox_filter of every user's layers based on the current layer_filters table.
+    Meant to be called after a filter configuration changed. Requires an admin user.
+    """
+    updated_count = refresh_map_layer_filters(db)
     db.commit()
-    return {"detail": f"Refreshed filters for {updated_count} layers"}
\ No newline at end of file
+    logger.info(
+        "Admin '%s' refreshed filters for %d layers", admin_user.username, updated_count,
+        extra={"event": "map_layer_filters_refreshed"},
+    )
+    return {"detail": f"Refreshed filters for {updated_count} layers"}
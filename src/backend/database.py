@@ -1,13 +1,63 @@
+import itertools
+import logging
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings  # Changed to relative import
 
-# Create the SQLAlchemy engine
+logger = logging.getLogger(__name__)
+
+def _create_engine(url: str, pool_size: int, max_overflow: int, statement_timeout_ms: int):
+    """
+    Create an engine with the configured pool settings. statement_timeout is set
+    per connection, so a runaway query is cancelled by the server (0 disables it).
+    """
+    return create_engine(
+        url,
+        echo=False,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={"options": f"-c statement_timeout={statement_timeout_ms}"},
+    )
+
+
+# Create the SQLAlchemy engines
 # The `echo=True` argument logs all SQL statements to the console, useful for debugging.
+# Two separate pools, so a flood of slow tile queries can never take the
+# connections needed by logins, layer saves and other quick CRUD requests:
+# - `engine`: users, map layers, filters and the catalog
+# - `tile_engine`: MVT tile generation and other heavy spatial reads
+# - `rate_limit_engine`: token buckets of RATE_LIMIT_BACKEND=postgres (None otherwise)
+# With READ_REPLICA_URLS set, the reads of `get_db_connection` go to `replica_engines`
+# instead, and the primary only serves them when no replica is reachable.
 
 # engine = create_engine(settings.DATABASE_URL, echo=False)
-engine = create_engine(settings.DOCKER_DATABASE_URL, echo=False)
+engine = _create_engine(
+    settings.DOCKER_DATABASE_URL,
+    settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW, settings.DB_STATEMENT_TIMEOUT_MS
+)
+tile_engine = _create_engine(
+    settings.DOCKER_DATABASE_URL,
+    settings.TILE_DB_POOL_SIZE, settings.TILE_DB_MAX_OVERFLOW, settings.TILE_DB_STATEMENT_TIMEOUT_MS
+)
+rate_limit_engine = _create_engine(
+    settings.DOCKER_DATABASE_URL,
+    settings.RATE_LIMIT_DB_POOL_SIZE, settings.RATE_LIMIT_DB_MAX_OVERFLOW, settings.RATE_LIMIT_DB_STATEMENT_TIMEOUT_MS
+) if settings.RATE_LIMIT_BACKEND == "postgres" else None
+replica_engines = [
+    _create_engine(url, settings.TILE_DB_POOL_SIZE, settings.TILE_DB_MAX_OVERFLOW, settings.TILE_DB_STATEMENT_TIMEOUT_MS)
+    for url in settings.READ_REPLICA_URLS
+]
+
+# Round-robin position and, per replica, the time.monotonic() until which it is skipped
+_replica_counter = itertools.count()
+_replica_down_until = [0.0] * len(replica_engines)
 
 # Create a SessionLocal class
 # This class will be used to create database sessions.
@@ -38,10 +88,30 @@ def get_db():
 # It's useful for initial setup but for production, consider using Alembic for migrations.
 def get_db_connection():
     """
-    Get a raw database connection for executing SQL queries.
-    Use this for raw SQL operations like in tiling_operations.
+    Get a raw database connection for executing read-only SQL queries.
+    Use this for raw SQL operations like in tiling_operations, the feature store and
+    the catalog. Never write through it: it may be connected to a read replica.
+
+    Replicas are tried round-robin; one that fails to connect is marked down for
+    READ_REPLICA_RETRY_SECONDS (the pool pre-ping already replaces dead pooled
+    connections). Without healthy replicas the primary's tile pool is used.
     """
-    return engine.connect()
+    if replica_engines:
+        start = next(_replica_counter)
+        for offset in range(len(replica_engines)):
+            index = (start + offset) % len(replica_engines)
+            if _replica_down_until[index] > time.monotonic():
+                continue
+            try:
+                return replica_engines[index].connect()
+            except OperationalError as e:
+                _replica_down_until[index] = time.monotonic() + settings.READ_REPLICA_RETRY_SECONDS
+                logger.warning(
+                    "Read replica %s unavailable, skipping it for %ss: %s",
+                    replica_engines[index].url.host, settings.READ_REPLICA_RETRY_SECONDS, e,
+                    extra={"event": "replica_down", "replica": replica_engines[index].url.host},
+                )
+    return tile_engine.connect()
 
 
 def create_db_tables():
@@ -0,0 +1,260 @@
+"""
+In-memory vector feature store for small, frequently tiled layers.
+
+Reference layers such as boundaries or zones are usually only a few MB, yet every
+tile cache miss sends a query to PostGIS. Tables whose total size is below
+`settings.FEATURE_STORE_MAX_TABLE_MB` are loaded once (every simplification level
+plus the attribute values) into a Shapely STRtree, and tiles are clipped and encoded
+in-process with `mapbox_vector_tile`, so these layers need no DB round-trip per tile.
+
+Only non-point tables are served from the store; point tables keep using the
+clustering query in `tiling_operations`. Loaded tables are reloaded after
+`settings.FEATURE_STORE_TTL_SECONDS` so edits eventually show up.
+"""
+
+import logging
+import math
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+import mercantile
+from sqlalchemy import text
+
+from .config import settings
+from .database import get_db_connection
+
+try:
+    import mapbox_vector_tile
+    from mapbox_vector_tile.encoder import on_invalid_geometry_ignore
+    from shapely import box, clip_by_rect, wkb
+    from shapely.strtree import STRtree
+    FEATURE_STORE_AVAILABLE = True
+except ImportError:  # shapely / mapbox-vector-tile not installed, always tile from the DB
+    FEATURE_STORE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Same tile parameters as ST_AsMVTGeom(..., 4096, 256, true) in the SQL tile queries
+TILE_EXTENT = 4096
+TILE_BUFFER = 256
+
+
+class _LevelIndex:
+    """Spatial index over the geometries of one geometry column."""
+
+    def __init__(self, geometries: List, feature_ids: List[int]):
+        self.geometries = geometries
+        self.feature_ids = feature_ids
+        self.tree = STRtree(geometries)
+
+
+class _TableStore:
+    """All simplification levels and attributes of one table, held in memory."""
+
+    def __init__(self, table: str, levels: Dict[str, _LevelIndex], properties: List[Dict], sizes: List[float],
+                 points: Optional[_LevelIndex] = None):
+        self.table = table
+        self.levels = levels
+        self.properties = properties
+        self.sizes = sizes  # Bounding-box diagonal (m) of each feature's original geometry
+        self.points = points  # Point on the surface of each original geometry (small features)
+        self.loaded_at = time.time()
+
+    def is_expired(self) -> bool:
+        return time.time() - self.loaded_at > settings.FEATURE_STORE_TTL_SECONDS
+
+
+# table -> _TableStore, or None when the table does not qualify for the store
+_stores: Dict[str, Optional[_TableStore]] = {}
+_checked_at: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def _mvt_value(value):
+    """Convert a DB value into a type the MVT encoder supports (ST_AsMVT casts the rest to text)."""
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _table_size_bytes(table: str) -> Optional[int]:
+    with get_db_connection() as conn:
+        result = conn.execute(
+            text("SELECT pg_total_relation_size(to_regclass(:relation))"),
+            {"relation": f"layers.{table}"}
+        ).fetchone()
+        return result[0] if result else None
+
+
+def _load_table(table: str, geometry_columns: List[str], attributes_list: List[str]) -> _TableStore:
+    """Read every geometry level and attribute of `table` and build one STRtree per level."""
+    start_time = time.time()
+    geometry_sql = ', '.join(f'ST_AsBinary("{col}") AS "{col}"' for col in geometry_columns)
+    attributes_sql = ''.join(f', "{attr}"' for attr in attributes_list)
+
+    with get_db_connection() as conn:
+        rows = conn.execute(text(f"SELECT {geometry_sql}{attributes_sql} FROM layers.{table}")).fetchall()
+
+    level_geometries: Dict[str, List] = {col: [] for col in geometry_columns}
+    level_ids: Dict[str, List[int]] = {col: [] for col in geometry_columns}
+    properties = []
+    sizes = []
+    points, point_ids = [], []
+    for feature_id, row in enumerate(rows):
+        size = 0.0
+        for col_index, col in enumerate(geometry_columns):
+            geom_wkb = row[col_index]
+            if geom_wkb is None:
+                continue
+            geometry = wkb.loads(bytes(geom_wkb))
+            level_geometries[col].append(geometry)
+            level_ids[col].append(feature_id)
+            if col_index == 0:
+                minx, miny, maxx, maxy = geometry.bounds
+                size = math.hypot(maxx - minx, maxy - miny)
+                if not geometry.is_empty:
+                    points.append(geometry.point_on_surface())
+                    point_ids.append(feature_id)
+        sizes.append(size)
+        attribute_values = row[len(geometry_columns):]
+        properties.append({
+            attr: _mvt_value(value)
+            for attr, value in zip(attributes_list, attribute_values)
+            if value is not None
+        })
+
+    levels = {
+        col: _LevelIndex(level_geometries[col], level_ids[col])
+        for col in geometry_columns
+        if level_geometries[col]
+    }
+    elapsed = time.time() - start_time
+    logger.info(
+        "Loaded %d features of %s into the in-memory feature store (%.2fs)", len(rows), table, elapsed,
+        extra={"event": "feature_store_load", "table": table},
+    )
+    return _TableStore(table, levels, properties, sizes, _LevelIndex(points, point_ids) if points else None)
+
+
+def get_table_store(table: str, geometry_columns: List[str], attributes_list: List[str]) -> Optional[_TableStore]:
+    """
+    Return the in-memory store for `table`, loading it on first use.
+    Returns None when the store is disabled or the table is too large to qualify.
+
+    `geometry_columns` lists every geometry column to index, original geometry first.
+    """
+    if not FEATURE_STORE_AVAILABLE or settings.FEATURE_STORE_MAX_TABLE_MB <= 0:
+        return None
+
+    store = _stores.get(table)
+    if store is not None and not store.is_expired():
+        return store
+    if store is None and table in _stores and time.time() - _checked_at[table] < settings.FEATURE_STORE_TTL_SECONDS:
+        return None  # Recently checked and found too large
+
+    with _lock:
+        # Another thread may have (re)loaded the table while we were waiting
+        store = _stores.get(table)
+        if store is not None and not store.is_expired():
+            return store
+
+        size_bytes = _table_size_bytes(table)
+        _checked_at[table] = time.time()
+        if size_bytes is None or size_bytes > settings.FEATURE_STORE_MAX_TABLE_MB * 1024 * 1024:
+            _stores[table] = None
+            return None
+
+        store = _load_table(table, geometry_columns, attributes_list)
+        _stores[table] = store
+        return store
+
+
+def encode_tile(store: _TableStore, geometry_column: str, z: int, x: int, y: int,
+                min_feature_size: Optional[float] = None, small_as_points: bool = False,
+                feature_filter: Optional[Callable[[Dict], bool]] = None) -> Optional[bytes]:
+    """
+    Clip the features of one simplification level to tile z/x/y and encode them as MVT,
+    mirroring ST_AsMVTGeom(geom, ST_TileEnvelope(z, x, y), 4096, 256, true).
+    Features smaller than `min_feature_size` meters are dropped, or replaced by a point
+    on the surface of their original geometry when `small_as_points` is set (same rules
+    as the SQL tile query; such features may be EMPTY in the coarse levels).
+    Features whose properties do not pass `feature_filter` are skipped.
+    Returns None if the level has not been loaded (e.g. column is entirely NULL).
+    """
+    level = store.levels.get(geometry_column)
+    if level is None:
+        return None
+
+    bounds = mercantile.xy_bounds(x, y, z)
+    buffer = (bounds.right - bounds.left) * TILE_BUFFER / TILE_EXTENT
+    clip_bounds = (
+        bounds.left - buffer,
+        bounds.bottom - buffer,
+        bounds.right + buffer,
+        bounds.top + buffer,
+    )
+
+    clip_box = box(*clip_bounds)
+    features = []
+    for index in level.tree.query(clip_box, predicate="intersects"):
+        feature_id = level.feature_ids[index]
+        if min_feature_size is not None and store.sizes[feature_id] < min_feature_size:
+            continue  # Dropped, or added as a point below
+        if feature_filter is not None and not feature_filter(store.properties[feature_id]):
+            continue
+        clipped = clip_by_rect(level.geometries[index], *clip_bounds)
+        if clipped.is_empty:
+            continue
+        features.append({
+            "geometry": clipped,
+            "properties": store.properties[feature_id],
+        })
+
+    if min_feature_size is not None and small_as_points and store.points is not None:
+        for index in store.points.tree.query(clip_box, predicate="intersects"):
+            feature_id = store.points.feature_ids[index]
+            if store.sizes[feature_id] >= min_feature_size:
+                continue
+            if feature_filter is not None and not feature_filter(store.properties[feature_id]):
+                continue
+            features.append({
+                "geometry": store.points.geometries[index],
+                "properties": store.properties[feature_id],
+            })
+
+    if not features:
+        return b''
+
+    return mapbox_vector_tile.encode(
+        {"name": "features", "features": features},
+        default_options={
+            "quantize_bounds": (bounds.left, bounds.bottom, bounds.right, bounds.top),
+            "extents": TILE_EXTENT,
+            "on_invalid_geometry": on_invalid_geometry_ignore,
+        },
+    )
+
+
+def count_tile_features(tile_data: bytes) -> Optional[Dict[str, int]]:
+    """Number of features per layer of an encoded MVT tile (None without mapbox-vector-tile)."""
+    if not FEATURE_STORE_AVAILABLE:
+        return None
+    return {name: len(layer["features"]) for name, layer in mapbox_vector_tile.decode(tile_data).items()}
+
+
+def invalidate(table: Optional[str] = None):
+    """Drop a table (or every table, if None) from the store so it is reloaded on next use."""
+    with _lock:
+        if table is None:
+            _stores.clear()
+            _checked_at.clear()
+        else:
+            _stores.pop(table, None)
+            _checked_at.pop(table, None)
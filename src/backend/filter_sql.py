@@ -0,0 +1,337 @@
+"""
+Server-side evaluation of the Mapbox filter expressions stored in layer_filters.
+
+Filters used to be sent to the browser only, so tiles carried every feature the
+client then hid. This module turns the stored filter into a parameterized SQL
+predicate for the tile queries (`compile_filter`) and evaluates it in Python for
+tiles encoded from the in-memory feature store (`evaluate_filter`).
+
+Supported subset, in both the legacy syntax (["==", "field", value]) and the
+expression syntax (["==", ["get", "field"], value]):
+    ==  !=  <  <=  >  >=      comparison with a literal value
+    in  !in                   membership in a list of literal values (expression
+                              syntax: ["in", ["get", "field"], ["literal", [...]]])
+    has  !has                 property presence
+    all  any  none  !         boolean combinations
+    step on ["zoom"]          and comparisons of ["zoom"] with a number
+    true / false
+
+Semantics follow Mapbox: a missing (NULL) property equals nothing but null, values
+of different types are never equal and never ordered. A tile at zoom z is shown
+for map zooms in [z, z+1), so zoom-dependent parts must have the same result over
+that whole range; otherwise, like for any expression outside the subset,
+`UnsupportedFilterError` is raised and the caller leaves filtering to the client.
+
+This module only depends on the standard library.
+"""
+
+import hashlib
+import json
+import operator
+from typing import Any, Dict, List, Tuple
+
+NUMERIC_TYPES = {"smallint", "integer", "bigint", "numeric", "real", "double precision"}
+TEXT_TYPES = {"text", "character varying", "character"}
+
+# Highest map zoom still displaying a tile of zoom z is just below z + 1
+ZOOM_RANGE_EPSILON = 1e-6
+
+_COMPARISON_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+# Operator to use when the column is on the right-hand side (5 < x  ->  x > 5)
+_SWAPPED_OPERATORS = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+
+class UnsupportedFilterError(ValueError):
+    """The filter uses an expression this module cannot evaluate server-side."""
+
+
+def filter_hash(expression: Any) -> str:
+    """Short stable hash of a filter expression, used in tile cache keys."""
+    canonical = json.dumps(expression, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:12]
+
+
+def _value_kind(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    raise UnsupportedFilterError(f"Unsupported filter value: {value!r}")
+
+
+def _column_kind(data_type: str) -> str:
+    """Kind of the MVT value encoded for a column (ST_AsMVT writes other types as strings)."""
+    if data_type in NUMERIC_TYPES:
+        return "number"
+    if data_type == "boolean":
+        return "boolean"
+    return "string"
+
+
+def _compare_values(op: str, left: Any, right: Any) -> bool:
+    """Mapbox comparison of two plain values."""
+    same_kind = _value_kind(left) == _value_kind(right)
+    if op == "==":
+        return same_kind and left == right
+    if op == "!=":
+        return not (same_kind and left == right)
+    if not same_kind or _value_kind(left) not in ("number", "string"):
+        return False
+    return _COMPARISON_OPERATORS[op](left, right)
+
+
+def _operand(arg: Any, allow_property_name: bool) -> Tuple[str, Any]:
+    """
+    Classify a comparison operand as ("property", name), ("zoom", None) or ("value", v).
+    A bare string is a property name only in the legacy first-operand position.
+    """
+    if isinstance(arg, list):
+        if len(arg) == 2 and arg[0] == "get" and isinstance(arg[1], str):
+            return "property", arg[1]
+        if arg == ["zoom"]:
+            return "zoom", None
+        if len(arg) == 2 and arg[0] == "literal" and not isinstance(arg[1], (list, dict)):
+            return "value", arg[1]
+        raise UnsupportedFilterError(f"Unsupported filter operand: {arg!r}")
+    if allow_property_name and isinstance(arg, str):
+        if arg.startswith("$"):
+            raise UnsupportedFilterError(f"Unsupported filter key: {arg}")
+        return "property", arg
+    _value_kind(arg)  # Validates the literal
+    return "value", arg
+
+
+def _parse_comparison(op: str, args: List) -> Tuple[str, Any, Any, Any]:
+    """
+    Normalize a comparison to (op, left_kind, left, right_value), with the property
+    or zoom operand (if any) on the left.
+    """
+    if len(args) != 2:
+        raise UnsupportedFilterError(f"'{op}' expects two operands")
+    left_kind, left = _operand(args[0], allow_property_name=True)
+    right_kind, right = _operand(args[1], allow_property_name=False)
+    if left_kind == "value" and right_kind != "value":
+        op, left_kind, left, right_kind, right = _SWAPPED_OPERATORS[op], right_kind, right, left_kind, left
+    if right_kind != "value":
+        raise UnsupportedFilterError(f"Comparing two properties is not supported: {args!r}")
+    return op, left_kind, left, right
+
+
+def _parse_membership(op: str, args: List) -> Tuple[str, List]:
+    """Return (property name, values) of an in / !in filter."""
+    if not args:
+        raise UnsupportedFilterError(f"'{op}' expects a property")
+    kind, name = _operand(args[0], allow_property_name=True)
+    if kind != "property":
+        raise UnsupportedFilterError(f"'{op}' expects a property: {args!r}")
+    values = args[1:]
+    is_literal_array = (
+        len(values) == 1 and isinstance(values[0], list) and len(values[0]) == 2 and values[0][0] == "literal"
+    )
+    if isinstance(args[0], list) and not (is_literal_array and isinstance(values[0][1], list)):
+        # Expression syntax: ["in", ["get", "b"], "xyz"] is a substring test, only
+        # membership in ["literal", [...]] is supported
+        raise UnsupportedFilterError(f"'{op}' on an expression expects a ['literal', [...]] array: {args!r}")
+    if is_literal_array:
+        values = values[0][1]
+    if not isinstance(values, list):
+        raise UnsupportedFilterError(f"'{op}' expects a list of values: {args!r}")
+    for value in values:
+        _value_kind(value)
+    return name, values
+
+
+def _zoom_constant(zoom: int, predicate) -> bool:
+    """Value of a zoom-dependent predicate, which must be the same over [zoom, zoom + 1)."""
+    low, high = predicate(zoom), predicate(zoom + 1 - ZOOM_RANGE_EPSILON)
+    if low != high:
+        raise UnsupportedFilterError(f"Filter changes between zoom {zoom} and {zoom + 1}")
+    return low
+
+
+def _select_step(args: List, zoom: int) -> Any:
+    """Return the output of ["step", ["zoom"], out0, stop1, out1, ...] at tile zoom `zoom`."""
+    if len(args) < 2 or len(args) % 2 != 0 or args[0] != ["zoom"]:
+        raise UnsupportedFilterError(f"Only 'step' on ['zoom'] is supported: {args!r}")
+    stops = args[2::2]
+    if not all(isinstance(stop, (int, float)) and not isinstance(stop, bool) for stop in stops):
+        raise UnsupportedFilterError(f"'step' stops must be numbers: {stops!r}")
+
+    def branch(map_zoom: float) -> int:
+        index = 0
+        for stop_index, stop in enumerate(stops):
+            if map_zoom >= stop:
+                index = stop_index + 1
+        return index
+
+    index = _zoom_constant(zoom, branch)
+    return args[1 + 2 * index]
+
+
+class _SqlCompiler:
+    """Translate one filter expression into a SQL predicate with bind parameters."""
+
+    def __init__(self, zoom: int, column_types: Dict[str, str], column_prefix: str):
+        self.zoom = zoom
+        self.column_types = column_types
+        self.column_prefix = column_prefix
+        self.params: Dict[str, Any] = {}
+
+    def param(self, value: Any) -> str:
+        name = f"filter_{len(self.params)}"
+        self.params[name] = value
+        return f":{name}"
+
+    def column(self, name: str, for_ordering: bool = False) -> str:
+        sql = self.column_prefix + '"' + name.replace('"', '""') + '"'
+        if _column_kind(self.column_types[name]) == "string":
+            if self.column_types[name] not in TEXT_TYPES:
+                sql += "::text"
+            if for_ordering:
+                # Mapbox orders strings by code point
+                sql += ' COLLATE "C"'
+        return sql
+
+    def compile(self, expression: Any) -> str:
+        if isinstance(expression, bool):
+            return "TRUE" if expression else "FALSE"
+        if not isinstance(expression, list) or not expression or not isinstance(expression[0], str):
+            raise UnsupportedFilterError(f"Unsupported filter expression: {expression!r}")
+
+        op, args = expression[0], expression[1:]
+        if op == "all":
+            return "(" + " AND ".join(self.compile(arg) for arg in args) + ")" if args else "TRUE"
+        if op == "any":
+            return "(" + " OR ".join(self.compile(arg) for arg in args) + ")" if args else "FALSE"
+        if op == "none":
+            return self.negate(self.compile(["any", *args]))
+        if op == "!":
+            if len(args) != 1:
+                raise UnsupportedFilterError("'!' expects one operand")
+            return self.negate(self.compile(args[0]))
+        if op == "step":
+            return self.compile(_select_step(args, self.zoom))
+        if op in ("has", "!has"):
+            if len(args) != 1:
+                raise UnsupportedFilterError(f"'{op}' expects one property")
+            kind, name = _operand(args[0], allow_property_name=True)
+            if kind != "property":
+                raise UnsupportedFilterError(f"'{op}' expects a property: {args!r}")
+            sql = f"{self.column(name)} IS NOT NULL" if name in self.column_types else "FALSE"
+            return sql if op == "has" else self.negate(sql)
+        if op in _COMPARISON_OPERATORS:
+            return self.comparison(op, args)
+        if op in ("in", "!in"):
+            sql = self.membership(op, args)
+            return sql if op == "in" else self.negate(sql)
+        raise UnsupportedFilterError(f"Unsupported filter operator: {op}")
+
+    @staticmethod
+    def negate(sql: str) -> str:
+        # COALESCE so a NULL predicate (missing property) negates to TRUE, as in Mapbox
+        return f"NOT COALESCE({sql}, false)"
+
+    def comparison(self, op: str, args: List) -> str:
+        op, left_kind, left, value = _parse_comparison(op, args)
+        if left_kind == "zoom":
+            result = _zoom_constant(self.zoom, lambda map_zoom: _compare_values(op, map_zoom, value))
+            return "TRUE" if result else "FALSE"
+        if left_kind == "value":
+            return "TRUE" if _compare_values(op, left, value) else "FALSE"
+        if left not in self.column_types:
+            # Missing property: compares like null
+            return "TRUE" if _compare_values(op, None, value) else "FALSE"
+
+        value_kind = _value_kind(value)
+        if value_kind == "null":
+            return {"==": f"{self.column(left)} IS NULL", "!=": f"{self.column(left)} IS NOT NULL"}.get(op, "FALSE")
+        if _column_kind(self.column_types[left]) != value_kind:
+            return "TRUE" if op == "!=" else "FALSE"
+        if op == "==":
+            return f"{self.column(left)} = {self.param(value)}"
+        if op == "!=":
+            return f"{self.column(left)} IS DISTINCT FROM {self.param(value)}"
+        return f"{self.column(left, for_ordering=True)} {op} {self.param(value)}"
+
+    def membership(self, op: str, args: List) -> str:
+        name, values = _parse_membership(op, args)
+        if name not in self.column_types:
+            return "TRUE" if any(value is None for value in values) else "FALSE"
+        column_kind = _column_kind(self.column_types[name])
+        matching = [value for value in values if _value_kind(value) == column_kind]
+        parts = []
+        if matching:
+            parts.append(f"{self.column(name)} IN ({', '.join(self.param(value) for value in matching)})")
+        if any(value is None for value in values):
+            parts.append(f"{self.column(name)} IS NULL")
+        return "(" + " OR ".join(parts) + ")" if parts else "FALSE"
+
+
+def compile_filter(expression: Any, zoom: int, column_types: Dict[str, str],
+                   column_prefix: str = "") -> Tuple[str, Dict[str, Any]]:
+    """
+    Translate a Mapbox filter into a SQL predicate for tiles of zoom `zoom`.
+
+    `column_types` maps the table's column names to their information_schema
+    data_type; `column_prefix` (e.g. "tbl.") qualifies column references.
+    Returns the predicate and its bind parameters (named filter_0, filter_1, ...).
+    Raises UnsupportedFilterError for expressions outside the supported subset.
+    """
+    compiler = _SqlCompiler(zoom, column_types, column_prefix)
+    return compiler.compile(expression), compiler.params
+
+
+def evaluate_filter(expression: Any, zoom: int, properties: Dict[str, Any]) -> bool:
+    """
+    Evaluate a Mapbox filter against the properties of one feature (missing or None
+    values are treated as absent), with the same semantics as `compile_filter`.
+    """
+    if isinstance(expression, bool):
+        return expression
+    if not isinstance(expression, list) or not expression or not isinstance(expression[0], str):
+        raise UnsupportedFilterError(f"Unsupported filter expression: {expression!r}")
+
+    op, args = expression[0], expression[1:]
+    if op == "all":
+        return all(evaluate_filter(arg, zoom, properties) for arg in args)
+    if op == "any":
+        return any(evaluate_filter(arg, zoom, properties) for arg in args)
+    if op == "none":
+        return not any(evaluate_filter(arg, zoom, properties) for arg in args)
+    if op == "!":
+        if len(args) != 1:
+            raise UnsupportedFilterError("'!' expects one operand")
+        return not evaluate_filter(args[0], zoom, properties)
+    if op == "step":
+        return evaluate_filter(_select_step(args, zoom), zoom, properties)
+    if op in ("has", "!has"):
+        if len(args) != 1:
+            raise UnsupportedFilterError(f"'{op}' expects one property")
+        kind, name = _operand(args[0], allow_property_name=True)
+        if kind != "property":
+            raise UnsupportedFilterError(f"'{op}' expects a property: {args!r}")
+        present = properties.get(name) is not None
+        return present if op == "has" else not present
+    if op in _COMPARISON_OPERATORS:
+        op, left_kind, left, value = _parse_comparison(op, args)
+        if left_kind == "zoom":
+            return _zoom_constant(zoom, lambda map_zoom: _compare_values(op, map_zoom, value))
+        if left_kind == "value":
+            return _compare_values(op, left, value)
+        return _compare_values(op, properties.get(left), value)
+    if op in ("in", "!in"):
+        name, values = _parse_membership(op, args)
+        found = any(_compare_values("==", properties.get(name), value) for value in values)
+        return found if op == "in" else not found
+    raise UnsupportedFilterError(f"Unsupported filter operator: {op}")
@@ -0,0 +1,128 @@
+"""
+Simplification pyramid shared by simplify_geometries.py and the MVT tile queries.
+
+The pyramid is described by its zoom breaks: "3,6,10,12,14" creates the levels
+geom_z_0_3 (zooms 0-3), geom_z_3_6 (zooms 4-6), geom_z_6_10 (zooms 7-10),
+geom_z_10_12 (zooms 11-12) and geom_z_12_14 (zooms 13-14); zooms above the last
+break use the original geometry.
+
+Each level's tolerance is derived from the ground resolution at the highest zoom
+of its band (the most detailed zoom it serves), so no level drops detail that
+would be visible on screen:
+    tolerance = SIMPLIFY_PIXEL_TOLERANCE * meters_per_pixel(max_zoom)
+    precision = size of one MVT tile unit (tile width / 4096) at max_zoom
+
+simplify_geometries.py comments the level columns it adds with
+POPULATING_COMMENT_PREFIX and replaces the comment with POPULATED_COMMENT_PREFIX
+once every row is filled. The tile server does not read columns marked as
+populating. Columns without a comment predate the markers and are still served;
+tiling_operations.mark_legacy_levels checks and marks them once.
+
+This module only depends on the standard library so the standalone
+simplification script can import it as well as the FastAPI app.
+"""
+
+import hashlib
+import math
+from typing import List, NamedTuple, Optional
+
+EARTH_CIRCUMFERENCE_METERS = 2 * math.pi * 6378137
+SCREEN_TILE_SIZE = 256  # Pixels per tile on screen
+MVT_EXTENT = 4096       # Units per tile in the encoded MVT
+
+DEFAULT_ZOOM_BREAKS = "3,6,10,12,14"
+DEFAULT_PIXEL_TOLERANCE = 0.5
+
+# Start of the comments marking a level column as fully populated / being populated
+POPULATED_COMMENT_PREFIX = "simplified:"
+POPULATING_COMMENT_PREFIX = "populating:"
+
+# Sub-pixel feature filtering defaults (see settings.TILE_MIN_FEATURE_*)
+DEFAULT_MIN_FEATURE_MAX_ZOOM = 6
+DEFAULT_MIN_FEATURE_PIXELS = 1.0
+
+
+class SimplificationLevel(NamedTuple):
+    column: str        # Geometry column holding this level
+    min_zoom: int      # First zoom served by the level
+    max_zoom: int      # Last zoom served by the level
+    tolerance: float   # ST_SimplifyPreserveTopology tolerance in meters
+    precision: float   # ST_ReducePrecision grid size in meters
+
+
+def meters_per_pixel(z: int) -> float:
+    """Ground resolution of one screen pixel (256px tiles) at zoom z in EPSG:3857."""
+    return EARTH_CIRCUMFERENCE_METERS / (SCREEN_TILE_SIZE * 2 ** z)
+
+
+def min_feature_size_for_zoom(z: int, max_zoom: int = DEFAULT_MIN_FEATURE_MAX_ZOOM,
+                              pixels: float = DEFAULT_MIN_FEATURE_PIXELS) -> Optional[float]:
+    """
+    Minimum bounding-box diagonal (meters) a feature needs to be drawn at zoom z,
+    or None when no sub-pixel filtering applies at this zoom.
+    """
+    if z > max_zoom or pixels <= 0:
+        return None
+    return pixels * meters_per_pixel(z)
+
+
+def parse_zoom_breaks(spec: str) -> List[int]:
+    """Parse a comma separated list of increasing zoom breaks, e.g. "3,6,10"."""
+    breaks = [int(part) for part in spec.split(",") if part.strip()]
+    if not breaks or breaks != sorted(set(breaks)) or breaks[0] < 0:
+        raise ValueError(f"Invalid zoom breaks '{spec}': expected increasing, non-negative zoom levels")
+    return breaks
+
+
+def build_pyramid(zoom_breaks: List[int], pixel_tolerance: float = DEFAULT_PIXEL_TOLERANCE) -> List[SimplificationLevel]:
+    """Create the simplification levels for the given zoom breaks, coarsest first."""
+    levels = []
+    previous_break = 0
+    for index, max_zoom in enumerate(zoom_breaks):
+        resolution = meters_per_pixel(max_zoom)
+        levels.append(SimplificationLevel(
+            column=f"geom_z_{previous_break}_{max_zoom}",
+            min_zoom=0 if index == 0 else previous_break + 1,
+            max_zoom=max_zoom,
+            tolerance=round(pixel_tolerance * resolution, 2),
+            precision=round(resolution * SCREEN_TILE_SIZE / MVT_EXTENT, 3),
+        ))
+        previous_break = max_zoom
+    return levels
+
+
+def populated_level_comment(level: SimplificationLevel) -> str:
+    """Column comment marking a level as populated with its current tolerance and precision."""
+    return (
+        f"{POPULATED_COMMENT_PREFIX} zooms {level.min_zoom}-{level.max_zoom}, "
+        f"tolerance {level.tolerance:g}m, precision {level.precision:g}m"
+    )
+
+
+def populating_level_comment(level: SimplificationLevel) -> str:
+    """Column comment keeping the tile server off a level until all of its rows are filled."""
+    return f"{POPULATING_COMMENT_PREFIX} zooms {level.min_zoom}-{level.max_zoom}, not served until filled"
+
+
+def pyramid_signature(levels: List[SimplificationLevel]) -> str:
+    """Short hash of the level columns, tolerances and precisions, e.g. to key population progress."""
+    spec = ";".join(f"{level.column}:{level.tolerance!r}:{level.precision!r}" for level in levels)
+    return hashlib.md5(spec.encode()).hexdigest()[:16]
+
+
+def level_for_zoom(levels: List[SimplificationLevel], z: int,
+                   available_columns: Optional[List[str]] = None) -> Optional[SimplificationLevel]:
+    """
+    Return the level serving zoom z, or None when the original geometry should be used.
+
+    If `available_columns` (the servable level columns of a table) is given,
+    levels that are missing or still being populated (e.g. the table was
+    simplified with an older pyramid) are skipped in favour of the next more
+    detailed level that is available.
+    """
+    for level in levels:
+        if level.max_zoom < z:
+            continue
+        if available_columns is None or level.column in available_columns:
+            return level
+    return None
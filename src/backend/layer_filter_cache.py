@@ -0,0 +1,204 @@
+"""
+Process-wide cache of the layer_filters table.
+
+The table is tiny and rarely edited, yet it used to be queried on every filter
+lookup (map layer loading, the /layer_filters endpoints and the tiling filter
+route). It is now loaded once at startup and kept in memory:
+
+- a statement-level trigger on layer_filters sends NOTIFY layer_filters_changed
+  after every change, and a background thread LISTENing on that channel reloads
+  the cache right away
+- as a fallback (trigger could not be installed, notification missed while the
+  listener was reconnecting), a background refresh thread also reloads the cache
+  once it is older than `settings.LAYER_FILTER_CACHE_TTL_SECONDS`, and retries
+  every LOAD_RETRY_SECONDS after a failed load
+
+Lookups never query the database: they read the current snapshot, even when it
+is stale (or empty, until the first load succeeds).
+"""
+
+import logging
+import select
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from .config import settings
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "layer_filters_changed"
+
+NOTIFY_TRIGGER_SQL = f"""
+    CREATE OR REPLACE FUNCTION notify_layer_filters_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{NOTIFY_CHANNEL}', TG_OP);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS layer_filters_changed ON layer_filters;
+    CREATE TRIGGER layer_filters_changed
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON layer_filters
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_layer_filters_changed();
+"""
+
+# Seconds to wait before reconnecting a broken listener connection / retrying a failed load
+LISTEN_RETRY_SECONDS = 5
+LOAD_RETRY_SECONDS = 5
+
+# How often the refresh thread checks the age of the snapshot
+REFRESH_CHECK_SECONDS = 1.0
+
+# Snapshot of the table, replaced as a whole on reload so readers never see a partial state
+_records: List[Dict] = []              # Every row ({id, layer_name, layer_filter}), ordered by id
+_by_name: Dict[str, Optional[Any]] = {}  # layer_name -> layer_filter of its first row
+_loaded_at: Optional[float] = None
+_load_lock = threading.Lock()
+
+_listener_thread: Optional[threading.Thread] = None
+_refresh_thread: Optional[threading.Thread] = None
+_stop_event = threading.Event()
+
+
+def reload():
+    """Load the whole layer_filters table into memory."""
+    global _records, _by_name, _loaded_at
+    with _load_lock:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT id, layer_name, layer_filter FROM layer_filters ORDER BY id")
+            ).fetchall()
+
+        records = [
+            {"id": row.id, "layer_name": row.layer_name, "layer_filter": row.layer_filter}
+            for row in rows
+        ]
+        by_name: Dict[str, Optional[Any]] = {}
+        for record in records:
+            by_name.setdefault(record["layer_name"], record["layer_filter"])
+
+        _records, _by_name, _loaded_at = records, by_name, time.time()
+    logger.info("Loaded %d layer filters into memory", len(records))
+
+
+def get_filter(layer_name: str) -> Optional[Any]:
+    """Return the stored filter of a layer (None if it has no record or an empty filter)."""
+    return _by_name.get(layer_name)
+
+
+def get_filters_for_names(layer_names: List[str]) -> Dict[str, Any]:
+    """Return {layer_name: filter} for the given layers that have a non-empty filter."""
+    by_name = _by_name
+    return {name: by_name[name] for name in set(layer_names) if by_name.get(name)}
+
+
+def get_all_records() -> List[Dict]:
+    """Return every layer_filters row as {id, layer_name, layer_filter} dicts, ordered by id."""
+    return _records
+
+
+def get_record(layer_name: str) -> Optional[Dict]:
+    """Return the first layer_filters row of a layer, or None."""
+    for record in get_all_records():
+        if record["layer_name"] == layer_name:
+            return record
+    return None
+
+
+def get_layer_names() -> List[str]:
+    return list(_by_name)
+
+
+def install_notify_trigger():
+    """Create (or replace) the trigger that notifies listeners of layer_filters changes."""
+    with engine.begin() as conn:
+        conn.execute(text(NOTIFY_TRIGGER_SQL))
+
+
+def _listen():
+    """Reload the cache whenever a notification arrives on NOTIFY_CHANNEL, reconnecting on errors."""
+    while not _stop_event.is_set():
+        connection = None
+        try:
+            # A dedicated connection, detached from the pool so it does not hold a pool slot
+            connection = engine.raw_connection()
+            connection.detach()
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            # Changes made while we were not listening are picked up by this reload
+            reload()
+
+            while not _stop_event.is_set():
+                if select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                if dbapi_connection.notifies:
+                    dbapi_connection.notifies.clear()
+                    reload()
+        except Exception as e:
+            logger.error("Layer filter listener error: %s, retrying in %ss", e, LISTEN_RETRY_SECONDS)
+            _stop_event.wait(LISTEN_RETRY_SECONDS)
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+def _refresh():
+    """Reload the snapshot once it is older than the TTL, or LOAD_RETRY_SECONDS after a failed load."""
+    next_attempt = 0.0
+    while not _stop_event.wait(REFRESH_CHECK_SECONDS):
+        now = time.time()
+        if now < next_attempt:
+            continue
+        if _loaded_at is not None and now - _loaded_at <= settings.LAYER_FILTER_CACHE_TTL_SECONDS:
+            continue
+        try:
+            reload()
+        except Exception as e:
+            next_attempt = now + LOAD_RETRY_SECONDS
+            logger.warning("Could not reload layer filters, serving the previous snapshot: %s", e)
+
+
+def start():
+    """
+    Load the cache, then start the refresh thread and listen for changes. Called
+    once on application startup. Failures are logged, not raised: the refresh
+    thread retries the load in the background.
+    """
+    global _listener_thread, _refresh_thread
+    try:
+        reload()
+    except Exception as e:
+        logger.warning("Could not load layer filters at startup: %s", e)
+
+    _stop_event.clear()
+    _refresh_thread = threading.Thread(target=_refresh, name="layer-filter-refresh", daemon=True)
+    _refresh_thread.start()
+
+    if not settings.LAYER_FILTER_LISTEN:
+        return
+    try:
+        install_notify_trigger()
+    except Exception as e:
+        logger.warning("Could not install the layer_filters notify trigger, relying on TTL reloads: %s", e)
+        return
+
+    _listener_thread = threading.Thread(target=_listen, name="layer-filter-listener", daemon=True)
+    _listener_thread.start()
+
+
+def stop():
+    """Stop the listener and refresh threads. Called on application shutdown."""
+    _stop_event.set()
+    for thread in (_listener_thread, _refresh_thread):
+        if thread is not None:
+            thread.join(timeout=5)
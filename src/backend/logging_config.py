@@ -0,0 +1,122 @@
+"""
+Logging of the backend package.
+
+Modules log through `logging.getLogger(__name__)` instead of printing. Records
+of every backend logger are:
+
+- dropped below settings.LOG_LEVEL (per-logger levels: LOG_LEVELS)
+- sampled when they carry an `event` listed in LOG_SAMPLE_RATES, e.g.
+  `logger.info("Served tile %s", tile, extra={"event": "tile_cache_hit"})` is
+  kept for 1% of tiles with {"tile_cache_hit": 0.01}
+- put on a bounded in-memory queue and written to stderr by a background
+  thread, so request threads never wait on the terminal. When the queue is
+  full, records are dropped and counted instead of blocking.
+
+LOG_FORMAT=json writes one JSON object per line (with the `extra` fields of the
+record), LOG_FORMAT=text a plain human-readable line.
+"""
+
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+from .config import settings
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_dropped_records = 0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including the fields passed with `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the records of high-volume events (see LOG_SAMPLE_RATES)."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = {event: float(rate) for event, rate in rates.items()}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, "event", None))
+        return rate is None or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only resolve the message arguments here; formatting (and the traceback)
+        # is left to the writer thread so JsonFormatter still sees exc_info
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global _dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped_records += 1
+
+
+def get_dropped_records() -> int:
+    """Records lost because the log queue was full."""
+    return _dropped_records
+
+
+def configure_logging():
+    """Install the queue handler on the backend package logger and start its writer thread."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+
+    package_logger = logging.getLogger(__package__)
+    package_logger.handlers = [queue_handler]
+    package_logger.setLevel(settings.LOG_LEVEL.upper())
+    package_logger.propagate = False
+    for name, level in settings.LOG_LEVELS.items():
+        logging.getLogger(f"{__package__}.{name}").setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    _listener.start()
+
+
+def stop_logging():
+    """Write the records still queued and stop the writer thread. Called on shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,192 @@
+"""
+In-process outbound mail queue.
+
+Request handlers used to open a TLS SMTP connection, log in and send inside the
+request, so their response time depended on the mail server. They now only
+`enqueue` the message; a background asyncio worker delivers it:
+
+- one SMTP connection is kept open and reused for consecutive messages, and
+  closed after `settings.MAIL_IDLE_CLOSE_SECONDS` without mail
+- messages waiting in the queue are sent in batches of up to
+  `settings.MAIL_BATCH_SIZE` over that connection
+- failed messages are retried with exponential backoff, up to
+  `settings.MAIL_MAX_RETRIES` times, on a fresh connection
+
+Recipients are personal data: the logs only report counts and error types.
+
+Set SMTP_START_TLS=false and leave SMTP_USERNAME empty to deliver to a plain
+local SMTP server (e.g. `python -m aiosmtpd -n` during tests).
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, NamedTuple, Optional
+
+import aiosmtplib  # type: ignore[import-untyped]
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Delay before the first retry, doubled on every further attempt
+RETRY_BASE_SECONDS = 2
+
+
+class OutgoingMail(NamedTuple):
+    sender: str
+    recipient: str
+    message: str
+    attempts: int = 0
+
+
+_queue: Optional[asyncio.Queue] = None
+_worker_task: Optional[asyncio.Task] = None
+_client: Optional[aiosmtplib.SMTP] = None
+_retry_handles: List[asyncio.TimerHandle] = []
+_stats = {"sent": 0, "failed": 0, "retried": 0, "connections": 0}
+
+
+def _ensure_started():
+    """Create the queue and worker on first use (must be called from the event loop)."""
+    global _queue, _worker_task
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=settings.MAIL_QUEUE_MAX_SIZE)
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.get_running_loop().create_task(_worker(), name="mail-queue-worker")
+
+
+def enqueue(sender: str, recipient: str, message: str):
+    """
+    Queue a message for delivery and return immediately.
+    Raises asyncio.QueueFull when MAIL_QUEUE_MAX_SIZE messages are already waiting.
+    """
+    _ensure_started()
+    _queue.put_nowait(OutgoingMail(sender, recipient, message))
+
+
+def queue_depth() -> int:
+    """Messages waiting for delivery, including those waiting for a retry."""
+    waiting = _queue.qsize() if _queue is not None else 0
+    return waiting + len(_retry_handles)
+
+
+def get_stats() -> dict:
+    return {**_stats, "queue_depth": queue_depth(), "connected": _client is not None and _client.is_connected}
+
+
+async def _connect() -> aiosmtplib.SMTP:
+    """Return the pooled SMTP connection, (re)connecting if needed."""
+    global _client
+    if _client is not None and _client.is_connected:
+        return _client
+    client = aiosmtplib.SMTP(
+        hostname=settings.SMTP_SERVER, port=settings.SMTP_PORT, start_tls=settings.SMTP_START_TLS
+    )
+    await client.connect()
+    if settings.SMTP_USERNAME:
+        await client.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+    _client = client
+    _stats["connections"] += 1
+    return client
+
+
+async def _disconnect():
+    global _client
+    client, _client = _client, None
+    if client is not None and client.is_connected:
+        try:
+            await client.quit()
+        except Exception:
+            client.close()
+
+
+def _schedule_retry(mail: OutgoingMail):
+    attempts = mail.attempts + 1
+    if attempts > settings.MAIL_MAX_RETRIES:
+        _stats["failed"] += 1
+        logger.error("Giving up on an email after %d retries", mail.attempts, extra={"event": "mail_failed"})
+        return
+    delay = RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    _stats["retried"] += 1
+
+    def requeue():
+        _retry_handles.remove(handle)
+        try:
+            _queue.put_nowait(mail._replace(attempts=attempts))
+        except asyncio.QueueFull:
+            _schedule_retry(mail._replace(attempts=attempts))
+
+    handle = asyncio.get_running_loop().call_later(delay, requeue)
+    _retry_handles.append(handle)
+
+
+async def _send_batch(batch: List[OutgoingMail]) -> int:
+    """Send a batch over the pooled connection; returns the number of messages delivered."""
+    sent = 0
+    for mail in batch:
+        try:
+            client = await _connect()
+            await client.sendmail(mail.sender, [mail.recipient], mail.message)
+            _stats["sent"] += 1
+            sent += 1
+        except Exception as e:
+            # Only the error type: SMTP errors may quote the recipient, which is personal data
+            logger.warning(
+                "Error sending an email (attempt %d): %s", mail.attempts + 1, type(e).__name__,
+                extra={"event": "mail_send_error"},
+            )
+            # The connection may be unusable; the rest of the batch uses a new one
+            await _disconnect()
+            _schedule_retry(mail)
+    return sent
+
+
+async def _worker():
+    while True:
+        try:
+            mail = await asyncio.wait_for(_queue.get(), timeout=settings.MAIL_IDLE_CLOSE_SECONDS)
+        except asyncio.TimeoutError:
+            await _disconnect()  # Idle: do not hold the SMTP connection open
+            continue
+
+        batch = [mail]
+        while len(batch) < settings.MAIL_BATCH_SIZE and not _queue.empty():
+            batch.append(_queue.get_nowait())
+
+        start_time = time.perf_counter()
+        sent = await _send_batch(batch)
+        for _ in batch:
+            _queue.task_done()
+        logger.info(
+            "Sent %d of %d emails in %.2fs (%d waiting)",
+            sent, len(batch), time.perf_counter() - start_time, queue_depth(),
+            extra={"event": "mail_batch_sent"},
+        )
+
+
+async def start():
+    """Start the delivery worker. Called on application startup."""
+    _ensure_started()
+
+
+async def stop(timeout: float = 5.0):
+    """Give queued mail `timeout` seconds to go out, then stop the worker and close the connection."""
+    global _worker_task
+    if _queue is not None and _worker_task is not None and not _worker_task.done():
+        try:
+            await asyncio.wait_for(_queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Shutting down with %d undelivered emails", queue_depth())
+    if _worker_task is not None:
+        # Cancel until the worker is gone: a cancellation can be swallowed (e.g. by
+        # wait_for() before Python 3.12 when the queue hands over a message at that moment)
+        while not _worker_task.done():
+            _worker_task.cancel()
+            await asyncio.wait({_worker_task}, timeout=0.1)
+        _worker_task = None
+    # Only now, since the worker may have scheduled retries until it stopped
+    for handle in _retry_handles:
+        handle.cancel()
+    _retry_handles.clear()
+    await _disconnect()
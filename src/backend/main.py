@@ -1,12 +1,19 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import threading
 from fastapi.openapi.utils import get_openapi  # Import get_openapi
 
 from .database import create_db_tables
+from . import layer_filter_cache, mail_queue, metrics, tiling_operations
+from .logging_config import configure_logging, stop_logging
 from .auth_routes import router as auth_router
 from .data_routes import router as data_router
 from .tiling_routes import router as tiling_router
+from .rate_limit import RateLimitMiddleware
+
+# Queue-based logging of the backend modules (LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES)
+configure_logging()
 
 
 # Define the lifespan context manager for startup/shutdown events
@@ -20,9 +27,18 @@ async def lifespan(app: FastAPI):
     print("Creating database tables if they don't exist...")
     create_db_tables()
     print("Database tables creation complete.")
+    # Load layer filters into memory and listen for changes to them
+    layer_filter_cache.start()
+    # Mark the simplification levels of tables simplified before level markers existed
+    threading.Thread(target=tiling_operations.mark_legacy_levels, name="legacy-levels", daemon=True).start()
+    # Background delivery of outgoing emails
+    await mail_queue.start()
     yield  # Application starts here
     # Code after yield runs on shutdown (optional for this example)
+    await mail_queue.stop()
+    layer_filter_cache.stop()
     print("FastAPI application is shutting down.")
+    stop_logging()
 
 
 # Initialize FastAPI app, passing the lifespan context manager
@@ -67,7 +83,7 @@ def custom_openapi():
 # Apply the custom OpenAPI function to the FastAPI app
 app.openapi = custom_openapi
 
-# Configure CORS middleware
+# Configure CORS middleware (exposed headers are readable by the frontend's fetch calls)
 # Adjust `allow_origins` to your frontend's URL in a production environment.
 origins = [
     "http://localhost",
@@ -75,12 +91,17 @@ origins = [
     "http://localhost:5173",  # Your React app's development port
 ]
 
+# Rate limit logins and catalog listings per user/IP (tile misses are limited in the tile route).
+# Added before CORS so the CORS middleware wraps it and its 429 responses carry CORS headers.
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Tile-Fallback", "Retry-After"],
 )
 
 # --- Include Routers ---
@@ -96,3 +117,14 @@ app.include_router(tiling_router, prefix="/api")
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to the FastAPI backend!"}
+
+
+# Prometheus metrics (tile latency/outcomes, cache, pools and queues), see metrics.py.
+# Internal only: restricted to METRICS_ALLOWED_NETWORKS / METRICS_TOKEN.
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    client_host = request.client.host if request.client else None
+    if not metrics.scrape_allowed(client_host, request.headers.get("authorization")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Metrics are internal")
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,125 @@
+"""
+Prometheus metrics, served by GET /metrics.
+
+Tile requests are labelled with the table, the zoom band of the simplification
+pyramid (e.g. "4-6") and the outcome:
+
+- "disk": served from the local tile cache
+- "memory": generated from the in-memory feature store
+- "miss": generated by PostGIS
+- "empty": no features in the tile
+- "cancelled" / "timeout" / "error": no tile was produced
+
+/metrics is internal: it is only served to METRICS_ALLOWED_NETWORKS and, with
+METRICS_TOKEN set, to scrapers sending that bearer token (see `scrape_allowed`).
+
+The table label is empty until the tile worker has found the table, so
+requests for unknown table names cannot add series.
+
+Pool and queue gauges (DB pools, password hashing pool, mail and log queues)
+are read when the endpoint is scraped; the tile executor gauges are kept up to
+date by `tiling_operations.submit_tile`.
+"""
+
+import hmac
+import ipaddress
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+from . import auth, mail_queue
+from .config import settings
+from .database import engine, rate_limit_engine, replica_engines, tile_engine
+from .logging_config import get_dropped_records
+
+TILE_REQUESTS = Counter(
+    "tile_requests_total", "MVT tile requests", ["table", "zoom_band", "outcome"]
+)
+TILE_REQUEST_SECONDS = Histogram(
+    "tile_request_seconds", "Time to serve an MVT tile", ["table", "zoom_band", "outcome"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+TILE_DB_QUERY_SECONDS = Histogram(
+    "tile_db_query_seconds", "Duration of a single PostGIS tile query", ["table", "zoom_band"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+TILE_BYTES = Histogram(
+    "tile_bytes", "Size of served MVT tiles", ["table", "zoom_band"],
+    buckets=(1024, 4096, 16384, 65536, 131072, 262144, 524288, 1048576, 4194304),
+)
+TILE_CACHE_SIZE_BYTES = Gauge("tile_cache_size_bytes", "Size of the local tile cache after the last cleanup check")
+TILE_CACHE_EVICTIONS = Counter("tile_cache_evictions_total", "Tiles deleted from the local cache to stay under its limit")
+TILE_CACHE_EVICTED_BYTES = Counter("tile_cache_evicted_bytes_total", "Bytes deleted from the local tile cache")
+RATE_LIMITED_REQUESTS = Counter("rate_limited_requests_total", "Requests rejected with HTTP 429", ["budget"])
+RATE_LIMIT_STORE_ERRORS = Counter(
+    "rate_limit_store_errors_total", "Rate limit checks that failed and let the request through"
+)
+TILE_EXECUTOR_QUEUE_DEPTH = Gauge("tile_executor_queue_depth", "Tiles waiting for a tile worker thread")
+TILE_EXECUTOR_IN_FLIGHT = Gauge("tile_executor_in_flight", "Tiles being generated by a tile worker thread")
+
+
+class PoolCollector:
+    """Reports DB pool usage and the password/mail queues at scrape time."""
+
+    def collect(self):
+        pool_size = GaugeMetricFamily("db_pool_size", "Connections kept open by the pool", labels=["pool"])
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections currently in use", labels=["pool"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Connections opened beyond the pool size", labels=["pool"])
+        pools = [("crud", engine), ("tile", tile_engine)]
+        if rate_limit_engine is not None:
+            pools.append(("rate_limit", rate_limit_engine))
+        pools += [(f"replica:{replica.url.host}", replica) for replica in replica_engines]
+        for name, pool_engine in pools:
+            pool = pool_engine.pool
+            pool_size.add_metric([name], pool.size())
+            checked_out.add_metric([name], pool.checkedout())
+            overflow.add_metric([name], max(0, pool.overflow()))
+        yield pool_size
+        yield checked_out
+        yield overflow
+
+        password_metrics = auth.get_password_hash_metrics()
+        yield GaugeMetricFamily(
+            "password_hash_pending", "Password hash/verify calls queued or running", value=password_metrics["pending"]
+        )
+        yield GaugeMetricFamily(
+            "password_hash_rejected", "Password calls refused because the pool was full", value=password_metrics["rejected"]
+        )
+        yield GaugeMetricFamily("mail_queue_depth", "Emails waiting for delivery", value=mail_queue.queue_depth())
+        yield GaugeMetricFamily(
+            "log_records_dropped", "Log records lost because the log queue was full", value=get_dropped_records()
+        )
+
+
+REGISTRY.register(PoolCollector())
+
+
+def observe_tile(table: str, zoom_band: str, outcome: str, seconds: float, size: int = 0):
+    """Record one tile request (`table` is "" when the table is not known to exist)."""
+    TILE_REQUESTS.labels(table, zoom_band, outcome).inc()
+    TILE_REQUEST_SECONDS.labels(table, zoom_band, outcome).observe(seconds)
+    if size:
+        TILE_BYTES.labels(table, zoom_band).observe(size)
+
+
+_allowed_networks = [ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_NETWORKS]
+
+
+def scrape_allowed(client_host: Optional[str], authorization: Optional[str]) -> bool:
+    """Whether a client may read /metrics (direct peer address only, X-Forwarded-For is ignored)."""
+    try:
+        address = ipaddress.ip_address(client_host or "")
+    except ValueError:
+        return False
+    if not any(address in network for network in _allowed_networks):
+        return False
+    if settings.METRICS_TOKEN:
+        scheme, _, token = (authorization or "").partition(" ")
+        return scheme.lower() == "bearer" and hmac.compare_digest(token, settings.METRICS_TOKEN)
+    return True
+
+
+def render():
+    """Return (body, content type) of the metrics page."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,214 @@
+"""
+Token-bucket rate limiting keyed by user (or client IP for anonymous requests).
+
+Each budget has a refill rate (tokens per second) and a burst size (bucket
+capacity), see the RATE_LIMIT_* settings:
+
+- "tile_miss": tiles that have to be generated by PostGIS. Checked in the tile
+  route only on cache misses, so cached tiles are never limited.
+- "login": POST /api/auth/login, against brute force (each attempt costs a
+  bcrypt verify).
+- "catalog": GET /api/data/layers/tables.
+
+Login and catalog are enforced by `RateLimitMiddleware`. Buckets live in memory
+by default (one set per worker process); with RATE_LIMIT_BACKEND=postgres they
+are kept in an UNLOGGED table so every worker and instance shares them, using
+their own small pool (RATE_LIMIT_DB_*).
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from jose import JWTError, jwt
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from . import metrics
+from .config import settings
+from .database import rate_limit_engine
+
+logger = logging.getLogger(__name__)
+
+# Budget name -> (refill rate in tokens/second, burst). A rate of 0 disables the budget.
+BUDGETS: Dict[str, Tuple[float, float]] = {
+    "tile_miss": (settings.RATE_LIMIT_TILE_MISS_RATE, settings.RATE_LIMIT_TILE_MISS_BURST),
+    "login": (settings.RATE_LIMIT_LOGIN_RATE, settings.RATE_LIMIT_LOGIN_BURST),
+    "catalog": (settings.RATE_LIMIT_CATALOG_RATE, settings.RATE_LIMIT_CATALOG_BURST),
+}
+
+# (method, path) -> budget enforced by RateLimitMiddleware
+MIDDLEWARE_BUDGETS = {
+    ("POST", "/api/auth/login"): "login",
+    ("GET", "/api/data/layers/tables"): "catalog",
+}
+
+
+class InMemoryRateLimitStore:
+    """Token buckets of this process."""
+
+    # Once the store tracks more keys than this, buckets idle for PRUNE_IDLE_SECONDS are dropped
+    MAX_KEYS = 100000
+    PRUNE_IDLE_SECONDS = 3600
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated at)
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        """Take `cost` tokens from a bucket. Returns (allowed, seconds until allowed)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def _prune(self, now: float):
+        self._buckets = {
+            key: bucket
+            for key, bucket in self._buckets.items()
+            if now - bucket[1] < self.PRUNE_IDLE_SECONDS
+        }
+
+
+class PostgresRateLimitStore:
+    """Token buckets shared by every process through an UNLOGGED table."""
+
+    CREATE_TABLE_SQL = text("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+            key text PRIMARY KEY,
+            tokens double precision NOT NULL,
+            allowed boolean NOT NULL,
+            updated_at timestamptz NOT NULL
+        )
+    """)
+
+    # Every SET expression sees the old row, so the refilled token count is the same in each
+    CONSUME_SQL = text("""
+        INSERT INTO rate_limit_buckets AS b (key, tokens, allowed, updated_at)
+        VALUES (:key, :burst - :cost, true, now())
+        ON CONFLICT (key) DO UPDATE SET
+            allowed = LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM now() - b.updated_at) * :rate) >= :cost,
+            tokens = LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM now() - b.updated_at) * :rate)
+                     - CASE
+                           WHEN LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM now() - b.updated_at) * :rate) >= :cost
+                           THEN :cost ELSE 0
+                       END,
+            updated_at = now()
+        RETURNING allowed, tokens
+    """)
+
+    PRUNE_SQL = text("DELETE FROM rate_limit_buckets WHERE updated_at < now() - interval '1 hour'")
+    PRUNE_INTERVAL_SECONDS = 300
+
+    def __init__(self):
+        self._table_ready = False
+        self._pruned_at = time.monotonic()
+
+    def consume(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        with rate_limit_engine.begin() as conn:
+            if not self._table_ready:
+                conn.execute(self.CREATE_TABLE_SQL)
+                self._table_ready = True
+            allowed, tokens = conn.execute(
+                self.CONSUME_SQL, {"key": key, "rate": rate, "burst": burst, "cost": cost}
+            ).one()
+            if time.monotonic() - self._pruned_at > self.PRUNE_INTERVAL_SECONDS:
+                self._pruned_at = time.monotonic()
+                conn.execute(self.PRUNE_SQL)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+_store = PostgresRateLimitStore() if settings.RATE_LIMIT_BACKEND == "postgres" else InMemoryRateLimitStore()
+
+
+def client_key(request: Request) -> str:
+    """
+    Identify the caller: "user:<username>" for a valid bearer token, "ip:<address>" otherwise.
+    The token is verified so clients cannot spread requests over made-up users.
+    """
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except JWTError:
+            pass
+
+    address = request.client.host if request.client else "unknown"
+    if settings.RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            address = forwarded.split(",")[0].strip()
+    return f"ip:{address}"
+
+
+def check_rate_limit(request: Request, budget: str, key: Optional[str] = None) -> Optional[float]:
+    """
+    Take one token from the caller's bucket for `budget`.
+    Returns None if the request may proceed, or the number of seconds to wait.
+    Errors of the shared backend are logged and let the request through.
+    """
+    rate, burst = BUDGETS[budget]
+    if not settings.RATE_LIMIT_ENABLED or rate <= 0:
+        return None
+    key = key or client_key(request)
+    try:
+        allowed, retry_after = _store.consume(f"{budget}:{key}", rate, burst)
+    except Exception as e:
+        metrics.RATE_LIMIT_STORE_ERRORS.inc()
+        logger.warning(
+            "Rate limit store error, allowing request: %s", e, extra={"event": "rate_limit_store_error"}
+        )
+        return None
+    if allowed:
+        return None
+    metrics.RATE_LIMITED_REQUESTS.labels(budget).inc()
+    logger.info(
+        "Rate limited %s on '%s' (retry in %.1fs)", key, budget, retry_after, extra={"event": "rate_limited"}
+    )
+    return retry_after
+
+
+def _retry_after_header(retry_after: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, int(retry_after + 0.999)))}
+
+
+def enforce_rate_limit(request: Request, budget: str):
+    """Raise HTTP 429 if the caller has exhausted `budget` (for use inside routes)."""
+    retry_after = check_rate_limit(request, budget)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please slow down.",
+            headers=_retry_after_header(retry_after),
+        )
+
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """Applies the budgets of MIDDLEWARE_BUDGETS before the request reaches its route."""
+
+    async def dispatch(self, request: Request, call_next):
+        budget = MIDDLEWARE_BUDGETS.get((request.method, request.url.path))
+        if budget is not None:
+            # The shared backend queries the database, keep it off the event loop
+            retry_after = await run_in_threadpool(check_rate_limit, request, budget)
+            if retry_after is not None:
+                return JSONResponse(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    content={"detail": "Too many requests, please slow down."},
+                    headers=_retry_after_header(retry_after),
+                )
+        return await call_next(request)
@@ -99,10 +99,11 @@ class ColumnSchema(BaseModel):
 class TableSchema(BaseModel):
     """Schema for a database table, including its columns and geometry type."""
     name: str
-    columns: List[ColumnSchema]
+    columns: Optional[List[ColumnSchema]] = None  # Omitted when listing with include_columns=false
     geometry_type: Optional[str] = None # Added geometry_type field
     srid: Optional[int] = None  # Added SRID field for spatial reference
     feature_count: Optional[int] = None  # Added count field for number of rows
+    feature_count_exact: bool = False  # False when feature_count is a planner estimate
 
 class MapLayerBase(BaseModel):
     name: str
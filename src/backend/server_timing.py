@@ -0,0 +1,47 @@
+"""
+Per-request Server-Timing headers (https://www.w3.org/TR/server-timing/).
+
+Routes measure their phases (metadata lookups, PostGIS queries, cache I/O,
+serialization...) and return them in a Server-Timing header, which browsers
+show in the Timing tab of the network panel. Timing-Allow-Origin lets the
+frontend, served from another origin, see them too.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class ServerTiming:
+    """Durations of the phases of one request, in the order they were first measured."""
+
+    def __init__(self):
+        self._started_at = time.perf_counter()
+        self._durations: Dict[str, float] = {}     # phase -> milliseconds (summed over repeats)
+        self._descriptions: Dict[str, str] = {}    # entry -> text, for debug values without a duration
+
+    @contextmanager
+    def measure(self, phase: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start_time)
+
+    def add(self, phase: str, seconds: float):
+        self._durations[phase] = self._durations.get(phase, 0.0) + seconds * 1000
+
+    def describe(self, name: str, value):
+        """Add an entry without duration, e.g. a feature count in debug mode."""
+        self._descriptions[name] = str(value)
+
+    def header_value(self) -> str:
+        entries = [f"{phase};dur={ms:.1f}" for phase, ms in self._durations.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self._started_at) * 1000:.1f}")
+        for name, value in self._descriptions.items():
+            escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+            entries.append(f'{name};desc="{escaped}"')
+        return ", ".join(entries)
+
+    def headers(self) -> Dict[str, str]:
+        return {"Server-Timing": self.header_value(), "Timing-Allow-Origin": "*"}
@@ -4,21 +4,55 @@ Geometry Simplification Script for MVT Tiling Performance
 
 This script adds pre-simplified geometry columns to a table for different zoom levels
 to improve MVT tile generation performance. Only works with non-point geometries.
+The levels and their tolerances come from the simplification pyramid in
+geometry_pyramid.py (SIMPLIFY_ZOOM_BREAKS / SIMPLIFY_PIXEL_TOLERANCE).
 
 Usage:
-    python simplify_geometries.py <table_name>
+    python simplify_geometries.py <table_name> [--batch-size N] [--workers N] [--restart]
+                                  [--install-triggers | --uninstall-triggers]
+    python simplify_geometries.py --all [--processes N] [--max-connections N] [...]
+    python simplify_geometries.py <table_name> --report-dir reports [--report-only]
 
 Example:
-    python simplify_geometries.py countries
+    python simplify_geometries.py countries --workers 8
+    python simplify_geometries.py --all --processes 3 --workers 4 --max-connections 15
+
+Rows are simplified in primary-key batches (heap page batches for tables without
+an integer primary key) by a pool of workers, committing per batch. Progress is recorded in public.simplify_progress so an interrupted run
+resumes from the last completed batches. Rows inserted or edited afterwards are
+backfilled on the next run, or kept current by a trigger with --install-triggers.
 """
 
+import argparse
+import json
+import statistics
 import sys
 import time
 import os
+from datetime import datetime, timezone
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from itertools import islice
 from sqlalchemy import text, create_engine
 from sqlalchemy.orm import sessionmaker
+import mercantile
 from dotenv import load_dotenv
 
+from geometry_pyramid import (
+    DEFAULT_MIN_FEATURE_MAX_ZOOM,
+    DEFAULT_MIN_FEATURE_PIXELS,
+    DEFAULT_PIXEL_TOLERANCE,
+    DEFAULT_ZOOM_BREAKS,
+    POPULATING_COMMENT_PREFIX,
+    build_pyramid,
+    level_for_zoom,
+    min_feature_size_for_zoom,
+    parse_zoom_breaks,
+    populated_level_comment,
+    populating_level_comment,
+    pyramid_signature,
+)
+from tile_queries import SERVED_COLUMNS_SQL, build_polygon_query, is_derived_column
+
 # Load environment variables
 load_dotenv(dotenv_path="../../.env.local")
 
@@ -29,6 +63,19 @@ if not database_url:
     print("Make sure DOCKER_DATABASE_URL or DATABASE_URL is set in .env.local")
     sys.exit(1)
 
+# Simplification pyramid, configured the same way as the tile server (see config.py)
+SIMPLIFICATION_LEVELS = build_pyramid(
+    parse_zoom_breaks(os.getenv("SIMPLIFY_ZOOM_BREAKS", DEFAULT_ZOOM_BREAKS)),
+    float(os.getenv("SIMPLIFY_PIXEL_TOLERANCE", DEFAULT_PIXEL_TOLERANCE)),
+)
+# Progress is recorded per pyramid: changing the levels recomputes every batch
+PYRAMID_SIGNATURE = pyramid_signature(SIMPLIFICATION_LEVELS)
+
+# Sub-pixel filtering as applied by the tile server, for tile size estimates
+MIN_FEATURE_MAX_ZOOM = int(os.getenv("TILE_MIN_FEATURE_MAX_ZOOM", DEFAULT_MIN_FEATURE_MAX_ZOOM))
+MIN_FEATURE_PIXELS = float(os.getenv("TILE_MIN_FEATURE_PIXELS", DEFAULT_MIN_FEATURE_PIXELS))
+SMALL_FEATURES_AS_POINTS = os.getenv("TILE_SMALL_FEATURES_AS_POINTS", "false").lower() == "true"
+
 # Create engine and session factory
 engine = create_engine(database_url, echo=False)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -97,14 +144,13 @@ def add_geometry_columns(table_name, geom_type):
     geom_type_sql = "Geometry"
 
     columns = [
-        ("geom_z_0_3", "MVT zooms 0-3"),
-        ("geom_z_3_6", "MVT zooms 3-6"),
-        ("geom_z_6_10", "MVT zooms 6-10"),
+        (level.column, f"MVT zooms {level.min_zoom}-{level.max_zoom}", populating_level_comment(level))
+        for level in SIMPLIFICATION_LEVELS
     ]
 
     db = SessionLocal()
     try:
-        for col_name, description in columns:
+        for col_name, description, comment in columns:
             print(f"  📝 Adding column {col_name} for {description}...")
 
             # Check if column already exists
@@ -134,6 +180,11 @@ def add_geometry_columns(table_name, geom_type):
 
             start_time = time.time()
             db.execute(add_col_query)
+            # Committed with the column, so the tile server never reads it before it is filled
+            db.execute(
+                text(f"COMMENT ON COLUMN layers.{table_name}.{col_name} IS :comment"),
+                {"comment": comment},
+            )
             db.commit()
             elapsed = time.time() - start_time
             print(f"    ✓ Added column {col_name} ({elapsed:.2f}s)")
@@ -141,69 +192,496 @@ def add_geometry_columns(table_name, geom_type):
         db.close()
 
 
-def populate_geometry_columns(table_name, geom_column):
+def describe_level(level):
+    return (
+        f"zooms {level.min_zoom}-{level.max_zoom} "
+        f"({level.tolerance:g}m tolerance, {level.precision:g}m precision)"
+    )
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_WORKERS = 4
+DEFAULT_PROCESSES = 2
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_REPORT_SAMPLES = 20
+
+
+def ensure_progress_table():
+    """Create the table recording completed key ranges, so interrupted runs can resume."""
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS public.simplify_progress (
+                    table_name TEXT NOT NULL,
+                    pyramid TEXT NOT NULL DEFAULT '',
+                    batch_key TEXT NOT NULL DEFAULT '',
+                    range_start BIGINT NOT NULL,
+                    range_end BIGINT NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    completed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (table_name, pyramid, batch_key, range_start, range_end)
+                )
+            """
+            )
+        )
+        # Progress tables created by older versions of the script lack pyramid and batch_key
+        conn.execute(
+            text(
+                """
+                ALTER TABLE public.simplify_progress
+                ADD COLUMN IF NOT EXISTS pyramid TEXT NOT NULL DEFAULT '',
+                ADD COLUMN IF NOT EXISTS batch_key TEXT NOT NULL DEFAULT ''
+            """
+            )
+        )
+        conn.execute(
+            text(
+                """
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (
+                        SELECT 1 FROM pg_index i
+                        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                        WHERE i.indrelid = 'public.simplify_progress'::regclass
+                          AND i.indisprimary AND a.attname = 'pyramid'
+                    ) THEN
+                        ALTER TABLE public.simplify_progress DROP CONSTRAINT IF EXISTS simplify_progress_pkey;
+                        ALTER TABLE public.simplify_progress
+                            ADD PRIMARY KEY (table_name, pyramid, batch_key, range_start, range_end);
+                    END IF;
+                END $$
+            """
+            )
+        )
+
+
+def get_integer_primary_key(table_name):
+    """Return the single-column integer primary key of the table, or None."""
+    with engine.connect() as conn:
+        result = conn.execute(
+            text(
+                """
+                SELECT a.attname
+                FROM pg_index i
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                WHERE i.indrelid = to_regclass(:relation)
+                  AND i.indisprimary
+                  AND array_length(i.indkey::int2[], 1) = 1
+                  AND format_type(a.atttypid, a.atttypmod) IN ('integer', 'bigint', 'smallint')
+            """
+            ),
+            {"relation": f"layers.{table_name}"},
+        ).fetchone()
+        return result[0] if result else None
+
+
+def _derived_column_expressions(geom_ref):
     """
-    Populate the new geometry columns with simplified and precision-reduced geometries.
-    Since tables are already in EPSG:3857, tolerances are in meters.
+    (column, SQL expression) pairs computing every simplification level and
+    geom_size from `geom_ref` (a column name, or NEW.<column> inside a trigger).
     """
-    print(f"\n🔄 Populating simplified geometries for table '{table_name}'...")
-
-    # Define simplification tolerances in meters for 3857 projection
-    # Precision set to 0 decimal places (1 meter precision) for 3857
-    simplifications = [
-        ("geom_z_0_3", 1000, 0, "zooms 0-3 (1000m tolerance, 1m precision)"),
-        ("geom_z_3_6", 500, 0, "zooms 3-6 (500m tolerance, 1m precision)"),
-        ("geom_z_6_10", 250, 0, "zooms 6-10 (250m tolerance, 1m precision)"),
+    expressions = [
+        (
+            level.column,
+            f"""ST_ReducePrecision(
+                ST_Multi(ST_SimplifyPreserveTopology({geom_ref}, {level.tolerance})),
+                {level.precision}
+            )""",
+        )
+        for level in SIMPLIFICATION_LEVELS
     ]
+    expressions.append(
+        (
+            "geom_size",
+            f"""sqrt(
+                power(ST_XMax({geom_ref}) - ST_XMin({geom_ref}), 2) +
+                power(ST_YMax({geom_ref}) - ST_YMin({geom_ref}), 2)
+            )""",
+        )
+    )
+    return expressions
 
-    db = SessionLocal()
-    try:
-        for col_name, tolerance, precision, description in simplifications:
-            print(f"  🎯 Populating {col_name} for {description}...")
 
-            # Check if column is already populated (simple check for any non-NULL values)
-            check_query = text(
-                f"""
-                SELECT COUNT(*) FROM layers.{table_name} 
-                WHERE {col_name} IS NOT NULL
-            """
+def _simplified_columns_sql(geom_column):
+    """SET clause computing every simplification level and geom_size in one pass over a row."""
+    return ",\n            ".join(
+        f"{column} = {expression}"
+        for column, expression in _derived_column_expressions(geom_column)
+    )
+
+
+def _range_condition_sql(batch_key):
+    """WHERE condition selecting the rows of one batch: a primary-key range or a range of heap pages."""
+    if batch_key == "ctid":
+        # Page ranges are read with a TID range scan (PostgreSQL 14+)
+        return (
+            "ctid >= ('(' || :range_start || ',0)')::tid "
+            "AND ctid < ('(' || :range_end || ',0)')::tid"
+        )
+    return f"{batch_key} >= :range_start AND {batch_key} < :range_end"
+
+
+def _key_ranges(table_name, pk_column, batch_size):
+    """
+    Half-open [start, end) key ranges holding `batch_size` existing rows each.
+    Boundaries are taken from the keys present in the table, so gaps in the key
+    sequence do not produce empty batches.
+    """
+    with engine.connect() as conn:
+        starts = [
+            row[0]
+            for row in conn.execute(
+                text(
+                    f"""
+                    SELECT {pk_column} FROM (
+                        SELECT {pk_column}, row_number() OVER (ORDER BY {pk_column}) AS position
+                        FROM layers.{table_name}
+                    ) numbered
+                    WHERE (position - 1) % :batch_size = 0
+                    ORDER BY {pk_column}
+                """
+                ),
+                {"batch_size": batch_size},
             )
-            existing_count = db.execute(check_query).fetchone()[0]
+        ]
+        if not starts:
+            return []
+        max_key = conn.execute(text(f"SELECT MAX({pk_column}) FROM layers.{table_name}")).scalar()
+    return list(zip(starts, starts[1:] + [max_key + 1]))
+
+
+def _page_ranges(table_name, batch_size, completed):
+    """
+    Half-open [start, end) heap page ranges of about `batch_size` rows each, for
+    tables without an integer primary key. The page count of a resumed run's
+    recorded ranges is reused so the ranges line up with the completed ones.
+    """
+    with engine.connect() as conn:
+        pages, estimated_rows = conn.execute(
+            text(
+                """
+                SELECT pg_relation_size(c.oid) / current_setting('block_size')::bigint, c.reltuples
+                FROM pg_class c
+                WHERE c.oid = to_regclass(:relation)
+            """
+            ),
+            {"relation": f"layers.{table_name}"},
+        ).fetchone()
+        if not pages:
+            return []
+        if estimated_rows <= 0:
+            # Never analyzed: count the rows once
+            estimated_rows = conn.execute(text(f"SELECT count(*) FROM layers.{table_name}")).scalar()
 
-            if existing_count > 0:
+    if completed:
+        range_start, range_end = next(iter(completed))
+        pages_per_batch = range_end - range_start
+    else:
+        rows_per_page = max(1.0, estimated_rows / pages)
+        pages_per_batch = max(1, int(batch_size / rows_per_page))
+    return [
+        (start, start + pages_per_batch)
+        for start in range(0, pages, pages_per_batch)
+    ]
+
+
+def _process_ranges(ranges, workers, process_range):
+    """
+    Run `process_range(range_start, range_end)` for every range on `workers`
+    threads and print progress; return the total of the row counts it returns.
+    Only a small window of ranges is submitted at a time, so a large table does
+    not queue all of its batches up front and a failing batch stops the run.
+    """
+    start_time = time.time()
+    rows_done = 0
+    ranges_done = 0
+    remaining = iter(ranges)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {
+            executor.submit(process_range, *key_range)
+            for key_range in islice(remaining, workers * 2)
+        }
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                rows_done += future.result()
+                ranges_done += 1
+                elapsed = time.time() - start_time
+                rate = rows_done / elapsed if elapsed > 0 else 0.0
                 print(
-                    f"    ⚠️  Column {col_name} already has {existing_count} records, skipping population."
+                    f"    ⏱️  {ranges_done}/{len(ranges)} ranges, {rows_done} rows "
+                    f"({rate:.0f} rows/s)"
                 )
-                continue
+            in_flight |= {
+                executor.submit(process_range, *key_range)
+                for key_range in islice(remaining, len(done))
+            }
+    return rows_done
+
 
-            # Update query with ST_ReducePrecision and simplification
-            # No ST_Transform needed since tables are already in EPSG:3857
-            update_query = text(
+def _missing_levels_sql(geom_column):
+    """Condition matching rows with at least one derived column not computed yet."""
+    return " OR ".join(
+        f"{column} IS NULL" for column, _ in _derived_column_expressions(geom_column)
+    )
+
+
+def _populate_range(worker_engine, table_name, geom_column, batch_key, range_start, range_end,
+                    only_missing=False):
+    """
+    Simplify one key or page range and record it as completed, in a single transaction.
+    With `only_missing` only rows with NULL derived columns are updated and no
+    progress is recorded (backfill).
+    """
+    missing_filter = f"AND ({_missing_levels_sql(geom_column)})" if only_missing else ""
+    with worker_engine.begin() as conn:
+        result = conn.execute(
+            text(
                 f"""
                 UPDATE layers.{table_name}
-                SET {col_name} = ST_ReducePrecision(
-                    ST_Multi(
-                        ST_SimplifyPreserveTopology(
-                            {geom_column},
-                            :tolerance
-                        )
-                    ),
-                    :precision
-                )
-                WHERE {geom_column} IS NOT NULL;
+                SET {_simplified_columns_sql(geom_column)}
+                WHERE {_range_condition_sql(batch_key)}
+                  AND {geom_column} IS NOT NULL
+                  {missing_filter}
+                """
+            ),
+            {"range_start": range_start, "range_end": range_end},
+        )
+        if only_missing:
+            return result.rowcount
+        conn.execute(
+            text(
+                """
+                INSERT INTO public.simplify_progress
+                    (table_name, pyramid, batch_key, range_start, range_end, row_count)
+                VALUES (:table, :pyramid, :batch_key, :range_start, :range_end, :row_count)
+                ON CONFLICT DO NOTHING
+            """
+            ),
+            {
+                "table": table_name,
+                "pyramid": PYRAMID_SIGNATURE,
+                "batch_key": batch_key,
+                "range_start": range_start,
+                "range_end": range_end,
+                "row_count": result.rowcount,
+            },
+        )
+        return result.rowcount
+
+
+def populate_geometry_columns(
+    table_name,
+    geom_column,
+    batch_size=DEFAULT_BATCH_SIZE,
+    workers=DEFAULT_WORKERS,
+    restart=False,
+):
+    """
+    Populate the new geometry columns with simplified and precision-reduced geometries.
+
+    Rows are processed in batches of `batch_size` rows by a pool of `workers`
+    threads, each batch being one short transaction that computes all
+    simplification levels (and geom_size) at once. Batches are primary-key
+    ranges, or heap page ranges (ctid) when the table has no single-column
+    integer primary key. Completed batches are stored in public.simplify_progress
+    per pyramid, so re-running the script resumes where it stopped (use the same
+    batch size) and a changed pyramid recomputes every batch; `restart=True`
+    forgets the recorded progress.
+    """
+    print(f"\n🔄 Populating simplified geometries for table '{table_name}'...")
+
+    pk_column = get_integer_primary_key(table_name)
+    batch_key = pk_column or "ctid"
+    if not pk_column:
+        print(f"    ⚠️  No integer primary key on '{table_name}', batching by heap pages (ctid)")
+
+    ensure_progress_table()
+    with engine.begin() as conn:
+        if restart:
+            conn.execute(
+                text("DELETE FROM public.simplify_progress WHERE table_name = :table"),
+                {"table": table_name},
+            )
+        completed = {
+            (row[0], row[1])
+            for row in conn.execute(
+                text(
+                    """
+                    SELECT range_start, range_end FROM public.simplify_progress
+                    WHERE table_name = :table AND pyramid = :pyramid AND batch_key = :batch_key
                 """
+                ),
+                {"table": table_name, "pyramid": PYRAMID_SIGNATURE, "batch_key": batch_key},
             )
+        }
 
-            start_time = time.time()
-            result = db.execute(
-                update_query, {"tolerance": tolerance, "precision": precision}
+    if pk_column:
+        ranges = _key_ranges(table_name, pk_column, batch_size)
+    else:
+        ranges = _page_ranges(table_name, batch_size, completed)
+    if not ranges:
+        print(f"    ⚠️  Table '{table_name}' is empty, nothing to populate.")
+        return
+
+    pending = [key_range for key_range in ranges if key_range not in completed]
+    if not pending:
+        print(
+            f"    ⚠️  All {len(ranges)} batches already populated, skipping (use --restart to recompute)."
+        )
+        return
+
+    print(
+        f"  🎯 {len(pending)}/{len(ranges)} batches of ~{batch_size} rows on '{batch_key}' to process "
+        f"with {workers} workers"
+    )
+    for level in SIMPLIFICATION_LEVELS:
+        print(f"    • {level.column}: {describe_level(level)}")
+
+    # Pool sized to the worker count: one connection per worker
+    worker_engine = create_engine(database_url, echo=False, pool_size=workers, max_overflow=0)
+    start_time = time.time()
+    try:
+        rows_done = _process_ranges(
+            pending,
+            workers,
+            lambda range_start, range_end: _populate_range(
+                worker_engine, table_name, geom_column, batch_key, range_start, range_end
+            ),
+        )
+    finally:
+        worker_engine.dispose()
+    elapsed = time.time() - start_time
+    print(f"    ✓ Updated {rows_done} rows in {elapsed:.2f}s")
+
+
+def mark_levels_populated(table_name):
+    """
+    Mark every level column as populated (column comment), which lets the tile
+    server read it. Called once population and backfill have completed.
+    """
+    with engine.begin() as conn:
+        for level in SIMPLIFICATION_LEVELS:
+            conn.execute(
+                text(f"COMMENT ON COLUMN layers.{table_name}.{level.column} IS :comment"),
+                {"comment": populated_level_comment(level)},
             )
-            db.commit()
-            elapsed = time.time() - start_time
+    print(f"    ✓ {len(SIMPLIFICATION_LEVELS)} levels marked as populated")
 
-            print(
-                f"    ✓ Updated {result.rowcount} rows in {col_name} ({elapsed:.2f}s)"
+
+def backfill_missing_rows(table_name, geom_column, batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS):
+    """
+    Compute the derived columns of rows that have a geometry but NULL levels,
+    e.g. rows inserted or edited after the table was simplified without triggers.
+    Runs over the same batches as populate_geometry_columns, committing per batch.
+    """
+    print(f"\n🩹 Backfilling rows with missing simplified geometries in '{table_name}'...")
+
+    pk_column = get_integer_primary_key(table_name)
+    batch_key = pk_column or "ctid"
+    if pk_column:
+        ranges = _key_ranges(table_name, pk_column, batch_size)
+    else:
+        ranges = _page_ranges(table_name, batch_size, set())
+    if not ranges:
+        print("    ✓ Table is empty, nothing to backfill")
+        return
+
+    worker_engine = create_engine(database_url, echo=False, pool_size=workers, max_overflow=0)
+    start_time = time.time()
+    try:
+        rows_done = _process_ranges(
+            ranges,
+            workers,
+            lambda range_start, range_end: _populate_range(
+                worker_engine, table_name, geom_column, batch_key, range_start, range_end, only_missing=True
+            ),
+        )
+    finally:
+        worker_engine.dispose()
+    elapsed = time.time() - start_time
+    print(f"    ✓ Backfilled {rows_done} rows ({elapsed:.2f}s)")
+
+
+def install_triggers(table_name, geom_column):
+    """
+    Install a BEFORE INSERT OR UPDATE trigger that recomputes the simplified
+    columns and geom_size of each inserted row, or of each row whose geometry
+    changes, so the tiles stay correct without rebuilding the whole table.
+    """
+    print(f"\n⚡ Installing simplification trigger on table '{table_name}'...")
+
+    function_name = f"layers.{table_name}_simplify_geometries"
+    trigger_name = f"{table_name}_simplify_geometries"
+    assignments = "\n            ".join(
+        f"NEW.{column} := {expression};"
+        for column, expression in _derived_column_expressions(f"NEW.{geom_column}")
+    )
+    clear_assignments = "\n            ".join(
+        f"NEW.{column} := NULL;" for column, _ in _derived_column_expressions(geom_column)
+    )
+
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"""
+                CREATE OR REPLACE FUNCTION {function_name}() RETURNS trigger AS $$
+                BEGIN
+                    IF NEW.{geom_column} IS NULL THEN
+                        {clear_assignments}
+                    ELSE
+                        {assignments}
+                    END IF;
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql
+                """
             )
+        )
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger_name} ON layers.{table_name}"))
+        conn.execute(
+            text(
+                f"""
+                CREATE TRIGGER {trigger_name}
+                BEFORE INSERT OR UPDATE OF {geom_column} ON layers.{table_name}
+                FOR EACH ROW EXECUTE FUNCTION {function_name}()
+                """
+            )
+        )
+    print(f"    ✓ Trigger {trigger_name} installed")
+
+
+def uninstall_triggers(table_name):
+    """Remove the simplification trigger and its function from the table."""
+    print(f"\n🧹 Removing simplification trigger from table '{table_name}'...")
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"DROP TRIGGER IF EXISTS {table_name}_simplify_geometries ON layers.{table_name}")
+        )
+        conn.execute(text(f"DROP FUNCTION IF EXISTS layers.{table_name}_simplify_geometries()"))
+    print("    ✓ Trigger removed")
+
+
+def add_feature_size_column(table_name):
+    """
+    Add the geom_size column: the bounding-box diagonal of each feature in meters.
+    It is filled by populate_geometry_columns and used by the tile query to drop
+    (or collapse to a point) features smaller than a pixel at low zoom levels.
+    """
+    print(f"\n📏 Adding feature size column to table '{table_name}'...")
+
+    db = SessionLocal()
+    try:
+        db.execute(
+            text(
+                f"""
+                ALTER TABLE layers.{table_name}
+                ADD COLUMN IF NOT EXISTS geom_size DOUBLE PRECISION
+            """
+            )
+        )
+        db.commit()
+        print("    ✓ geom_size column ready")
     finally:
         db.close()
 
@@ -212,84 +690,537 @@ def create_spatial_indexes(table_name, original_geom_column):
     """
     Create spatial indexes on the new geometry columns and ensure an index
     exists on the original geometry column.
+
+    Indexes are built with CREATE INDEX CONCURRENTLY so the table stays writable;
+    an invalid index left behind by an interrupted concurrent build is rebuilt.
     """
     print(f"\n📊 Creating spatial indexes for table '{table_name}'...")
 
-    columns_to_index = ["geom_z_0_3", "geom_z_3_6", "geom_z_6_10", original_geom_column]
+    columns_to_index = [level.column for level in SIMPLIFICATION_LEVELS] + [original_geom_column]
 
-    db = SessionLocal()
-    try:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
         for col_name in columns_to_index:
             # For the original geom column, use a generic index name or ensure it's predictable
             index_name = f"idx_{table_name}_{col_name}"
 
             print(f"  🔍 Creating index {index_name} on {col_name}...")
 
-            # Check if index already exists
+            # Check if index already exists (and whether its build completed)
             check_index_query = text(
                 """
-                SELECT indexname FROM pg_indexes 
-                WHERE schemaname = 'layers' 
-                AND tablename = :table 
-                AND indexname = :index
+                SELECT i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'layers' AND c.relname = :index
             """
             )
-            existing = db.execute(
-                check_index_query, {"table": table_name, "index": index_name}
-            ).fetchone()
+            existing = conn.execute(check_index_query, {"index": index_name}).fetchone()
 
-            if existing:
+            if existing and existing[0]:
                 print(f"    ⚠️  Index {index_name} already exists, skipping...")
                 continue
+            if existing:
+                print(f"    ⚠️  Index {index_name} is invalid (interrupted build), rebuilding...")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS layers.{index_name}"))
 
             create_index_query = text(
                 f"""
-                CREATE INDEX {index_name} ON layers.{table_name} USING GIST ({col_name})
+                CREATE INDEX CONCURRENTLY {index_name} ON layers.{table_name} USING GIST ({col_name})
             """
             )
 
             start_time = time.time()
-            db.execute(create_index_query)
-            db.commit()
+            conn.execute(create_index_query)
             elapsed = time.time() - start_time
             print(f"    ✓ Created index {index_name} ({elapsed:.2f}s)")
-    finally:
-        db.close()
 
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python simplify_geometries.py <table_name>")
-        print("Example: python simplify_geometries.py countries")
-        sys.exit(1)
+def analyze_table(table_name):
+    """Refresh planner statistics after the new columns and indexes were written."""
+    print(f"\n📈 Analyzing table '{table_name}'...")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        start_time = time.time()
+        conn.execute(text(f"ANALYZE layers.{table_name}"))
+        elapsed = time.time() - start_time
+    print(f"    ✓ Analyzed ({elapsed:.2f}s)")
 
-    table_name = sys.argv[1]
 
-    print(f"🚀 Starting geometry simplification for table '{table_name}'")
-    print("=" * 60)
+def count_vertices(table_name, geom_column):
+    """Total vertices of the original geometry and of the coarsest simplification level."""
+    coarsest_column = SIMPLIFICATION_LEVELS[0].column
+    with engine.connect() as conn:
+        original, simplified = conn.execute(
+            text(
+                f"""
+                SELECT COALESCE(SUM(ST_NPoints({geom_column})), 0),
+                       COALESCE(SUM(ST_NPoints({coarsest_column})), 0)
+                FROM layers.{table_name}
+            """
+            )
+        ).fetchone()
+    return int(original), int(simplified)
+
+
+def measure_levels(table_name, geom_column):
+    """Vertex count and geometry bytes of the original geometry and of every level."""
+    with engine.connect() as conn:
+        table_columns = _get_table_columns(conn, table_name)
+    columns = [geom_column] + [
+        level.column for level in SIMPLIFICATION_LEVELS if level.column in table_columns
+    ]
+    aggregates = ", ".join(
+        f"COALESCE(SUM(ST_NPoints({col})), 0), COALESCE(SUM(ST_MemSize({col})), 0)"
+        for col in columns
+    )
+    with engine.connect() as conn:
+        row = conn.execute(text(f"SELECT {aggregates} FROM layers.{table_name}")).fetchone()
+
+    original_vertices, original_bytes = int(row[0]), int(row[1])
+    levels_by_column = {level.column: level for level in SIMPLIFICATION_LEVELS}
+    measurements = []
+    for index, col in enumerate(columns):
+        vertices, size_bytes = int(row[2 * index]), int(row[2 * index + 1])
+        level = levels_by_column.get(col)
+        measurements.append({
+            "column": col,
+            "zooms": f"{level.min_zoom}-{level.max_zoom}" if level
+            else f"{SIMPLIFICATION_LEVELS[-1].max_zoom + 1}+",
+            "tolerance_m": level.tolerance if level else 0,
+            "vertices": vertices,
+            "bytes": size_bytes,
+            "vertex_reduction_pct": round(100 * (1 - vertices / original_vertices), 2)
+            if original_vertices else 0.0,
+            "byte_reduction_pct": round(100 * (1 - size_bytes / original_bytes), 2)
+            if original_bytes else 0.0,
+        })
+    return measurements
+
+
+def estimate_tile_sizes(table_name, geom_column, samples=DEFAULT_REPORT_SAMPLES):
+    """
+    Sampled tile sizes at representative zooms (the most detailed zoom of each
+    level, plus the first zoom served by the original geometry), generated with
+    the same polygon tile query the tile server uses. Tiles are picked around
+    randomly sampled features, so empty ocean tiles do not skew the numbers.
+    """
+    with engine.connect() as conn:
+        table_columns = _get_table_columns(conn, table_name)
+        attributes_list = [
+            col for col in table_columns if col != geom_column and not is_derived_column(col)
+        ]
+        # Only the levels the tile server would read
+        served_columns = [
+            row[0]
+            for row in conn.execute(
+                text(SERVED_COLUMNS_SQL),
+                {"table": table_name, "populating_prefix": POPULATING_COMMENT_PREFIX},
+            )
+        ]
+        points = conn.execute(
+            text(
+                f"""
+                SELECT ST_X(p), ST_Y(p) FROM (
+                    SELECT ST_PointOnSurface({geom_column}) AS p
+                    FROM layers.{table_name}
+                    WHERE {geom_column} IS NOT NULL
+                    ORDER BY random()
+                    LIMIT :samples
+                ) sampled
+            """
+            ),
+            {"samples": samples},
+        ).fetchall()
+
+        zooms = [level.max_zoom for level in SIMPLIFICATION_LEVELS]
+        zooms.append(SIMPLIFICATION_LEVELS[-1].max_zoom + 1)
+        estimates = []
+        for z in zooms:
+            level = level_for_zoom(SIMPLIFICATION_LEVELS, z, served_columns)
+            level_column = level.column if level else geom_column
+            min_feature_size = None
+            if "geom_size" in table_columns:
+                min_feature_size = min_feature_size_for_zoom(z, MIN_FEATURE_MAX_ZOOM, MIN_FEATURE_PIXELS)
+            query = text(
+                build_polygon_query(
+                    table_name,
+                    level_column,
+                    attributes_list,
+                    min_feature_size,
+                    small_as_points=SMALL_FEATURES_AS_POINTS,
+                    geom_column=geom_column,
+                )
+            )
+
+            tiles = {mercantile.tile(*mercantile.lnglat(x, y), z) for x, y in points}
+            sizes = []
+            for tile in tiles:
+                params = {"z": tile.z, "x": tile.x, "y": tile.y}
+                if min_feature_size is not None:
+                    params["min_feature_size"] = min_feature_size
+                tile_data = conn.execute(query, params).scalar()
+                sizes.append(len(tile_data) if tile_data else 0)
+
+            estimates.append({
+                "zoom": z,
+                "column": level_column,
+                "sampled_tiles": len(sizes),
+                "mean_bytes": round(statistics.mean(sizes)) if sizes else 0,
+                "median_bytes": round(statistics.median(sizes)) if sizes else 0,
+                "max_bytes": max(sizes) if sizes else 0,
+            })
+            print(
+                f"    📦 z{z} ({level_column}): {len(sizes)} tiles, "
+                f"mean {estimates[-1]['mean_bytes'] / 1024:.1f} KB, max {estimates[-1]['max_bytes'] / 1024:.1f} KB"
+            )
+        return estimates
+
+
+def write_report(table_name, geom_column, report_dir, samples=DEFAULT_REPORT_SAMPLES):
+    """
+    Write a JSON report of vertices, geometry bytes and sampled tile sizes per
+    level to <report_dir>/<table>_<UTC timestamp>.json, so tiling cost can be
+    tracked as the data changes. Returns the report path.
+    """
+    print(f"\n📝 Building simplification report for table '{table_name}'...")
+    generated_at = datetime.now(timezone.utc)
+    report = {
+        "table": table_name,
+        "geometry_column": geom_column,
+        "generated_at": generated_at.isoformat(),
+        "pyramid": {
+            "zoom_breaks": [level.max_zoom for level in SIMPLIFICATION_LEVELS],
+            "pixel_tolerance": float(os.getenv("SIMPLIFY_PIXEL_TOLERANCE", DEFAULT_PIXEL_TOLERANCE)),
+        },
+        "levels": measure_levels(table_name, geom_column),
+        "tile_estimates": estimate_tile_sizes(table_name, geom_column, samples),
+    }
+
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(
+        report_dir, f"{table_name}_{generated_at.strftime('%Y%m%dT%H%M%SZ')}.json"
+    )
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"    ✓ Report written to {report_path}")
+    return report_path
+
+
+def _get_table_columns(conn, table_name):
+    result = conn.execute(
+        text(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = 'layers' AND table_name = :table
+            ORDER BY ordinal_position
+        """
+        ),
+        {"table": table_name},
+    ).fetchall()
+    return [row[0] for row in result]
+
+
+def get_simplifiable_tables():
+    """
+    All tables in the layers schema (SRID 3857, as tiling_operations.get_tables)
+    whose geometry column is not a point type, largest first.
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                """
+                SELECT gc.f_table_name
+                FROM public.geometry_columns gc
+                WHERE gc.f_table_schema = 'layers'
+                  AND gc.srid = 3857
+                  AND gc.f_geometry_column NOT LIKE 'geom\\_z\\_%'
+                  AND gc.type NOT LIKE '%POINT%'
+                GROUP BY gc.f_table_name
+                ORDER BY pg_total_relation_size(to_regclass('layers.' || quote_ident(gc.f_table_name))) DESC
+            """
+            )
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+def simplify_table(
+    table_name,
+    batch_size=DEFAULT_BATCH_SIZE,
+    workers=DEFAULT_WORKERS,
+    restart=False,
+    install=False,
+    report_dir=None,
+    report_samples=DEFAULT_REPORT_SAMPLES,
+    report_only=False,
+):
+    """
+    Run every simplification step for one table and return a summary dict
+    (status, elapsed seconds, original and coarsest-level vertex counts).
+    With `report_dir` a JSON level report is written afterwards; `report_only`
+    skips the simplification steps and only writes the report.
+    """
+    start_time = time.time()
+    summary = {"table": table_name, "status": "ok", "elapsed": 0.0}
 
     # Step 1: Check geometry type
     geom_column, geom_type = check_geometry_type(table_name)
     if not geom_column:
-        sys.exit(1)
+        summary["status"] = "skipped"
+        return summary
+
+    if report_only:
+        write_report(table_name, geom_column, report_dir, report_samples)
+        summary["original_vertices"], summary["simplified_vertices"] = count_vertices(table_name, geom_column)
+        summary["elapsed"] = time.time() - start_time
+        return summary
 
-    # Step 2: Add geometry columns
+    # Step 2: Add geometry columns and the feature size column
     add_geometry_columns(table_name, geom_type)
+    add_feature_size_column(table_name)
+
+    # Step 3: Populate geometry columns and feature sizes in batches
+    populate_geometry_columns(
+        table_name,
+        geom_column,
+        batch_size=batch_size,
+        workers=workers,
+        restart=restart,
+    )
+
+    # Step 4: Optionally keep the columns current for future edits
+    if install:
+        install_triggers(table_name, geom_column)
 
-    # Step 3: Populate geometry columns
-    populate_geometry_columns(table_name, geom_column)
+    # Step 5: Fix rows added or edited since the last run (NULL levels), then
+    # let the tile server use the levels
+    backfill_missing_rows(table_name, geom_column, batch_size=batch_size, workers=workers)
+    mark_levels_populated(table_name)
 
-    # Step 4: Create spatial indexes (now passing original_geom_column)
+    # Step 6: Create spatial indexes (now passing original_geom_column)
     create_spatial_indexes(table_name, geom_column)
 
+    # Step 7: Refresh planner statistics for the new columns
+    analyze_table(table_name)
+
+    # Step 8: Optionally report vertex counts and projected tile sizes per level
+    if report_dir:
+        write_report(table_name, geom_column, report_dir, report_samples)
+
+    summary["original_vertices"], summary["simplified_vertices"] = count_vertices(table_name, geom_column)
+    summary["elapsed"] = time.time() - start_time
+    return summary
+
+
+def _init_table_process():
+    # Forked processes must not reuse the parent's pooled connections
+    engine.dispose(close=False)
+
+
+def _simplify_table_in_process(table_name, options):
+    try:
+        return simplify_table(table_name, **options)
+    except Exception as e:
+        print(f"❌ Simplification of '{table_name}' failed: {e}")
+        return {"table": table_name, "status": f"failed: {e}", "elapsed": 0.0}
+
+
+def simplify_all_tables(processes, max_connections, **options):
+    """
+    Simplify every non-point table of the layers schema, several tables at a time.
+    `options` are passed to simplify_table for each table.
+
+    Each table process uses `workers` connections for population plus one for
+    the other steps, so the number of concurrent table processes is capped to
+    keep the total at or below `max_connections`. If a single table process would
+    already exceed it, its workers are reduced to `max_connections - 1`.
+    """
+    if max_connections < 2:
+        raise ValueError("max_connections must be at least 2 (one worker plus one connection per table)")
+    workers = options.get("workers", DEFAULT_WORKERS)
+    if workers + 1 > max_connections:
+        print(f"⚠️ {workers} workers per table exceed --max-connections {max_connections}, using {max_connections - 1}")
+        workers = max_connections - 1
+        options = {**options, "workers": workers}
+    tables = get_simplifiable_tables()
+    if not tables:
+        print("❌ No non-point tables found in the layers schema")
+        return []
+
+    connections_per_table = workers + 1
+    processes = max(1, min(processes, max_connections // connections_per_table, len(tables)))
+    print(
+        f"🚀 Simplifying {len(tables)} tables with {processes} processes "
+        f"x {workers} workers (max {processes * connections_per_table} DB connections)"
+    )
+    print("=" * 60)
+
+    # Hand the connections used for discovery back before forking
+    engine.dispose()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_table_process) as executor:
+        futures = [
+            executor.submit(_simplify_table_in_process, table, options)
+            for table in tables
+        ]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            print(f"🏁 Finished '{summary['table']}' ({summary['status']}, {summary['elapsed']:.1f}s)")
+    return summaries
+
+
+def print_summary_report(summaries):
+    print("\n" + "=" * 60)
+    print("📋 Simplification summary")
+    print(f"{'table':<32} {'status':<10} {'time (s)':>9} {'vertices':>12} {'coarsest':>12} {'reduction':>9}")
+    for summary in sorted(summaries, key=lambda item: item["table"]):
+        original = summary.get("original_vertices")
+        simplified = summary.get("simplified_vertices")
+        if original:
+            vertex_cols = f"{original:>12} {simplified:>12} {100 * (1 - simplified / original):>8.1f}%"
+        else:
+            vertex_cols = f"{'-':>12} {'-':>12} {'-':>9}"
+        status = summary["status"] if len(summary["status"]) <= 10 else "failed"
+        print(f"{summary['table']:<32} {status:<10} {summary['elapsed']:>9.1f} {vertex_cols}")
+    print("=" * 60)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Add pre-simplified geometry columns to a table in the layers schema."
+    )
+    parser.add_argument("table_name", nargs="?", help="Table in the 'layers' schema")
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Simplify every non-point table in the layers schema",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Rows processed per transaction (default {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Parallel workers per table, one DB connection each (default {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=DEFAULT_PROCESSES,
+        help=f"Tables processed concurrently with --all (default {DEFAULT_PROCESSES})",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=DEFAULT_MAX_CONNECTIONS,
+        help=f"Global cap on DB connections with --all (default {DEFAULT_MAX_CONNECTIONS})",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore recorded progress and recompute every row",
+    )
+    parser.add_argument(
+        "--report-dir",
+        help="Write a JSON report of vertices, bytes and sampled tile sizes per level to this directory",
+    )
+    parser.add_argument(
+        "--report-only",
+        action="store_true",
+        help="Only write the report (requires --report-dir), do not simplify",
+    )
+    parser.add_argument(
+        "--report-samples",
+        type=int,
+        default=DEFAULT_REPORT_SAMPLES,
+        help=f"Features sampled to pick tiles for the size estimates (default {DEFAULT_REPORT_SAMPLES})",
+    )
+    trigger_mode = parser.add_mutually_exclusive_group()
+    trigger_mode.add_argument(
+        "--install-triggers",
+        action="store_true",
+        help="Keep the simplified columns up to date on INSERT/UPDATE with a trigger",
+    )
+    trigger_mode.add_argument(
+        "--uninstall-triggers",
+        action="store_true",
+        help="Remove the trigger installed by --install-triggers and exit",
+    )
+    args = parser.parse_args()
+    if bool(args.table_name) == args.all:
+        parser.error("pass either a table name or --all")
+    if args.report_only and not args.report_dir:
+        parser.error("--report-only requires --report-dir")
+    if args.all and args.max_connections < 2:
+        parser.error("--max-connections must be at least 2")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if args.all:
+        if args.uninstall_triggers:
+            for table_name in get_simplifiable_tables():
+                uninstall_triggers(table_name)
+            return
+        summaries = simplify_all_tables(
+            processes=args.processes,
+            max_connections=args.max_connections,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            restart=args.restart,
+            install=args.install_triggers,
+            report_dir=args.report_dir,
+            report_samples=args.report_samples,
+            report_only=args.report_only,
+        )
+        print_summary_report(summaries)
+        if any(summary["status"].startswith("failed") for summary in summaries):
+            sys.exit(1)
+        return
+
+    table_name = args.table_name
+
+    if args.uninstall_triggers:
+        uninstall_triggers(table_name)
+        return
+
+    print(f"🚀 Starting geometry simplification for table '{table_name}'")
+    print("=" * 60)
+
+    try:
+        summary = simplify_table(
+            table_name,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            restart=args.restart,
+            install=args.install_triggers,
+            report_dir=args.report_dir,
+            report_samples=args.report_samples,
+            report_only=args.report_only,
+        )
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if summary["status"] != "ok":
+        sys.exit(1)
+    if args.report_only:
+        return
+
     print("\n" + "=" * 60)
     print(f"✅ Geometry simplification completed for table '{table_name}'!")
     print("📊 Simplification levels created:")
-    print("   • geom_z_0_3:  1000m tolerance (zooms 0-3)")
-    print("   • geom_z_3_6:  500m tolerance  (zooms 4-6)")
-    print("   • geom_z_6_10: 250m tolerance  (zooms 7-10)")
-    print("   • Original geom: Used for zoom 11+")
-    print("=" * 60)
+    for level in SIMPLIFICATION_LEVELS:
+        print(f"   • {level.column}: {describe_level(level)}")
+    print(f"   • Original geom: Used for zoom {SIMPLIFICATION_LEVELS[-1].max_zoom + 1}+")
+    print("   • geom_size:   Bounding-box diagonal (m) for sub-pixel filtering")
+    print_summary_report([summary])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+"""
+Tests for the catalog filtering and pagination cursors (catalog_operations).
+
+Usage:
+    python -m pytest src/backend/test_catalog_operations.py
+"""
+
+import pytest
+
+from backend.catalog_operations import decode_cursor, encode_cursor, filter_catalog
+
+TABLES = [
+    {"name": "countries", "geometry_type": "MULTIPOLYGON"},
+    {"name": "rivers", "geometry_type": "MULTILINESTRING"},
+    {"name": "roads", "geometry_type": "LINESTRING"},
+    {"name": "towns", "geometry_type": "POINT"},
+    {"name": "unknown", "geometry_type": None},
+]
+
+
+def names(tables):
+    return [table["name"] for table in tables]
+
+
+def test_pages_cover_every_table_once():
+    pages, after = [], None
+    while True:
+        page, next_name = filter_catalog(TABLES, after=after, limit=2)
+        pages.append(names(page))
+        if next_name is None:
+            break
+        after = decode_cursor(encode_cursor(next_name))
+    assert pages == [["countries", "rivers"], ["roads", "towns"], ["unknown"]]
+
+
+def test_limit_equal_to_the_matches_has_no_next_page():
+    page, next_name = filter_catalog(TABLES, limit=len(TABLES))
+    assert names(page) == names(TABLES)
+    assert next_name is None
+
+
+def test_after_the_last_table_is_empty():
+    assert filter_catalog(TABLES, after="unknown", limit=2) == ([], None)
+
+
+def test_after_a_name_between_tables():
+    page, next_name = filter_catalog(TABLES, after="rivet", limit=1)
+    assert names(page) == ["roads"]
+    assert next_name == "roads"
+
+
+def test_filters_apply_before_the_limit():
+    page, next_name = filter_catalog(TABLES, name="R", limit=1)
+    assert names(page) == ["countries"]
+    page, next_name = filter_catalog(TABLES, name="R", after=next_name, limit=1)
+    assert names(page) == ["rivers"]
+
+    page, next_name = filter_catalog(TABLES, geometry_types=["LINESTRING", "MULTILINESTRING"])
+    assert names(page) == ["rivers", "roads"]
+    assert next_name is None
+
+
+@pytest.mark.parametrize("table_name", ["roads", "a", "ab", "données_2024", "x" * 100])
+def test_cursor_round_trip(table_name):
+    cursor = encode_cursor(table_name)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == table_name
+
+
+@pytest.mark.parametrize("cursor", ["a", "!!!!", "cm9hZHM+/", "__8"])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
@@ -0,0 +1,75 @@
+"""
+Tests for tiling from the in-memory feature store (feature_store.encode_tile).
+
+Usage:
+    python -m pytest src/backend/test_feature_store.py
+"""
+
+import pytest
+
+from backend import feature_store
+
+if not feature_store.FEATURE_STORE_AVAILABLE:
+    pytest.skip("shapely / mapbox-vector-tile not installed", allow_module_level=True)
+
+import mapbox_vector_tile
+import mercantile
+from shapely import Polygon, box
+
+from backend.feature_store import _LevelIndex, _TableStore, encode_tile
+
+# Tile 1/0/0 is the north-west quarter of the world
+BOUNDS = mercantile.xy_bounds(0, 0, 1)
+LARGE = box(BOUNDS.left + 1e6, BOUNDS.bottom + 1e6, BOUNDS.left + 5e6, BOUNDS.bottom + 5e6)
+SMALL = box(BOUNDS.left + 8e6, BOUNDS.bottom + 8e6, BOUNDS.left + 8e6 + 10, BOUNDS.bottom + 8e6 + 10)
+ELSEWHERE = box(-BOUNDS.left - 5e6, -BOUNDS.top + 1e6, -BOUNDS.left - 1e6, -BOUNDS.top + 5e6)  # South-east
+
+
+def make_store():
+    originals = [LARGE, SMALL, ELSEWHERE]
+    ids = [0, 1, 2]
+    return _TableStore(
+        "test",
+        levels={
+            "geom": _LevelIndex(originals, ids),
+            # Coarse level: the small feature collapses to EMPTY when snapped to the grid
+            "geom_z_0_3": _LevelIndex([LARGE, Polygon(), ELSEWHERE], ids),
+        },
+        properties=[{"name": "large", "rank": 1}, {"name": "small", "rank": 2}, {"name": "elsewhere", "rank": 3}],
+        sizes=[5.6e6, 14.1, 5.6e6],
+        points=_LevelIndex([geometry.point_on_surface() for geometry in originals], ids),
+    )
+
+
+def decode(tile_data):
+    features = mapbox_vector_tile.decode(tile_data)["features"]["features"]
+    return sorted((feature["properties"]["name"], feature["geometry"]["type"]) for feature in features)
+
+
+def test_only_features_of_the_tile_are_encoded():
+    # The small polygon is far below one tile unit: it collapses when quantized
+    tile_data = encode_tile(make_store(), "geom", 1, 0, 0)
+    assert decode(tile_data) == [("large", "Polygon")]
+
+
+def test_small_features_are_dropped():
+    tile_data = encode_tile(make_store(), "geom_z_0_3", 1, 0, 0, min_feature_size=1000)
+    assert decode(tile_data) == [("large", "Polygon")]
+
+
+def test_small_features_become_points_of_the_original_geometry():
+    tile_data = encode_tile(make_store(), "geom_z_0_3", 1, 0, 0, min_feature_size=1000, small_as_points=True)
+    assert decode(tile_data) == [("large", "Polygon"), ("small", "Point")]
+
+
+def test_feature_filter_is_applied_to_polygons_and_points():
+    tile_data = encode_tile(
+        make_store(), "geom_z_0_3", 1, 0, 0, min_feature_size=1000, small_as_points=True,
+        feature_filter=lambda properties: properties["rank"] != 2,
+    )
+    assert decode(tile_data) == [("large", "Polygon")]
+
+
+def test_empty_tile_and_unloaded_level():
+    assert encode_tile(make_store(), "geom", 3, 0, 7) == b""
+    assert encode_tile(make_store(), "geom_z_3_6", 1, 0, 0) is None
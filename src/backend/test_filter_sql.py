@@ -0,0 +1,41 @@
+"""
+Tests for the server-side layer filters (filter_sql).
+
+Usage:
+    python -m pytest src/backend/test_filter_sql.py
+"""
+
+import pytest
+
+from backend.filter_sql import UnsupportedFilterError, compile_filter, evaluate_filter
+
+COLUMN_TYPES = {"b": "text", "n": "integer"}
+
+
+def test_legacy_in_is_membership():
+    sql, params = compile_filter(["in", "b", "x", "y"], 5, COLUMN_TYPES)
+    assert sql == '("b" IN (:filter_0, :filter_1))'
+    assert params == {"filter_0": "x", "filter_1": "y"}
+    assert evaluate_filter(["in", "b", "x", "y"], 5, {"b": "y"})
+    assert not evaluate_filter(["in", "b", "x", "y"], 5, {"b": "xy"})
+
+
+def test_expression_in_literal_array_is_membership():
+    expression = ["in", ["get", "b"], ["literal", ["x", "y"]]]
+    sql, params = compile_filter(expression, 5, COLUMN_TYPES)
+    assert sql == '("b" IN (:filter_0, :filter_1))'
+    assert params == {"filter_0": "x", "filter_1": "y"}
+    assert evaluate_filter(expression, 5, {"b": "x"})
+
+
+@pytest.mark.parametrize("expression", [
+    ["in", ["get", "b"], "xyz"],                # substring of a string
+    ["in", ["get", "b"], ["literal", "xyz"]],   # substring of a literal string
+    ["!in", ["get", "b"], "xyz"],
+    ["in", ["get", "b"], "x", "y"],             # legacy value list after an expression
+])
+def test_expression_in_without_literal_array_is_unsupported(expression):
+    with pytest.raises(UnsupportedFilterError):
+        compile_filter(expression, 5, COLUMN_TYPES)
+    with pytest.raises(UnsupportedFilterError):
+        evaluate_filter(expression, 5, {"b": "y"})
@@ -0,0 +1,82 @@
+"""
+Tests for the simplification pyramid (geometry_pyramid): zoom bands and level selection.
+
+Usage:
+    python -m pytest src/backend/test_geometry_pyramid.py
+"""
+
+import pytest
+
+from backend.geometry_pyramid import (
+    build_pyramid,
+    level_for_zoom,
+    meters_per_pixel,
+    min_feature_size_for_zoom,
+    parse_zoom_breaks,
+    pyramid_signature,
+)
+
+LEVELS = build_pyramid([3, 6, 10, 12, 14])
+
+
+def test_zoom_bands_are_contiguous():
+    assert [(level.column, level.min_zoom, level.max_zoom) for level in LEVELS] == [
+        ("geom_z_0_3", 0, 3),
+        ("geom_z_3_6", 4, 6),
+        ("geom_z_6_10", 7, 10),
+        ("geom_z_10_12", 11, 12),
+        ("geom_z_12_14", 13, 14),
+    ]
+
+
+def test_tolerance_follows_the_most_detailed_zoom_of_the_band():
+    for level in LEVELS:
+        assert level.tolerance == round(0.5 * meters_per_pixel(level.max_zoom), 2)
+    assert [level.tolerance for level in LEVELS] == sorted((level.tolerance for level in LEVELS), reverse=True)
+
+
+@pytest.mark.parametrize("z, column", [
+    (0, "geom_z_0_3"),
+    (3, "geom_z_0_3"),
+    (4, "geom_z_3_6"),
+    (10, "geom_z_6_10"),
+    (11, "geom_z_10_12"),
+    (14, "geom_z_12_14"),
+])
+def test_level_for_zoom(z, column):
+    assert level_for_zoom(LEVELS, z).column == column
+
+
+def test_zooms_above_the_last_break_use_the_original_geometry():
+    assert level_for_zoom(LEVELS, 15) is None
+    assert level_for_zoom(LEVELS, 22) is None
+
+
+def test_missing_levels_fall_back_to_the_next_more_detailed_one():
+    available = ["geom_z_6_10", "geom_z_12_14"]
+    assert level_for_zoom(LEVELS, 2, available).column == "geom_z_6_10"
+    assert level_for_zoom(LEVELS, 11, available).column == "geom_z_12_14"
+    assert level_for_zoom(LEVELS, 15, available) is None
+    assert level_for_zoom(LEVELS, 5, []) is None
+
+
+@pytest.mark.parametrize("spec", ["", "3,3", "6,3", "-1,3", "a,b"])
+def test_invalid_zoom_breaks(spec):
+    with pytest.raises(ValueError):
+        parse_zoom_breaks(spec)
+
+
+def test_parse_zoom_breaks():
+    assert parse_zoom_breaks("3, 6,10,") == [3, 6, 10]
+
+
+def test_signature_changes_with_the_pyramid():
+    assert pyramid_signature(LEVELS) == pyramid_signature(build_pyramid([3, 6, 10, 12, 14]))
+    assert pyramid_signature(LEVELS) != pyramid_signature(build_pyramid([3, 6, 10, 12, 14], pixel_tolerance=1.0))
+    assert pyramid_signature(LEVELS) != pyramid_signature(build_pyramid([4, 8, 12]))
+
+
+def test_min_feature_size_only_applies_up_to_its_max_zoom():
+    assert min_feature_size_for_zoom(6, max_zoom=6, pixels=2) == 2 * meters_per_pixel(6)
+    assert min_feature_size_for_zoom(7, max_zoom=6, pixels=2) is None
+    assert min_feature_size_for_zoom(3, max_zoom=6, pixels=0) is None
@@ -0,0 +1,192 @@
+"""
+Tests for the outbound mail queue (mail_queue), against a minimal in-process SMTP server.
+
+Usage:
+    python -m pytest src/backend/test_mail_queue.py
+"""
+
+import asyncio
+
+import pytest
+
+from backend import mail_queue
+from backend.config import settings
+
+
+class FakeSMTPServer:
+    """Just enough SMTP for aiosmtplib: accepts every message unless `reject` returns True."""
+
+    def __init__(self, reject=lambda recipient: False):
+        self.reject = reject
+        self.messages = []  # (sender, recipients, data)
+        self.connections = 0
+        self.port = None
+        self._server = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        sender, recipients = None, []
+
+        async def reply(line):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 fake ESMTP")
+        while line := await reader.readline():
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                await reply("250 fake")
+            elif verb == "MAIL":
+                sender, recipients = command.split(":", 1)[1].strip("<> "), []
+                await reply("250 OK")
+            elif verb == "RCPT":
+                recipient = command.split(":", 1)[1].strip("<> ")
+                if self.reject(recipient):
+                    await reply("451 Try again later")
+                else:
+                    recipients.append(recipient)
+                    await reply("250 OK")
+            elif verb == "DATA":
+                await reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (data_line := await reader.readline()) != b".\r\n":
+                    data.append(data_line)
+                self.messages.append((sender, recipients, b"".join(data)))
+                await reply("250 OK")
+            elif verb == "QUIT":
+                await reply("221 Bye")
+                break
+            else:  # RSET, NOOP
+                await reply("250 OK")
+        writer.close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_queue(monkeypatch):
+    """Every test runs its own event loop, so start from an empty queue and fast retries."""
+    monkeypatch.setattr(mail_queue, "_queue", None)
+    monkeypatch.setattr(mail_queue, "_worker_task", None)
+    monkeypatch.setattr(mail_queue, "_client", None)
+    monkeypatch.setattr(mail_queue, "_retry_handles", [])
+    monkeypatch.setattr(mail_queue, "_stats", {"sent": 0, "failed": 0, "retried": 0, "connections": 0})
+    monkeypatch.setattr(mail_queue, "RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(settings, "SMTP_START_TLS", False)
+    monkeypatch.setattr(settings, "SMTP_USERNAME", "")
+    monkeypatch.setattr(settings, "MAIL_QUEUE_MAX_SIZE", 100)
+    monkeypatch.setattr(settings, "MAIL_BATCH_SIZE", 20)
+    monkeypatch.setattr(settings, "MAIL_MAX_RETRIES", 5)
+
+
+async def wait_until(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_queued_mail_is_sent_in_batches_over_one_connection(monkeypatch):
+    monkeypatch.setattr(settings, "MAIL_BATCH_SIZE", 3)
+    batch_sizes = []
+    send_batch = mail_queue._send_batch
+
+    async def recording_send_batch(batch):
+        batch_sizes.append(len(batch))
+        return await send_batch(batch)
+
+    monkeypatch.setattr(mail_queue, "_send_batch", recording_send_batch)
+
+    async def scenario():
+        async with FakeSMTPServer() as server:
+            monkeypatch.setattr(settings, "SMTP_PORT", server.port)
+            for i in range(5):
+                mail_queue.enqueue("noreply@example.com", f"user{i}@example.com", f"Subject: {i}\r\n\r\nbody")
+            await asyncio.wait_for(mail_queue._queue.join(), timeout=5)
+            await mail_queue.stop()
+            return server
+
+    server = asyncio.run(scenario())
+    assert batch_sizes == [3, 2]
+    assert [recipients for _, recipients, _ in server.messages] == [[f"user{i}@example.com"] for i in range(5)]
+    assert server.connections == 1
+    assert mail_queue._stats["sent"] == 5
+
+
+def test_failed_mail_is_requeued_and_retried(monkeypatch):
+    attempts = []
+
+    def reject_first_attempt(recipient):
+        attempts.append(recipient)
+        return len(attempts) == 1
+
+    async def scenario():
+        async with FakeSMTPServer(reject=reject_first_attempt) as server:
+            monkeypatch.setattr(settings, "SMTP_PORT", server.port)
+            mail_queue.enqueue("noreply@example.com", "flaky@example.com", "Subject: retry\r\n\r\nbody")
+            await wait_until(lambda: mail_queue._stats["sent"] == 1)
+            await mail_queue.stop()
+            return server
+
+    server = asyncio.run(scenario())
+    assert attempts == ["flaky@example.com", "flaky@example.com"]
+    assert len(server.messages) == 1
+    assert mail_queue._stats["retried"] == 1
+    assert mail_queue._stats["failed"] == 0
+    assert mail_queue.queue_depth() == 0
+
+
+def test_mail_is_dropped_after_max_retries(monkeypatch):
+    monkeypatch.setattr(settings, "MAIL_MAX_RETRIES", 2)
+
+    async def scenario():
+        async with FakeSMTPServer(reject=lambda recipient: True) as server:
+            monkeypatch.setattr(settings, "SMTP_PORT", server.port)
+            mail_queue.enqueue("noreply@example.com", "gone@example.com", "Subject: lost\r\n\r\nbody")
+            await wait_until(lambda: mail_queue._stats["failed"] == 1)
+            await mail_queue.stop()
+            return server
+
+    server = asyncio.run(scenario())
+    assert server.messages == []
+    assert mail_queue._stats["retried"] == 2
+    assert mail_queue._stats["sent"] == 0
+    assert mail_queue.queue_depth() == 0
+
+
+def test_enqueue_raises_when_the_queue_is_full(monkeypatch):
+    monkeypatch.setattr(settings, "MAIL_QUEUE_MAX_SIZE", 2)
+
+    async def scenario():
+        # The worker only runs once the loop is awaited, so nothing is consumed yet
+        mail_queue.enqueue("noreply@example.com", "a@example.com", "a")
+        mail_queue.enqueue("noreply@example.com", "b@example.com", "b")
+        with pytest.raises(asyncio.QueueFull):
+            mail_queue.enqueue("noreply@example.com", "c@example.com", "c")
+        assert mail_queue.queue_depth() == 2
+        await mail_queue.stop(timeout=0)
+
+    asyncio.run(scenario())
+
+
+def test_retry_into_a_full_queue_is_rescheduled(monkeypatch):
+    async def scenario():
+        mail_queue._queue = asyncio.Queue(maxsize=1)  # No worker: the queue stays full
+        mail_queue._queue.put_nowait(mail_queue.OutgoingMail("noreply@example.com", "a@example.com", "a"))
+        mail_queue._schedule_retry(mail_queue.OutgoingMail("noreply@example.com", "b@example.com", "b"))
+        await wait_until(lambda: mail_queue._stats["retried"] >= 2)
+        # Still waiting for a slot, not lost
+        assert len(mail_queue._retry_handles) == 1
+        assert mail_queue.queue_depth() == 2
+        await mail_queue.stop(timeout=0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+"""
+Tests for the in-memory token buckets (rate_limit.InMemoryRateLimitStore).
+
+Usage:
+    python -m pytest src/backend/test_rate_limit.py
+"""
+
+import types
+
+import pytest
+
+from backend import rate_limit
+from backend.rate_limit import InMemoryRateLimitStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.monotonic() for the store."""
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_burst_then_limited(clock):
+    store = InMemoryRateLimitStore()
+    assert [store.consume("k", rate=1, burst=3)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = store.consume("k", rate=1, burst=3)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+
+
+def test_tokens_refill_at_the_rate(clock):
+    store = InMemoryRateLimitStore()
+    for _ in range(4):
+        store.consume("k", rate=2, burst=4)
+    assert not store.consume("k", rate=2, burst=4)[0]
+
+    clock[0] += 0.25  # Half a token
+    allowed, retry_after = store.consume("k", rate=2, burst=4)
+    assert not allowed
+    assert retry_after == pytest.approx(0.25)
+
+    clock[0] += 0.25
+    assert store.consume("k", rate=2, burst=4) == (True, 0.0)
+    assert not store.consume("k", rate=2, burst=4)[0]
+
+
+def test_refill_is_capped_at_the_burst(clock):
+    store = InMemoryRateLimitStore()
+    store.consume("k", rate=10, burst=3)
+    clock[0] += 3600
+    assert [store.consume("k", rate=10, burst=3)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_keys_have_separate_buckets(clock):
+    store = InMemoryRateLimitStore()
+    assert store.consume("a", rate=1, burst=1)[0]
+    assert not store.consume("a", rate=1, burst=1)[0]
+    assert store.consume("b", rate=1, burst=1)[0]
+
+
+def test_idle_buckets_are_pruned(clock, monkeypatch):
+    monkeypatch.setattr(InMemoryRateLimitStore, "MAX_KEYS", 2)
+    store = InMemoryRateLimitStore()
+    store.consume("old", rate=1, burst=1)
+    clock[0] += InMemoryRateLimitStore.PRUNE_IDLE_SECONDS + 1
+    store.consume("a", rate=1, burst=1)
+    store.consume("b", rate=1, burst=1)
+    assert set(store._buckets) == {"a", "b"}
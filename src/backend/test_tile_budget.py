@@ -0,0 +1,74 @@
+"""
+Tests for the tile byte-budget fallbacks (tiling_operations._shrink_to_budget).
+
+Usage:
+    python -m pytest src/backend/test_tile_budget.py
+"""
+
+from backend.tiling_operations import _shrink_to_budget
+
+
+class FakeTileQuery:
+    """Returns a tile whose size is given by `size_for(options)` and records every call."""
+
+    def __init__(self, size_for):
+        self.size_for = size_for
+        self.calls = []
+
+    def __call__(self, **options):
+        self.calls.append(options)
+        return b"x" * self.size_for(options)
+
+
+def test_steps_accumulate_until_the_tile_fits():
+    query = FakeTileQuery(lambda options: 500 if options.get("sample_percent") == 50 else 2000)
+    tile_data, fallback = _shrink_to_budget(3000, 1000, query, is_point_data=False, has_attributes=True)
+    assert fallback == "sample_50"
+    assert len(tile_data) == 500
+    assert query.calls == [
+        {"simplify_pixels": 4},
+        {"simplify_pixels": 16},
+        {"simplify_pixels": 16, "drop_attributes": True},
+        {"simplify_pixels": 16, "drop_attributes": True, "sample_percent": 50},
+    ]
+
+
+def test_first_step_that_fits_wins():
+    query = FakeTileQuery(lambda options: 100)
+    assert _shrink_to_budget(3000, 1000, query, False, True) == (b"x" * 100, "simplify_4px")
+    assert len(query.calls) == 1
+
+
+def test_points_skip_simplification():
+    query = FakeTileQuery(lambda options: 100 if options.get("drop_attributes") else 2000)
+    _, fallback = _shrink_to_budget(3000, 1000, query, is_point_data=True, has_attributes=True)
+    assert fallback == "drop_attributes"
+    assert query.calls == [{"drop_attributes": True}]
+
+
+def test_tables_without_attributes_skip_dropping_them():
+    query = FakeTileQuery(lambda options: 2000)
+    _shrink_to_budget(3000, 1000, query, is_point_data=True, has_attributes=False)
+    assert query.calls[0] == {"sample_percent": 50}
+
+
+def test_steps_of_a_kind_that_did_not_shrink_are_skipped():
+    # Simplifying does not help (e.g. already simple shapes): no 16px step after 4px
+    query = FakeTileQuery(lambda options: 20 * options.get("sample_percent", 150))
+    tile_data, fallback = _shrink_to_budget(3000, 400, query, is_point_data=False, has_attributes=False)
+    assert [list(options) for options in query.calls] == [
+        ["simplify_pixels"],
+        ["simplify_pixels", "sample_percent"],
+        ["simplify_pixels", "sample_percent"],
+        ["simplify_pixels", "sample_percent"],
+    ]
+    assert [options["sample_percent"] for options in query.calls[1:]] == [50, 25, 10]
+    assert fallback == "sample_10"
+
+
+def test_over_budget_when_nothing_fits():
+    query = FakeTileQuery(lambda options: 2000 - 100 * len(query.calls))
+    tile_data, fallback = _shrink_to_budget(3000, 1000, query, is_point_data=False, has_attributes=True)
+    assert fallback == "sample_10_over_budget"
+    assert len(query.calls) == 6
+    assert len(tile_data) == 1400
@@ -0,0 +1,112 @@
+"""
+SQL builders for MVT tile queries on polygon/line tables.
+
+Shared by tiling_operations (tile serving) and simplify_geometries.py (tile size
+estimates in the simplification report), so both measure exactly the same query.
+Like geometry_pyramid, this module only depends on the standard library.
+"""
+
+from typing import Optional, List
+
+# Per-feature size column (bounding-box diagonal in meters) added by simplify_geometries.py
+FEATURE_SIZE_COLUMN = "geom_size"
+
+# Columns of a layers table that tiles may read: all but the level columns
+# simplify_geometries.py is still populating (comment starting with
+# geometry_pyramid.POPULATING_COMMENT_PREFIX, passed as :populating_prefix)
+SERVED_COLUMNS_SQL = """
+    SELECT a.attname
+    FROM pg_attribute a
+    WHERE a.attrelid = to_regclass('layers.' || quote_ident(:table))
+      AND a.attnum > 0 AND NOT a.attisdropped
+      AND NOT coalesce(starts_with(col_description(a.attrelid, a.attnum), :populating_prefix), false)
+"""
+
+def is_derived_column(column_name: str) -> bool:
+    """
+    Pre-simplified geometries (of any pyramid, including older ones) and geom_size
+    are added by simplify_geometries.py and are never sent as tile attributes.
+    """
+    return column_name == FEATURE_SIZE_COLUMN or column_name.startswith("geom_z_")
+
+def sample_filter_sql(key_sql: str, sample_percent: Optional[float]) -> str:
+    """
+    " AND <predicate>" keeping roughly `sample_percent` % of the rows, chosen by a
+    hash of `key_sql`. It sits next to the spatial filter, so only the rows the
+    index returns for the tile are thinned (TABLESAMPLE would scan the whole table).
+    A row is kept or dropped in every tile alike, and the rows kept at a lower
+    percentage are a subset of those kept at a higher one.
+    """
+    if sample_percent is None:
+        return ""
+    return f"""
+                          AND (hashtext({key_sql}) & 2147483647) % 100 < {float(sample_percent)}"""
+
+def build_polygon_query(table: str, level_column: str, attributes_list: List[str],
+                        min_feature_size: Optional[float] = None,
+                        small_as_points: bool = False,
+                        simplify_tolerance: Optional[float] = None,
+                        sample_percent: Optional[float] = None,
+                        filter_sql: Optional[str] = None,
+                        geom_column: Optional[str] = None) -> str:
+    """
+    Build a PostGIS query for polygon/line data using the pre-simplified column for the zoom level.
+
+    When `min_feature_size` is given, features whose stored geom_size is below it are
+    dropped, or replaced by a point on their surface if `small_as_points` is set.
+    The query then expects a :min_feature_size parameter. The point is taken from the
+    original `geom_column` (default: `level_column`), since coarse levels are snapped
+    to a grid and sub-grid features are EMPTY there.
+
+    `simplify_tolerance` (meters) and `sample_percent` are only used by the tile
+    byte-budget fallbacks to thin out oversized tiles.
+
+    `filter_sql` is an extra predicate on the `tbl` alias (see filter_sql.compile_filter),
+    whose bind parameters the caller passes along with the query.
+    """
+    # Tables are already in 3857 projection, no ST_Transform needed
+    attributes_sql = ', '.join(f'"{attr}"' for attr in attributes_list) if attributes_list else "NULL"
+    geom_column = geom_column or level_column
+    geometry_sql = f"tbl.{level_column}"
+    # Filter on the same column so its spatial index is used
+    bounds_filter_sql = f"ST_Intersects(tbl.{level_column}, bounds.geom)"
+    size_filter_sql = ""
+    if min_feature_size is not None:
+        if small_as_points:
+            geometry_sql = f"""CASE
+                                    WHEN tbl.{FEATURE_SIZE_COLUMN} < :min_feature_size
+                                    THEN ST_PointOnSurface(tbl.{geom_column})
+                                    ELSE tbl.{level_column}
+                                END"""
+            if geom_column != level_column:
+                # Small features are found through the original geometry's index
+                bounds_filter_sql = f"""({bounds_filter_sql}
+                                 OR (tbl.{FEATURE_SIZE_COLUMN} < :min_feature_size
+                                     AND ST_Intersects(tbl.{geom_column}, bounds.geom)))"""
+        else:
+            # Rows without a stored size (added after simplification) are kept
+            size_filter_sql = f"""
+                          AND (tbl.{FEATURE_SIZE_COLUMN} IS NULL OR tbl.{FEATURE_SIZE_COLUMN} >= :min_feature_size)"""
+    layer_filter_sql = f"""
+                          AND ({filter_sql})""" if filter_sql else ""
+    if simplify_tolerance is not None:
+        geometry_sql = f"ST_Simplify({geometry_sql}, {float(simplify_tolerance)}, true)"
+
+    return f"""
+        WITH bounds AS (SELECT ST_TileEnvelope(:z, :x, :y) AS geom),
+            features_data AS (
+                SELECT
+                    ST_AsMVTGeom(
+                        -- Pre-simplified geometry for this zoom level
+                        {geometry_sql},
+                        bounds.geom,
+                        4096,
+                        256,
+                        true
+                    ) AS geom,
+                    {attributes_sql}
+                FROM layers.{table} tbl, bounds
+                WHERE {bounds_filter_sql}{size_filter_sql}{layer_filter_sql}{sample_filter_sql("tbl.ctid::text", sample_percent)}
+            )
+        SELECT ST_AsMVT(features_data.*, 'features') FROM features_data
+    """
@@ -1,17 +1,40 @@
 # app/db_operations.py
 
+import logging
 import os
 import shutil # Used for clearing cache in example usage, remove if not needed in production
 import time   # Used for os.utime and time.sleep in mock/demo
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from sqlalchemy import create_engine, text, inspect, MetaData, Table, select, and_, func, distinct, column
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
 from sqlalchemy.engine import Engine
 from .config import settings
 import mercantile
-from typing import Dict, List, Optional, Tuple
-from .database import engine, get_db_connection, SessionLocal
-from .models import LayerFilter
+from typing import Callable, Dict, List, Optional, Tuple
+from .database import engine, get_db_connection
+from . import feature_store, layer_filter_cache, metrics
+from .geometry_pyramid import (
+    POPULATING_COMMENT_PREFIX,
+    build_pyramid,
+    level_for_zoom,
+    meters_per_pixel,
+    min_feature_size_for_zoom,
+    parse_zoom_breaks,
+    populated_level_comment,
+    populating_level_comment,
+)
+from .filter_sql import UnsupportedFilterError, compile_filter, evaluate_filter, filter_hash
+from .server_timing import ServerTiming
+from .tile_queries import (
+    FEATURE_SIZE_COLUMN,
+    SERVED_COLUMNS_SQL,
+    build_polygon_query,
+    is_derived_column,
+    sample_filter_sql,
+)
 
 """
 MVT Tiling Operations with Optimized Point Clustering
@@ -19,10 +42,11 @@ MVT Tiling Operations with Optimized Point Clustering
 This module provides MVT (Mapbox Vector Tile) generation with intelligent handling of different geometry types:
 
 1. **Polygon/LineString Data**: Uses pre-simplified geometries at different zoom levels for performance
-   - Zoom 0-3: Heavily simplified (geom_z_0_3) 
-   - Zoom 4-6: Medium simplified (geom_z_3_6)
-   - Zoom 7-9: Lightly simplified (geom_z_6_10)
-   - Zoom 10+: Original geometry
+   - One geom_z_<from>_<to> column per zoom band of the simplification pyramid
+     (settings.SIMPLIFY_ZOOM_BREAKS, default 0-3, 4-6, 7-10, 11-12, 13-14),
+     simplified to the pixel size of the band (see `geometry_pyramid`)
+   - Zooms above the last band: Original geometry
+   Small tables (see `feature_store`) are loaded into memory once and tiled in-process.
 
 2. **Point Data**: Uses intelligent clustering to reduce visual clutter and improve performance
    - Zoom 0-6: Heavy clustering (64px grid, ~100m tolerance)
@@ -36,6 +60,8 @@ Each cluster includes a 'point_count' attribute showing how many original points
 No coordinate transformations are performed during tile generation.
 """
 
+logger = logging.getLogger(__name__)
+
 # --- LOCAL FILE SYSTEM CACHE CONFIGURATION ---
 CACHE_DIR = "local_tile_cache"
 CACHE_LIMIT_GB = 10
@@ -60,7 +86,7 @@ def _get_dir_size(path: str) -> int:
                 try:
                     total_size += os.path.getsize(fp)
                 except OSError as e:
-                    print(f"Warning: Could not get size of {fp}: {e}") # Consider using logging
+                    logger.warning("Could not get size of %s: %s", fp, e)
     return total_size
 
 def _get_all_files(directory: str) -> List[str]:
@@ -81,12 +107,13 @@ def _clean_cache():
     until the total cache size is below the target cleanup threshold.
     """
     current_size = _get_dir_size(CACHE_DIR)
-    print(f"Current cache size: {current_size / (1024*1024):.2f} MB / {CACHE_LIMIT_GB} GB")
+    metrics.TILE_CACHE_SIZE_BYTES.set(current_size)
+    logger.debug("Current cache size: %.2f MB / %s GB", current_size / (1024*1024), CACHE_LIMIT_GB)
 
     if current_size <= CACHE_LIMIT_BYTES:
         return # No cleaning needed if under the hard limit
 
-    print(f"Cache size exceeds {CACHE_LIMIT_GB} GB. Starting cleanup...")
+    logger.info("Cache size exceeds %s GB. Starting cleanup...", CACHE_LIMIT_GB)
 
     # Get all files with their access times
     files_with_atime = []
@@ -98,7 +125,7 @@ def _clean_cache():
             atime = os.path.getatime(f_path)
             files_with_atime.append((f_path, atime))
         except OSError as e:
-            print(f"Warning: Could not get access time for {f_path}: {e}") # Consider using logging
+            logger.warning("Could not get access time for %s: %s", f_path, e)
             continue
 
     # Sort files by access time (oldest first)
@@ -117,31 +144,39 @@ def _clean_cache():
             os.remove(f_path)
             current_size -= file_size
             bytes_removed += file_size
-            print(f"  Deleted: {f_path} (Size: {file_size / (1024*1024):.2f} MB)") # Consider using logging
+            metrics.TILE_CACHE_EVICTIONS.inc()
+            metrics.TILE_CACHE_EVICTED_BYTES.inc(file_size)
+            logger.debug("Deleted %s (%d bytes)", f_path, file_size)
         except OSError as e:
-            print(f"Error deleting file {f_path}: {e}") # Consider using logging
+            logger.warning("Error deleting file %s: %s", f_path, e)
             pass # Keep going, try next file
 
-    print(f"Cleanup finished. Removed {bytes_removed / (1024*1024):.2f} MB.") # Consider using logging
-    print(f"New cache size: {current_size / (1024*1024):.2f} MB / {CACHE_LIMIT_GB} GB") # Consider using logging
+    logger.info(
+        "Cache cleanup removed %.2f MB, new size %.2f MB / %s GB",
+        bytes_removed / (1024*1024), current_size / (1024*1024), CACHE_LIMIT_GB,
+        extra={"event": "tile_cache_cleanup", "bytes_removed": bytes_removed, "cache_bytes": current_size},
+    )
+    metrics.TILE_CACHE_SIZE_BYTES.set(current_size)
 
 
 # --- ORIGINAL DB HELPER FUNCTIONS (UNCHANGED) ---
 
-def get_geometry_column(table: str) -> Optional[str]:
-    with get_db_connection() as conn:
-        result = conn.execute(
-            text("""
-                SELECT f_geometry_column
-                FROM geometry_columns
-                WHERE f_table_schema = 'layers' AND f_table_name = :table
-            """),
-            {"table": table}
-        ).fetchone()
-        return result[0] if result else None
+def get_geometry_column(table: str, conn=None) -> Optional[str]:
+    if conn is None:
+        with get_db_connection() as conn:
+            return get_geometry_column(table, conn)
+    result = conn.execute(
+        text("""
+            SELECT f_geometry_column
+            FROM geometry_columns
+            WHERE f_table_schema = 'layers' AND f_table_name = :table
+        """),
+        {"table": table}
+    ).fetchone()
+    return result[0] if result else None
 
 def get_tables() -> List[str]:
-    with engine.connect() as conn:
+    with get_db_connection() as conn:
         tables = conn.execute(text("""
             SELECT DISTINCT f_table_name
             FROM public.geometry_columns
@@ -149,23 +184,139 @@ def get_tables() -> List[str]:
         """)).fetchall()
         return [row[0] for row in tables]
 
+# Simplification pyramid, shared with simplify_geometries.py
+SIMPLIFICATION_LEVELS = build_pyramid(
+    parse_zoom_breaks(settings.SIMPLIFY_ZOOM_BREAKS), settings.SIMPLIFY_PIXEL_TOLERANCE
+)
+SIMPLIFIED_GEOMETRY_COLUMNS = [level.column for level in SIMPLIFICATION_LEVELS]
+
+def zoom_band(z: int) -> str:
+    """Label of the simplification band serving zoom z, e.g. "4-6" ("15+" above the last band)."""
+    for level in SIMPLIFICATION_LEVELS:
+        if level.min_zoom <= z <= level.max_zoom:
+            return f"{level.min_zoom}-{level.max_zoom}"
+    return f"{SIMPLIFICATION_LEVELS[-1].max_zoom + 1}+" if SIMPLIFICATION_LEVELS else "all"
+
+def _min_feature_size(z: int) -> Optional[float]:
+    """Minimum feature size (meters) drawn at zoom z with the configured sub-pixel filtering."""
+    return min_feature_size_for_zoom(z, settings.TILE_MIN_FEATURE_MAX_ZOOM, settings.TILE_MIN_FEATURE_PIXELS)
+
+def _geometry_column_for_zoom(z: int, geom_column: str, served_columns: List[str]) -> str:
+    """
+    Pick the pre-simplified geometry column matching a zoom level.
+    Falls back to a more detailed level, then to the original geometry,
+    when the table has not been (fully) simplified with the current pyramid.
+    """
+    level = level_for_zoom(SIMPLIFICATION_LEVELS, z, served_columns)
+    return level.column if level else geom_column
+
+def _get_served_columns(conn, table: str) -> List[str]:
+    """Columns of a layers table tiles may read: all but levels simplify_geometries.py is still filling."""
+    result = conn.execute(
+        text(SERVED_COLUMNS_SQL), {"table": table, "populating_prefix": POPULATING_COMMENT_PREFIX}
+    ).fetchall()
+    return [row[0] for row in result]
+
+# Session advisory lock held while checking legacy levels, so one app process does it
+LEGACY_LEVELS_LOCK_KEY = 730300
+
+def mark_legacy_levels():
+    """
+    One-off migration for tables simplified before simplify_geometries.py marked
+    its level columns. Each unmarked level column of the current pyramid is
+    checked once: it is marked as populated when every row with a geometry has a
+    value, otherwise as populating, so tiles stop reading it until the script has
+    filled it. Unmarked columns are served as before while the check runs.
+
+    Runs in a background thread at startup, on the primary (comments cannot be
+    written on a replica) and without statement_timeout, as it scans each table.
+    """
+    levels_by_column = {level.column: level for level in SIMPLIFICATION_LEVELS}
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": LEGACY_LEVELS_LOCK_KEY}).scalar():
+                return  # Another app process is checking them
+            try:
+                conn.execute(text("SET statement_timeout = 0"))
+                rows = conn.execute(text("""
+                    SELECT c.relname, a.attname
+                    FROM pg_attribute a
+                    JOIN pg_class c ON c.oid = a.attrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = 'layers' AND c.relkind = 'r'
+                      AND a.attname = ANY(:columns) AND NOT a.attisdropped
+                      AND col_description(a.attrelid, a.attnum) IS NULL
+                    ORDER BY c.relname, a.attnum
+                """), {"columns": list(levels_by_column)}).fetchall()
+                unmarked: Dict[str, List[str]] = {}
+                for table, column_name in rows:
+                    unmarked.setdefault(table, []).append(column_name)
+
+                for table, columns in unmarked.items():
+                    geom_column = get_geometry_column(table, conn)
+                    if not geom_column:
+                        continue
+                    incomplete = conn.execute(text(f"""
+                        SELECT {', '.join(f'coalesce(bool_or({col} IS NULL), false)' for col in columns)}
+                        FROM layers.{table}
+                        WHERE {geom_column} IS NOT NULL
+                    """)).fetchone()
+                    for column_name, is_incomplete in zip(columns, incomplete):
+                        level = levels_by_column[column_name]
+                        comment = populating_level_comment(level) if is_incomplete else populated_level_comment(level)
+                        conn.execute(
+                            text(f"COMMENT ON COLUMN layers.{table}.{column_name} IS :comment"), {"comment": comment}
+                        )
+                    logger.info(
+                        "Checked legacy levels of %s: %s", table,
+                        ", ".join(f"{col}={'incomplete' if bad else 'populated'}" for col, bad in zip(columns, incomplete)),
+                        extra={"event": "legacy_levels_marked", "table": table},
+                    )
+            finally:
+                conn.execute(text("RESET statement_timeout"))
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LEGACY_LEVELS_LOCK_KEY})
+    except SQLAlchemyError as e:
+        logger.warning("Could not check the simplification levels of existing tables: %s", e)
+
+def _get_table_column_types(conn, table: str) -> Dict[str, str]:
+    """Column name -> information_schema data_type of a layers table, in column order."""
+    result = conn.execute(text("""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = 'layers' AND table_name = :table
+        ORDER BY ordinal_position
+    """), {"table": table}).fetchall()
+    return {row[0]: row[1] for row in result}
+
+def _get_tile_filter(table: str) -> Optional[object]:
+    """The layer_filters filter applied server-side to the tiles of a table, if any."""
+    if not settings.TILE_SERVER_SIDE_FILTERS:
+        return None
+    try:
+        return layer_filter_cache.get_filter(table)
+    except Exception as e:
+        logger.warning("Could not load the layer filter of %s, serving unfiltered tiles: %s", table, e)
+        return None
+
 def get_tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
     tile = mercantile.Tile(x, y, z)
     bounds = mercantile.bounds(tile)
     return bounds.west, bounds.south, bounds.east, bounds.north
 
-def get_geometry_type_from_db(table: str) -> Optional[str]:
-    geom_column = get_geometry_column(table)
+def get_geometry_type_from_db(table: str, conn=None) -> Optional[str]:
+    if conn is None:
+        with get_db_connection() as conn:
+            return get_geometry_type_from_db(table, conn)
+    geom_column = get_geometry_column(table, conn)
     if not geom_column:
         return None
-    with engine.connect() as conn:
-        result = conn.execute(text(f"""
-            SELECT DISTINCT ST_GeometryType({geom_column}) AS geom_type
-            FROM layers.{table}
-            WHERE {geom_column} IS NOT NULL
-            LIMIT 1
-        """)).fetchone()
-        return result[0] if result else None
+    result = conn.execute(text(f"""
+        SELECT DISTINCT ST_GeometryType({geom_column}) AS geom_type
+        FROM layers.{table}
+        WHERE {geom_column} IS NOT NULL
+        LIMIT 1
+    """)).fetchone()
+    return result[0] if result else None
 
 def latlon_to_tile_coords(lat: float, lon: float, zoom: int):
     """
@@ -174,7 +325,9 @@ def latlon_to_tile_coords(lat: float, lon: float, zoom: int):
     tile = mercantile.tile(lon, lat, zoom)
     return {"z": tile.z, "x": tile.x, "y": tile.y}
 
-def _build_point_clustering_query(table: str, geom_column: str, attributes_list: List[str], z: int) -> str:
+def _build_point_clustering_query(table: str, geom_column: str, attributes_list: List[str], z: int,
+                                  sample_percent: Optional[float] = None,
+                                  filter_sql: Optional[str] = None) -> str:
     """
     Build a PostGIS query for point clustering based on zoom level.
     
@@ -182,7 +335,13 @@ def _build_point_clustering_query(table: str, geom_column: str, attributes_list:
     - Zoom 0-6: Heavy clustering (large grid)
     - Zoom 7-12: Medium clustering (smaller grid) 
     - Zoom 13+: Individual points (no clustering)
+
+    `filter_sql` is an extra predicate on the `tbl` alias (the layer's server-side filter).
+
+    `sample_percent` (tile byte-budget fallbacks) keeps a share of the clusters,
+    whose point_count stays exact, or of the individual points at high zooms.
     """
+    layer_filter_sql = f"\n                      AND ({filter_sql})" if filter_sql else ""
     
     # Define clustering grid size based on zoom level (in pixels)
     if z <= 6:
@@ -230,7 +389,7 @@ def _build_point_clustering_query(table: str, geom_column: str, attributes_list:
                         {attributes_sql}
                     FROM layers.{table} tbl, bounds
                     WHERE ST_Intersects(tbl.{geom_column}, bounds.geom)
-                      AND tbl.{geom_column} IS NOT NULL
+                      AND tbl.{geom_column} IS NOT NULL{layer_filter_sql}
                     GROUP BY ST_SnapToGrid(tbl.{geom_column}, {cluster_tolerance})
                     HAVING COUNT(*) > 0
                 ),
@@ -247,7 +406,7 @@ def _build_point_clustering_query(table: str, geom_column: str, attributes_list:
                     FROM clustered_points cp
                     CROSS JOIN bounds
                     WHERE cp.cluster_geom IS NOT NULL
-                      AND ST_Intersects(cp.cluster_geom, bounds.geom)
+                      AND ST_Intersects(cp.cluster_geom, bounds.geom){sample_filter_sql("cp.cluster_geom::text", sample_percent)}
                 )
             SELECT ST_AsMVT(features_data.*, 'features') FROM features_data
         """
@@ -268,131 +427,416 @@ def _build_point_clustering_query(table: str, geom_column: str, attributes_list:
                         {attributes_sql}
                     FROM layers.{table} tbl, bounds
                     WHERE ST_Intersects(tbl.{geom_column}, bounds.geom)
-                      AND tbl.{geom_column} IS NOT NULL
+                      AND tbl.{geom_column} IS NOT NULL{layer_filter_sql}{sample_filter_sql("tbl.ctid::text", sample_percent)}
                 )
             SELECT ST_AsMVT(features_data.*, 'features') FROM features_data
         """
     
     return query
 
+# --- TILE BYTE BUDGET ---
+
+# Fallbacks tried in order when a tile exceeds its byte budget. Each step keeps the
+# options of the previous steps, so thinning gets progressively stronger.
+# Simplification steps are expressed in screen pixels at the tile's zoom level.
+# Steps that cannot change the tile are skipped: simplification of points,
+# dropping attributes of a table without any, and stronger steps of a kind whose
+# previous step did not make the tile smaller.
+TILE_BUDGET_FALLBACKS = [
+    ("simplify_4px", {"simplify_pixels": 4}),
+    ("simplify_16px", {"simplify_pixels": 16}),
+    ("drop_attributes", {"drop_attributes": True}),
+    ("sample_50", {"sample_percent": 50}),
+    ("sample_25", {"sample_percent": 25}),
+    ("sample_10", {"sample_percent": 10}),
+]
+
+# Most recent tiles that needed a fallback (newest last), for inspection/debugging
+_recent_budget_fallbacks = deque(maxlen=1000)
+
+def _shrink_to_budget(size: int, byte_budget: int, run_tile_query: Callable[..., Optional[bytes]],
+                      is_point_data: bool, has_attributes: bool) -> Tuple[Optional[bytes], str]:
+    """
+    Regenerate a tile of `size` bytes with the TILE_BUDGET_FALLBACKS until it fits
+    `byte_budget`. `run_tile_query(**options)` returns the tile for the accumulated
+    options. Returns the last tile and its step ("<step>_over_budget" if none fit).
+    """
+    previous_size = size
+    options = {}
+    exhausted = set()  # Options whose last step did not shrink the tile
+    tile_data, fallback = None, None
+    for step, step_options in TILE_BUDGET_FALLBACKS:
+        if is_point_data and "simplify_pixels" in step_options:
+            continue  # Simplification does not shrink points
+        if "drop_attributes" in step_options and not has_attributes:
+            continue  # Nothing to drop
+        if exhausted.intersection(step_options):
+            continue
+        options.update(step_options)
+        fallback = step
+        tile_data = run_tile_query(**options)
+        size = len(tile_data) if tile_data else 0
+        if size <= byte_budget:
+            break
+        if size >= previous_size:
+            exhausted.update(step_options)
+        previous_size = size
+    else:
+        fallback = f"{fallback}_over_budget"  # Smallest tile we could produce
+    return tile_data, fallback
+
+def get_tile_byte_budget(table: str) -> int:
+    """Maximum MVT size in bytes for a table (0 disables the budget)."""
+    return settings.TILE_MAX_BYTES_PER_LAYER.get(table, settings.TILE_MAX_BYTES)
+
+def get_recent_budget_fallbacks() -> List[Dict]:
+    """Tiles that exceeded their byte budget recently and the fallback used to shrink them."""
+    return list(_recent_budget_fallbacks)
+
+# --- TILE EXECUTOR AND CANCELLATION ---
+
+# SQLSTATE of a query stopped by statement_timeout or a cancel request
+QUERY_CANCELED_SQLSTATE = "57014"
+
+# Tiles are generated here rather than on the event loop or the shared threadpool
+_tile_executor = ThreadPoolExecutor(max_workers=settings.TILE_WORKERS, thread_name_prefix="tile")
+
+class TileCancelledError(Exception):
+    """The client of the tile went away and its generation was cancelled."""
+
+class TileTimeoutError(Exception):
+    """A tile query ran longer than the statement_timeout of its zoom level."""
+
+class TileCancellation:
+    """
+    Lets the request cancel the database query of a tile generated on another thread.
+    The DBAPI connection is only registered while the tile holds it, so a late
+    cancel() can never hit the query of the next user of the pooled connection.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._dbapi_connection = None
+        self._lock = threading.Lock()
+
+    def attach(self, dbapi_connection):
+        with self._lock:
+            if self.cancelled:
+                raise TileCancelledError()
+            self._dbapi_connection = dbapi_connection
+
+    def detach(self):
+        with self._lock:
+            self._dbapi_connection = None
+
+    def check(self):
+        if self.cancelled:
+            raise TileCancelledError()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._dbapi_connection is not None:
+                try:
+                    # Asks the server to cancel the running query (like pg_cancel_backend)
+                    self._dbapi_connection.cancel()
+                except Exception as e:
+                    logger.warning("Error cancelling tile query: %s", e)
+
+def get_tile_statement_timeout_ms(z: int) -> int:
+    """statement_timeout for the queries of a tile at zoom z (see TILE_STATEMENT_TIMEOUT_MS_BY_ZOOM)."""
+    for max_zoom, timeout_ms in sorted(
+        (int(max_zoom), int(timeout_ms)) for max_zoom, timeout_ms in settings.TILE_STATEMENT_TIMEOUT_MS_BY_ZOOM.items()
+    ):
+        if z <= max_zoom:
+            return timeout_ms
+    return settings.TILE_DB_STATEMENT_TIMEOUT_MS
+
 # --- ACTUAL DB FETCH FUNCTION (RENAMED TO BE PRIVATE) ---
-def _get_mvt_tile_from_db_actual(table: str, z: int, x: int, y: int) -> Optional[bytes]:
+def _get_mvt_tile_from_db_actual(table: str, z: int, x: int, y: int,
+                                 stats: Optional[Dict] = None,
+                                 layer_filter: Optional[object] = None,
+                                 cancellation: Optional[TileCancellation] = None,
+                                 timing: Optional[ServerTiming] = None) -> Optional[bytes]:
     """
     Internal function to fetch and generate an MVT tile directly from the database.
     Handles both polygon/line geometries (with simplification) and point geometries (with clustering).
+
+    `layer_filter` is the table's Mapbox filter from layer_filters: when it can be
+    translated (see `filter_sql`), features it hides are left out of the tile.
+
+    Tiles larger than the table's byte budget are regenerated with the
+    TILE_BUDGET_FALLBACKS until they fit; the fallback used is stored in
+    `stats["fallback"]` when a `stats` dict is passed.
+
+    All queries of one tile run on a single connection of the tile pool, with the
+    statement_timeout of zoom z. Passing a `cancellation` lets another thread
+    cancel them (TileCancelledError is then raised). Phases are added to `timing`.
     """
-    geom_column = get_geometry_column(table)
+    byte_budget = get_tile_byte_budget(table)
+    timing = timing if timing is not None else ServerTiming()
+
+    with timing.measure("connect"):
+        conn = get_db_connection()
+    with conn:
+        if cancellation is not None:
+            cancellation.attach(conn.connection.dbapi_connection)
+        try:
+            return _generate_tile(conn, table, z, x, y, stats, layer_filter, cancellation, timing, byte_budget)
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) != QUERY_CANCELED_SQLSTATE:
+                raise
+            if cancellation is not None and cancellation.cancelled:
+                raise TileCancelledError() from e
+            raise TileTimeoutError(
+                f"Tile {table}/{z}/{x}/{y} exceeded its {get_tile_statement_timeout_ms(z)} ms statement timeout"
+            ) from e
+        finally:
+            if cancellation is not None:
+                cancellation.detach()
+
+def _generate_tile(conn, table: str, z: int, x: int, y: int, stats: Optional[Dict],
+                   layer_filter: Optional[object], cancellation: Optional[TileCancellation],
+                   timing: ServerTiming, byte_budget: int) -> Optional[bytes]:
+    """Body of `_get_mvt_tile_from_db_actual`, running on its connection."""
+    metadata_start = time.perf_counter()
+    # Local to the transaction, so it ends with the tile and never leaks into the pool
+    conn.execute(
+        text("SELECT set_config('statement_timeout', :timeout, true)"),
+        {"timeout": str(get_tile_statement_timeout_ms(z))},
+    )
+
+    geom_column = get_geometry_column(table, conn)
     if not geom_column:
         raise ValueError("Geometry column not found.")
-    
+    if stats is not None:
+        stats["table_found"] = True  # Safe to use the table name as a metric label
+
     # Check if this is point data
-    geom_type = get_geometry_type_from_db(table)
+    geom_type = get_geometry_type_from_db(table, conn)
     is_point_data = geom_type and 'POINT' in geom_type.upper()
-    
-    with engine.connect() as conn:
-        attributes = conn.execute(text("""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema = 'layers' AND table_name = :table AND column_name != :geom_column
-        """), {"table": table, "geom_column": geom_column}).fetchall()
-        attributes_list = [row[0] for row in attributes]
-        
+
+    column_types = _get_table_column_types(conn, table)
+    table_columns = list(column_types)
+    attributes_list = [
+        col for col in table_columns
+        if col != geom_column and not is_derived_column(col)
+    ]
+    # Levels still being populated (e.g. after a pyramid change) are not served
+    served_columns = [] if is_point_data else _get_served_columns(conn, table)
+    level_column = _geometry_column_for_zoom(z, geom_column, served_columns)
+
+    min_feature_size = None
+    if not is_point_data and FEATURE_SIZE_COLUMN in table_columns:
+        min_feature_size = _min_feature_size(z)
+
+    filter_sql, filter_params = None, {}
+    if layer_filter is not None:
+        try:
+            filter_sql, filter_params = compile_filter(layer_filter, z, column_types, column_prefix="tbl.")
+        except UnsupportedFilterError as e:
+            logger.debug("Layer filter of %s is applied by the client only at zoom %s: %s", table, z, e)
+    timing.add("metadata", time.perf_counter() - metadata_start)
+
+    def run_tile_query(simplify_pixels=None, drop_attributes=False, sample_percent=None):
+        if cancellation is not None:
+            cancellation.check()  # Cancelled between two queries
+        params = {"z": z, "x": x, "y": y, **filter_params}
+        tile_attributes = [] if drop_attributes else attributes_list
         if is_point_data:
             # Point clustering query
-            query = _build_point_clustering_query(table, geom_column, attributes_list, z)
+            query = _build_point_clustering_query(
+                table, geom_column, tile_attributes, z, sample_percent, filter_sql=filter_sql
+            )
         else:
             # Polygon/Line simplification query
-            # Tables are already in 3857 projection, no ST_Transform needed
-            attributes_sql = ', '.join(f'"{attr}"' for attr in attributes_list) if attributes_list else "NULL"
-            query = f"""
-                WITH bounds AS (SELECT ST_TileEnvelope(:z, :x, :y) AS geom),
-                    features_data AS (
-                        SELECT
-                            ST_AsMVTGeom(
-                                -- Select the appropriate pre-simplified geometry based on zoom level
-                                CASE
-                                    WHEN :z <= 3 THEN tbl.geom_z_0_3    -- 1000m tolerance
-                                    WHEN :z > 3 AND :z <= 6 THEN tbl.geom_z_3_6   -- 500m tolerance
-                                    WHEN :z > 6 AND :z <= 10 THEN tbl.geom_z_6_10  -- 250m tolerance
-                                    ELSE tbl.geom -- Use original (high-res) geometry for zoom 11 and above
-                                END,
-                                bounds.geom,
-                                4096,
-                                256,
-                                true
-                            ) AS geom,
-                            {attributes_sql}
-                        FROM layers.{table} tbl, bounds
-                        WHERE ST_Intersects(
-                                -- Ensure the WHERE clause also uses the appropriate pre-simplified geometry
-                                CASE
-                                    WHEN :z <= 3 THEN tbl.geom_z_0_3
-                                    WHEN :z > 3 AND :z <= 6 THEN tbl.geom_z_3_6
-                                    WHEN :z > 6 AND :z <= 10 THEN tbl.geom_z_6_10
-                                    ELSE tbl.geom -- Use original (high-res) geometry for zoom 11 and above
-                                END,
-                                bounds.geom
-                            )
-                    )
-                SELECT ST_AsMVT(features_data.*, 'features') FROM features_data
-            """
-        
-        result = conn.execute(text(query), {"z": z, "x": x, "y": y}).fetchone()
+            simplify_tolerance = simplify_pixels * meters_per_pixel(z) if simplify_pixels else None
+            query = build_polygon_query(
+                table, level_column, tile_attributes, min_feature_size,
+                small_as_points=settings.TILE_SMALL_FEATURES_AS_POINTS,
+                simplify_tolerance=simplify_tolerance,
+                sample_percent=sample_percent,
+                filter_sql=filter_sql,
+                geom_column=geom_column,
+            )
+            if min_feature_size is not None:
+                params["min_feature_size"] = min_feature_size
+        query_start = time.perf_counter()
+        result = conn.execute(text(query), params).fetchone()
+        query_seconds = time.perf_counter() - query_start
+        metrics.TILE_DB_QUERY_SECONDS.labels(table, zoom_band(z)).observe(query_seconds)
+        timing.add("db", query_seconds)
+        if stats is not None:
+            stats["queries"] = stats.get("queries", 0) + 1
         return result[0] if result else None
 
+    tile_data = None
+    if not is_point_data:
+        # Small tables are tiled from memory without touching the database again
+        store_columns = [geom_column] + [col for col in SIMPLIFIED_GEOMETRY_COLUMNS if col in served_columns]
+        with timing.measure("store_load"):
+            store = feature_store.get_table_store(table, store_columns, attributes_list)
+        if store is not None:
+            with timing.measure("encode"):
+                tile_data = feature_store.encode_tile(
+                    store, level_column, z, x, y,
+                    min_feature_size=min_feature_size,
+                    small_as_points=settings.TILE_SMALL_FEATURES_AS_POINTS,
+                    feature_filter=(
+                        (lambda properties: evaluate_filter(layer_filter, z, properties))
+                        if filter_sql is not None else None
+                    ),
+                )
+
+    if stats is not None:
+        stats["source"] = "memory" if tile_data is not None else "db"
+    if tile_data is None:
+        tile_data = run_tile_query()
+
+    if not tile_data or byte_budget <= 0 or len(tile_data) <= byte_budget:
+        return tile_data
+
+    # Over budget: thin the tile out step by step until it fits
+    original_size = len(tile_data)
+    tile_data, fallback = _shrink_to_budget(
+        original_size, byte_budget, run_tile_query, is_point_data, bool(attributes_list)
+    )
+
+    final_size = len(tile_data) if tile_data else 0
+    logger.info(
+        "Tile %s/%s/%s/%s was %d bytes (budget %d), used fallback '%s' -> %d bytes",
+        table, z, x, y, original_size, byte_budget, fallback, final_size,
+        extra={"event": "tile_budget_fallback", "table": table, "z": z, "fallback": fallback},
+    )
+    _recent_budget_fallbacks.append({
+        "tile": f"{table}/{z}/{x}/{y}",
+        "fallback": fallback,
+        "original_bytes": original_size,
+        "bytes": final_size,
+        "budget_bytes": byte_budget,
+    })
+    if stats is not None:
+        stats["fallback"] = fallback
+    return tile_data
+
+def _tile_cache_path(table: str, z: int, x: int, y: int, layer_filter: Optional[object]) -> str:
+    if layer_filter is not None:
+        return os.path.join(CACHE_DIR, table, f"filter_{filter_hash(layer_filter)}", str(z), str(x), f"{y}.mvt")
+    return os.path.join(CACHE_DIR, table, str(z), str(x), f"{y}.mvt")
+
+def is_tile_cached(table: str, z: int, x: int, y: int) -> bool:
+    """Whether get_mvt_tile_from_db would serve this tile from the local disk cache."""
+    return os.path.exists(_tile_cache_path(table, z, x, y, _get_tile_filter(table)))
+
 # --- PUBLIC MVT TILE FETCH FUNCTION WITH CACHING ---
-def get_mvt_tile_from_db(table: str, z: int, x: int, y: int) -> Optional[bytes]:
+def get_mvt_tile_from_db(table: str, z: int, x: int, y: int, stats: Optional[Dict] = None,
+                         cancellation: Optional[TileCancellation] = None,
+                         timing: Optional[ServerTiming] = None) -> Optional[bytes]:
     """
     Fetches an MVT tile, using a local file system cache with a size limit.
     If the tile is not in cache, it generates it from the database and stores it.
+    Tiles shrunk to fit the byte budget are cached as-is; pass `stats` to learn
+    which budget fallback (if any) was used while generating the tile, and where
+    the tile came from (`stats["source"]`: "disk", "memory" or "db").
+    `stats["table_found"]` is set once the table is known to exist.
+    Tiles of tables with a server-side layer filter are cached under a hash of the
+    filter, so editing the filter never serves tiles built with the old one.
+    Raises TileCancelledError if `cancellation` is cancelled while the tile is
+    generated; a tile that completes is always cached.
+    Pass `timing` to collect the duration of each phase (cache I/O, metadata,
+    queries, encoding) for a Server-Timing header.
     """
+    timing = timing if timing is not None else ServerTiming()
+    with timing.measure("metadata"):
+        layer_filter = _get_tile_filter(table)
+
     # Define the cache path for this tile
-    tile_dir = os.path.join(CACHE_DIR, table, str(z), str(x))
-    tile_path = os.path.join(tile_dir, f"{y}.mvt")
+    tile_path = _tile_cache_path(table, z, x, y, layer_filter)
+    tile_dir = os.path.dirname(tile_path)
 
     # 1. Try to fetch from local disk cache
     if os.path.exists(tile_path):
         try:
-            # Update access time to make it "recently used" for LRU eviction
-            os.utime(tile_path, None) 
-            print(f"✅ Served tile {table}/{z}/{x}/{y} from local disk cache.")
-            with open(tile_path, "rb") as f:
-                return f.read()
+            with timing.measure("cache_read"):
+                # Update access time to make it "recently used" for LRU eviction
+                os.utime(tile_path, None)
+                with open(tile_path, "rb") as f:
+                    tile_data = f.read()
+            logger.info(
+                "Served tile %s/%s/%s/%s from local disk cache", table, z, x, y,
+                extra={"event": "tile_cache_hit", "table": table, "z": z},
+            )
+            if stats is not None:
+                stats["source"] = "disk"
+                stats["table_found"] = True
+            return tile_data
         except OSError as e:
-            print(f"Error accessing cached tile {tile_path}: {e}. Regenerating...")
+            logger.warning("Error accessing cached tile %s: %s. Regenerating...", tile_path, e)
             # Fall through to regeneration if cached tile is inaccessible
 
     # 2. Cache miss: Generate from database
-    print(f"Cache miss for tile {table}/{z}/{x}/{y}. Generating from DB...")
-    
+    logger.debug("Cache miss for tile %s/%s/%s/%s", table, z, x, y)
+
     # Ensure the directory structure for this tile exists
     os.makedirs(tile_dir, exist_ok=True)
 
     # Call the actual DB fetching function (renamed private function)
-    tile_data = _get_mvt_tile_from_db_actual(table, z, x, y)
+    tile_data = _get_mvt_tile_from_db_actual(table, z, x, y, stats, layer_filter, cancellation, timing)
 
     # 3. If generated successfully, store in local disk cache and then clean
     if tile_data:
         try:
-            with open(tile_path, "wb") as f:
-                f.write(tile_data)
-            print(f"💾 Stored tile {table}/{z}/{x}/{y} to local disk cache.")
-            
-            # After writing, check and clean cache if needed
-            _clean_cache() 
+            with timing.measure("cache_write"):
+                with open(tile_path, "wb") as f:
+                    f.write(tile_data)
+                logger.info(
+                    "Generated and cached tile %s/%s/%s/%s (%d bytes)", table, z, x, y, len(tile_data),
+                    extra={"event": "tile_generated", "table": table, "z": z, "bytes": len(tile_data)},
+                )
+
+                # After writing, check and clean cache if needed
+                _clean_cache()
         except OSError as e:
-            print(f"Error writing tile {tile_path} to cache: {e}") # Consider logging
+            logger.error("Error writing tile %s to cache: %s", tile_path, e)
             # Do not return None, still return the generated tile even if caching failed
     
     return tile_data
 
+def submit_tile(table: str, z: int, x: int, y: int, stats: Optional[Dict] = None,
+                cancellation: Optional[TileCancellation] = None,
+                timing: Optional[ServerTiming] = None) -> Future:
+    """
+    Run `get_mvt_tile_from_db` on the tile executor (time spent waiting is timed as "queue").
+    The executor's queued and in-flight tiles are counted in the metrics as they move through.
+    """
+    submitted_at = time.perf_counter()
+
+    def run():
+        metrics.TILE_EXECUTOR_QUEUE_DEPTH.dec()
+        metrics.TILE_EXECUTOR_IN_FLIGHT.inc()
+        try:
+            if timing is not None:
+                timing.add("queue", time.perf_counter() - submitted_at)
+            return get_mvt_tile_from_db(table, z, x, y, stats, cancellation, timing)
+        finally:
+            metrics.TILE_EXECUTOR_IN_FLIGHT.dec()
+
+    def on_done(future: Future):
+        if future.cancelled():
+            metrics.TILE_EXECUTOR_QUEUE_DEPTH.dec()  # Cancelled while queued, `run` never started
+
+    metrics.TILE_EXECUTOR_QUEUE_DEPTH.inc()
+    future = _tile_executor.submit(run)
+    future.add_done_callback(on_done)
+    return future
+
 # --- REMAINING ORIGINAL DB HELPER FUNCTIONS (UNCHANGED) ---
 
 def get_table_extent_from_db(table: str) -> Optional[Dict[str, float]]:
     geom_column = get_geometry_column(table)
     if not geom_column:
         return None
-    with engine.connect() as conn:
+    with get_db_connection() as conn:
         result = conn.execute(text(f"""
             SELECT ST_XMin(ST_Extent({geom_column})) as minx,
                    ST_YMin(ST_Extent({geom_column})) as miny,
@@ -414,7 +858,7 @@ def check_srid_from_db(table: str) -> Dict[str, any]:
     geom_column = get_geometry_column(table)
     if not geom_column:
         return {"valid": False, "error": "No geometry column found."}
-    with engine.connect() as conn:
+    with get_db_connection() as conn:
         result = conn.execute(text(f"""
             SELECT ST_SRID({geom_column}) AS srid
             FROM layers.{table}
@@ -432,7 +876,7 @@ def check_srid_from_db(table: str) -> Dict[str, any]:
 
 def get_table_fields_from_db(table: str) -> List[Dict[str, str]]:
     geom_column = get_geometry_column(table)
-    with engine.connect() as conn:
+    with get_db_connection() as conn:
         result = conn.execute(text("""
             SELECT column_name, data_type
             FROM information_schema.columns
@@ -445,35 +889,71 @@ def get_table_fields_from_db(table: str) -> List[Dict[str, str]]:
 
 def get_layer_filter_from_db(layer_name: str) -> Optional[Dict]:
     """
-    Get the filter configuration for a specific layer from the layers_filters table.
+    Get the filter configuration for a specific layer from the layers_filters table
+    (served from the in-memory `layer_filter_cache`).
     Returns the filter dictionary that should be applied to the layer.
     """
-    db = SessionLocal()
     try:
-        print(f"🔍 Looking for filter for layer: '{layer_name}'")
-        layer_filter = db.query(LayerFilter).filter(LayerFilter.layer_name == layer_name).first()
-        
+        layer_filter = layer_filter_cache.get_record(layer_name)
+
         if layer_filter:
-            print(f"✅ Found filter record for layer: '{layer_name}'")
-            if layer_filter.layer_filter:
-                print(f"✅ Filter data exists: {type(layer_filter.layer_filter)}")
+            if layer_filter["layer_filter"]:
+                logger.debug("Found filter for layer '%s'", layer_name)
                 # The layer_filter is stored directly as the filter array
                 # Return it in the expected format with a "filter" key
-                return {"filter": layer_filter.layer_filter}
+                return {"filter": layer_filter["layer_filter"]}
             else:
-                print(f"⚠️ Filter record found but layer_filter is null/empty")
+                logger.debug("Filter record of layer '%s' is null/empty", layer_name)
         else:
-            print(f"❌ No filter record found for layer: '{layer_name}'")
-            # Let's check what layer names exist in the database
-            all_filters = db.query(LayerFilter).all()
-            print(f"📋 Available layer names in database: {[f.layer_name for f in all_filters]}")
-        
+            logger.debug("No filter record for layer '%s'", layer_name)
+
         return None
     except Exception as e:
-        print(f"❌ Error fetching filter for layer {layer_name}: {e}")
+        logger.error("Error fetching filter for layer %s: %s", layer_name, e)
         return None
-    finally:
-        db.close()
+
+def get_layer_filters_for_names(layer_names: List[str]) -> Dict[str, Dict]:
+    """
+    Resolve the filters of several layers at once.
+    Returns {layer_name: {"filter": ...}} for the layers that have a non-empty filter,
+    in the same format as `apply_layer_filter`.
+    """
+    if not layer_names:
+        return {}
+    filters = layer_filter_cache.get_filters_for_names(layer_names)
+    return {name: {"filter": layer_filter} for name, layer_filter in filters.items()}
+
+
+# Sets mapbox_filter of every selected map layer from the first layer_filters row
+# matching its original name (or name), in the {"filter": ...} format of
+# apply_layer_filter. Layers without a (non-empty) filter are cleared.
+REFRESH_MAP_LAYER_FILTERS_SQL = """
+    UPDATE map_layers m
+    SET mapbox_filter = (
+            SELECT json_build_object('filter', f.layer_filter)
+            FROM layer_filters f
+            WHERE f.layer_name = COALESCE(NULLIF(m.original_name, ''), m.name)
+              AND f.layer_filter IS NOT NULL
+              AND f.layer_filter::text NOT IN ('null', '[]', '{}', '""')
+            ORDER BY f.id
+            LIMIT 1
+        ),
+        updated_at = now()
+"""
+
+
+def refresh_map_layer_filters(db, user_id: Optional[int] = None) -> int:
+    """
+    Refresh mapbox_filter of a user's map layers (or of every user's layers when
+    `user_id` is None) with a single UPDATE. Returns the number of layers refreshed.
+    The caller commits.
+    """
+    if user_id is None:
+        result = db.execute(text(REFRESH_MAP_LAYER_FILTERS_SQL))
+    else:
+        result = db.execute(text(REFRESH_MAP_LAYER_FILTERS_SQL + " WHERE m.user_id = :user_id"), {"user_id": user_id})
+    return result.rowcount
+
 
 def apply_layer_filter(layer_name: str, zoom: int = None) -> Optional[Dict]:
     """
@@ -487,17 +967,8 @@ def apply_layer_filter(layer_name: str, zoom: int = None) -> Optional[Dict]:
     Returns:
         Dictionary containing the filter configuration or None if no filter needed
     """
-    print(f"🎯 apply_layer_filter called for layer: '{layer_name}'")
-    
     # Get filter from database based on layer name
-    db_filter = get_layer_filter_from_db(layer_name)
-    
-    if db_filter:
-        print(f"✅ Using database filter for layer: '{layer_name}'")
-        return db_filter
-    
-    print(f"ℹ️ No filter found for layer: '{layer_name}'")
-    return None
+    return get_layer_filter_from_db(layer_name)
 
 
 def get_layer_filter_config(layer_name: str):
@@ -511,24 +982,15 @@ def get_layer_filter_config(layer_name: str):
     Returns:
         Dictionary containing the filter configuration or None if no filter found
     """
-    print(f"🔍 Getting filter config for layer: '{layer_name}'")
-    
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT layer_filter 
-                FROM layer_filters 
-                WHERE layer_name = :layer_name
-            """), {"layer_name": layer_name}).fetchone()
-            
-            if result:
-                filter_config = result[0]
-                print(f"✅ Found filter config for layer '{layer_name}': {filter_config}")
-                return filter_config
-            else:
-                print(f"ℹ️ No filter config found for layer: '{layer_name}'")
-                return None
-                
+        filter_config = layer_filter_cache.get_filter(layer_name)
+        if filter_config is not None:
+            logger.debug("Found filter config for layer '%s'", layer_name)
+            return filter_config
+        else:
+            logger.debug("No filter config found for layer '%s'", layer_name)
+            return None
+
     except Exception as e:
-        print(f"❌ Error getting filter config for layer '{layer_name}': {str(e)}")
+        logger.error("Error getting filter config for layer '%s': %s", layer_name, e)
         raise RuntimeError(f"Failed to get filter config: {str(e)}")
\ No newline at end of file
@@ -1,16 +1,36 @@
 from fastapi import APIRouter, HTTPException, Response, Request, Query, Depends
 from typing import Dict, List
-from . import tiling_operations as tile_ops
+from . import feature_store, metrics, tiling_operations as tile_ops
 from .auth import get_current_user
+from .rate_limit import enforce_rate_limit
+from .server_timing import ServerTiming
 from .database import SessionLocal
 from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
 import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often a tile request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.25
+
+# stats["source"] of get_mvt_tile_from_db -> cache outcome label of the tile metrics
+TILE_SOURCE_OUTCOMES = {"disk": "disk", "memory": "memory", "db": "miss"}
 
 router = APIRouter(
     prefix="/tiling",
     tags=["Tiling"]
 )
 
+def _enforce_tile_miss_limit(request: Request, table: str, z: int, x: int, y: int):
+    """Generating a tile costs a PostGIS query, cached tiles are not rate limited."""
+    if not tile_ops.is_tile_cached(table, z, x, y):
+        enforce_rate_limit(request, "tile_miss")
+
+
 @router.get("/layer-state")
 async def get_layer_state(request: Request, user=Depends(get_current_user)):
     """Update and return the current layer state (for backend logging/display)"""
@@ -61,19 +81,36 @@ async def latlon_to_tile(
 
 @router.get("/mvt/{table}/{z}/{x}/{y}.pbf")
 async def get_mvt_tile(
+    request: Request,
     table: str, 
     z: int,  # Tile zoom level
     x: int,  # Tile X coordinate 
-    y: int   # Tile Y coordinate
+    y: int,  # Tile Y coordinate
+    debug: bool = Query(False, description="Add query and feature counts to the Server-Timing header"),
 ):
+    """
+    Returns an MVT tile. The Server-Timing header breaks its time down into
+    queue, connect, metadata, cache_read/cache_write, db (PostGIS queries),
+    store_load/encode (in-memory feature store) and total.
+    """
+    start_time = time.perf_counter()
+    timing = ServerTiming()
+
+    tile_stats = {}
+
+    def observe(outcome: str, size: int = 0):
+        # Tables not (yet) known to exist are not labelled, so arbitrary names cannot add series
+        metric_table = table if tile_stats.get("table_found") else ""
+        metrics.observe_tile(metric_table, tile_ops.zoom_band(z), outcome, time.perf_counter() - start_time, size)
+
     try:
         # z, x, y are already tile coordinates from the URL path
         tile_z = z
         tile_x = x
         tile_y = y
-        
-        print(f"Server debug: Generating MVT for {table} at tile coordinates z={tile_z}, x={tile_x}, y={tile_y}")
-        
+
+        logger.debug("Tile request %s/%s/%s/%s", table, tile_z, tile_x, tile_y)
+
         # Add validation
         if tile_z < 0 or tile_z > 22:
             raise HTTPException(400, detail=f"Invalid zoom level: {tile_z}. Must be between 0 and 22.")
@@ -82,36 +119,77 @@ async def get_mvt_tile(
         if tile_x < 0 or tile_x > max_coord or tile_y < 0 or tile_y > max_coord:
             raise HTTPException(400, detail=f"Invalid tile coordinates: x={tile_x}, y={tile_y}. Must be between 0 and {max_coord} for zoom {tile_z}.")
 
-        # Check if table exists first
-        print(f"Server debug: Calling get_mvt_tile_from_db with parameters: table={table}, z={tile_z}, x={tile_x}, y={tile_y}")
-        
-        tile_data = tile_ops.get_mvt_tile_from_db(table, tile_z, tile_x, tile_y)
-        
+        # Both the cache lookup (disk) and the limit check (maybe the database) block
+        await run_in_threadpool(_enforce_tile_miss_limit, request, table, tile_z, tile_x, tile_y)
+
+        cancellation = tile_ops.TileCancellation()
+        tile_future = asyncio.wrap_future(
+            tile_ops.submit_tile(table, tile_z, tile_x, tile_y, tile_stats, cancellation, timing)
+        )
+        while True:
+            done, _ = await asyncio.wait({tile_future}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                break
+            if await request.is_disconnected():
+                # Stop the PostGIS query (cancel opens a blocking connection to the server, kept off the
+                # event loop); a tile that still completes is cached by the worker
+                await asyncio.to_thread(cancellation.cancel)
+                tile_future.add_done_callback(lambda future: future.exception())
+                logger.info(
+                    "Client left, cancelled tile %s/%s/%s/%s", table, tile_z, tile_x, tile_y,
+                    extra={"event": "tile_cancelled", "table": table, "z": tile_z},
+                )
+                observe("cancelled")
+                return Response(status_code=499)
+        try:
+            tile_data = tile_future.result()
+        except tile_ops.TileCancelledError:
+            observe("cancelled")
+            return Response(status_code=499)
+        except tile_ops.TileTimeoutError as e:
+            logger.warning("%s", e, extra={"event": "tile_timeout", "table": table, "z": tile_z})
+            observe("timeout")
+            raise HTTPException(503, detail=str(e), headers={"Retry-After": "5", **timing.headers()})
+
+        if debug:
+            timing.describe("source", tile_stats.get("source", "db"))
+            timing.describe("queries", tile_stats.get("queries", 0))
+            timing.describe("bytes", len(tile_data) if tile_data else 0)
+            with timing.measure("debug"):
+                feature_counts = feature_store.count_tile_features(tile_data) if tile_data else {}
+            if feature_counts is not None:
+                timing.describe("features", sum(feature_counts.values()))
+
         if not tile_data:
-            print(f"Server debug: No MVT data generated for layers.{table} tile {tile_z}/{tile_x}/{tile_y}")
-            return Response(b'', media_type="application/x-protobuf")
+            logger.debug("No MVT data for layers.%s tile %s/%s/%s", table, tile_z, tile_x, tile_y)
+            observe("empty")
+            return Response(b'', media_type="application/x-protobuf", headers=timing.headers())
         
-        print(f"Server debug: Successfully generated MVT tile for {table}, size: {len(tile_data)} bytes")
+        observe(TILE_SOURCE_OUTCOMES.get(tile_stats.get("source"), "miss"), len(tile_data))
+        logger.debug("Served MVT tile %s/%s/%s/%s, %d bytes", table, tile_z, tile_x, tile_y, len(tile_data))
+        headers = {
+            "X-MVT-Layers": "features",
+            "Cache-Control": "public, max-age=3600",
+            **timing.headers(),
+        }
+        if tile_stats.get("fallback"):
+            # Tile was thinned out to fit the layer's byte budget
+            headers["X-Tile-Fallback"] = tile_stats["fallback"]
         return Response(
             content=bytes(tile_data),
             media_type="application/x-protobuf",
-            headers={
-                "X-MVT-Layers": "features",
-                "Cache-Control": "public, max-age=3600"
-            }
+            headers=headers
         )
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
     except Exception as e:
         # Catch and log any other exception with full details
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Server error: Detailed traceback for {table} tile {z}/{x}/{y}:")
-        print(error_details)
+        observe("error")
+        logger.exception("Failed to generate tile %s/%s/%s/%s", table, z, x, y, extra={"table": table, "z": z})
         raise HTTPException(500, detail=f"Failed to generate MVT tile for {table}: {str(e)}")
     except RuntimeError as e:
-        print(f"Server error: RuntimeError for {table} tile {z}/{x}/{y}: {str(e)}")
+        logger.error("RuntimeError for tile %s/%s/%s/%s: %s", table, z, x, y, e)
         raise HTTPException(500, detail=f"Failed to generate MVT tile: {str(e)}")
     except Exception as e:
         raise HTTPException(500, detail=f"An unexpected error occurred during tile generation: {str(e)}")